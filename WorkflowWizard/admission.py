@@ -0,0 +1,120 @@
+"""
+Admission control for work that creates user clients.
+
+Each AdmissionController has a concurrency budget. Requests beyond it wait in
+a bounded FIFO queue and are admitted strictly in arrival order; once the
+queue is full, new requests are shed immediately with QueueFullError.
+Waiting requests can be told their queue position, at most once per
+QUEUE_UPDATE_INTERVAL and only when it changed, so status messages are
+edited sparingly.
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Concurrent login steps (connect, send code, sign in) and their queue depth
+LOGIN_CONCURRENCY = int(os.environ.get("LOGIN_CONCURRENCY", 20))
+LOGIN_QUEUE_SIZE = int(os.environ.get("LOGIN_QUEUE_SIZE", 200))
+
+# Concurrent session validations and their queue depth
+VALIDATION_CONCURRENCY = int(os.environ.get("VALIDATION_CONCURRENCY", 10))
+VALIDATION_QUEUE_SIZE = int(os.environ.get("VALIDATION_QUEUE_SIZE", 100))
+
+# Minimum seconds between queue position updates for one waiter
+QUEUE_UPDATE_INTERVAL = float(os.environ.get("QUEUE_UPDATE_INTERVAL", 5))
+
+
+class QueueFullError(Exception):
+    """Raised when a request arrives while the wait queue is full"""
+
+
+class AdmissionController:
+    """Concurrency budget with a bounded, fair wait queue"""
+
+    def __init__(self, name, concurrency, max_queue, update_interval=QUEUE_UPDATE_INTERVAL):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.update_interval = update_interval
+        self.active = 0
+        # Futures of waiting requests, oldest first
+        self._waiters = deque()
+
+    async def acquire(self, on_position=None):
+        """
+        Wait for a slot.
+
+        Args:
+            on_position: Optional coroutine function called with the current
+                queue position (1 = next in line) while waiting
+
+        Raises:
+            QueueFullError: If the wait queue is already full
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            metrics.incr(f'admission_{self.name}_admitted')
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            metrics.incr(f'admission_{self.name}_shed')
+            raise QueueFullError(f"{self.name} queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.incr(f'admission_{self.name}_queued')
+        last_position = None
+        try:
+            while not waiter.done():
+                if on_position is not None:
+                    position = self._waiters.index(waiter) + 1
+                    if position != last_position:
+                        last_position = position
+                        try:
+                            await on_position(position)
+                        except Exception as e:
+                            logger.warning(f"Could not report queue position: {e}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), self.update_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+        metrics.incr(f'admission_{self.name}_admitted')
+
+    def release(self):
+        """Give a slot back, handing it straight to the oldest waiter"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter, so active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        """Current load of this controller"""
+        return {
+            'active': self.active,
+            'concurrency': self.concurrency,
+            'queued': len(self._waiters),
+            'max_queue': self.max_queue
+        }
+
+
+# Shared by every hosted bot: sockets, CPU and API quota are per process
+login_admission = AdmissionController('login', LOGIN_CONCURRENCY, LOGIN_QUEUE_SIZE)
+validation_admission = AdmissionController('validation', VALIDATION_CONCURRENCY, VALIDATION_QUEUE_SIZE)
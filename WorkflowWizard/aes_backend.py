@@ -0,0 +1,275 @@
+"""
+AES-IGE backend selection with a startup self-benchmark.
+
+Every MTProto message of the bot and of each user client is encrypted and
+decrypted with AES-IGE. Telethon uses cryptg if it is installed, then
+OpenSSL's libcrypto through ctypes, and otherwise a pure-Python loop over
+pyaes that is hundreds of times slower, without saying which one it got.
+
+select() checks each available backend against a known answer, times it,
+installs the fastest (or the one named by AES_BACKEND) into Telethon's AES
+class, and warns when only the pure-Python path is left. The result is
+exported as the 'aes_backend' gauge and shown on the status page.
+
+The 'python' backend is the stdlib-only fallback. IGE chains every block to
+the previous one, so blocks cannot be encrypted in parallel, but it unpacks
+and packs the whole buffer in one struct call and runs the AES rounds on
+32-bit words in local variables, instead of pyaes' per-byte lists.
+
+Obfuscated transports use AES-CTR, which Telethon always runs in pyaes;
+this module does not change that.
+"""
+import os
+import time
+import struct
+import logging
+import pyaes
+from telethon.crypto import aes as telethon_aes, libssl
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cryptg
+except ImportError:
+    cryptg = None
+
+# Backend to use: 'auto' for the fastest that passes its check, or a name
+AES_BACKEND = os.environ.get("AES_BACKEND", "auto")
+
+# Bytes per self-benchmark run, and the minimum time spent timing a backend
+BENCHMARK_SIZE = 16 * 1024
+BENCHMARK_SECONDS = 0.05
+
+# Backends that warrant a warning when selected
+SLOW_BACKENDS = ('python',)
+
+# Known answer: AES-256-IGE of bytes(range(64)) with key bytes(range(32))
+# and IV bytes(range(32, 64)), as produced by OpenSSL
+_CHECK_KEY = bytes(range(32))
+_CHECK_IV = bytes(range(32, 64))
+_CHECK_PLAIN = bytes(range(64))
+_CHECK_CIPHER = bytes.fromhex(
+    '42e66e1a756cccf5b27acc47523ad074ee39bf54e3db37bbdf415df6b400fca9'
+    '77f708327c9e9341cc3dc8efd31e76463daa65b1f0d0252f790d77f1824a662c'
+)
+
+_S = pyaes.AES.S
+_Si = pyaes.AES.Si
+_T1, _T2, _T3, _T4 = pyaes.AES.T1, pyaes.AES.T2, pyaes.AES.T3, pyaes.AES.T4
+_T5, _T6, _T7, _T8 = pyaes.AES.T5, pyaes.AES.T6, pyaes.AES.T7, pyaes.AES.T8
+
+# S-boxes pre-shifted into place for the last round
+_S24, _S16, _S8 = [s << 24 for s in _S], [s << 16 for s in _S], [s << 8 for s in _S]
+_Si24, _Si16, _Si8 = [s << 24 for s in _Si], [s << 16 for s in _Si], [s << 8 for s in _Si]
+
+
+def _schedule(key, kind):
+    """pyaes round keys ('_Ke' or '_Kd') as unsigned 32-bit words"""
+    return [[word & 0xFFFFFFFF for word in words] for words in getattr(pyaes.AES(key), kind)]
+
+
+def python_encrypt_ige(plain_text, key, iv):
+    """
+    Encrypt whole 16-byte blocks with AES-IGE in pure Python.
+
+    Args:
+        plain_text: Data whose length is a multiple of 16
+        key: 32-byte AES key
+        iv: 32-byte IGE initialization vector
+
+    Returns:
+        The cipher text
+    """
+    schedule = _schedule(key, '_Ke')
+    k0, middle, last = schedule[0], schedule[1:-1], schedule[-1]
+    count = len(plain_text) // 4
+    words = struct.unpack(f'>{count}I', plain_text)
+    c0, c1, c2, c3, p0, p1, p2, p3 = struct.unpack('>8I', iv)
+    out = [0] * count
+    for j in range(0, count, 4):
+        x0, x1, x2, x3 = words[j:j + 4]
+        t0 = x0 ^ c0 ^ k0[0]
+        t1 = x1 ^ c1 ^ k0[1]
+        t2 = x2 ^ c2 ^ k0[2]
+        t3 = x3 ^ c3 ^ k0[3]
+        for k in middle:
+            t0, t1, t2, t3 = (
+                _T1[t0 >> 24] ^ _T2[(t1 >> 16) & 255] ^ _T3[(t2 >> 8) & 255] ^ _T4[t3 & 255] ^ k[0],
+                _T1[t1 >> 24] ^ _T2[(t2 >> 16) & 255] ^ _T3[(t3 >> 8) & 255] ^ _T4[t0 & 255] ^ k[1],
+                _T1[t2 >> 24] ^ _T2[(t3 >> 16) & 255] ^ _T3[(t0 >> 8) & 255] ^ _T4[t1 & 255] ^ k[2],
+                _T1[t3 >> 24] ^ _T2[(t0 >> 16) & 255] ^ _T3[(t1 >> 8) & 255] ^ _T4[t2 & 255] ^ k[3],
+            )
+        c0 = (_S24[t0 >> 24] | _S16[(t1 >> 16) & 255] | _S8[(t2 >> 8) & 255] | _S[t3 & 255]) ^ last[0] ^ p0
+        c1 = (_S24[t1 >> 24] | _S16[(t2 >> 16) & 255] | _S8[(t3 >> 8) & 255] | _S[t0 & 255]) ^ last[1] ^ p1
+        c2 = (_S24[t2 >> 24] | _S16[(t3 >> 16) & 255] | _S8[(t0 >> 8) & 255] | _S[t1 & 255]) ^ last[2] ^ p2
+        c3 = (_S24[t3 >> 24] | _S16[(t0 >> 16) & 255] | _S8[(t1 >> 8) & 255] | _S[t2 & 255]) ^ last[3] ^ p3
+        out[j:j + 4] = c0, c1, c2, c3
+        p0, p1, p2, p3 = x0, x1, x2, x3
+    return struct.pack(f'>{count}I', *out)
+
+
+def python_decrypt_ige(cipher_text, key, iv):
+    """
+    Decrypt whole 16-byte blocks with AES-IGE in pure Python.
+
+    Args:
+        cipher_text: Data whose length is a multiple of 16
+        key: 32-byte AES key
+        iv: 32-byte IGE initialization vector
+
+    Returns:
+        The plain text
+    """
+    schedule = _schedule(key, '_Kd')
+    k0, middle, last = schedule[0], schedule[1:-1], schedule[-1]
+    count = len(cipher_text) // 4
+    words = struct.unpack(f'>{count}I', cipher_text)
+    c0, c1, c2, c3, p0, p1, p2, p3 = struct.unpack('>8I', iv)
+    out = [0] * count
+    for j in range(0, count, 4):
+        x0, x1, x2, x3 = words[j:j + 4]
+        t0 = x0 ^ p0 ^ k0[0]
+        t1 = x1 ^ p1 ^ k0[1]
+        t2 = x2 ^ p2 ^ k0[2]
+        t3 = x3 ^ p3 ^ k0[3]
+        for k in middle:
+            t0, t1, t2, t3 = (
+                _T5[t0 >> 24] ^ _T6[(t3 >> 16) & 255] ^ _T7[(t2 >> 8) & 255] ^ _T8[t1 & 255] ^ k[0],
+                _T5[t1 >> 24] ^ _T6[(t0 >> 16) & 255] ^ _T7[(t3 >> 8) & 255] ^ _T8[t2 & 255] ^ k[1],
+                _T5[t2 >> 24] ^ _T6[(t1 >> 16) & 255] ^ _T7[(t0 >> 8) & 255] ^ _T8[t3 & 255] ^ k[2],
+                _T5[t3 >> 24] ^ _T6[(t2 >> 16) & 255] ^ _T7[(t1 >> 8) & 255] ^ _T8[t0 & 255] ^ k[3],
+            )
+        p0 = (_Si24[t0 >> 24] | _Si16[(t3 >> 16) & 255] | _Si8[(t2 >> 8) & 255] | _Si[t1 & 255]) ^ last[0] ^ c0
+        p1 = (_Si24[t1 >> 24] | _Si16[(t0 >> 16) & 255] | _Si8[(t3 >> 8) & 255] | _Si[t2 & 255]) ^ last[1] ^ c1
+        p2 = (_Si24[t2 >> 24] | _Si16[(t1 >> 16) & 255] | _Si8[(t0 >> 8) & 255] | _Si[t3 & 255]) ^ last[2] ^ c2
+        p3 = (_Si24[t3 >> 24] | _Si16[(t2 >> 16) & 255] | _Si8[(t1 >> 8) & 255] | _Si[t0 & 255]) ^ last[3] ^ c3
+        out[j:j + 4] = p0, p1, p2, p3
+        c0, c1, c2, c3 = x0, x1, x2, x3
+    return struct.pack(f'>{count}I', *out)
+
+
+# name -> (encrypt_ige, decrypt_ige), fastest-expected first
+BACKENDS = {}
+
+
+def register_backend(name, encrypt_ige, decrypt_ige):
+    """
+    Make a backend available to select().
+
+    Args:
+        name: Backend name, as used in AES_BACKEND
+        encrypt_ige, decrypt_ige: Functions of (data, key, iv) -> bytes
+            working on whole 16-byte blocks
+    """
+    BACKENDS[name] = (encrypt_ige, decrypt_ige)
+
+
+if cryptg is not None:
+    register_backend('cryptg', cryptg.encrypt_ige, cryptg.decrypt_ige)
+if libssl.encrypt_ige and libssl.decrypt_ige:
+    register_backend('libssl', libssl.encrypt_ige, libssl.decrypt_ige)
+register_backend('python', python_encrypt_ige, python_decrypt_ige)
+
+# Outcome of select(), exported by stats()
+_selected = None
+_results = {}
+
+
+def check_backend(name):
+    """
+    Check a backend against the known answer.
+
+    Returns:
+        True if it encrypts and decrypts correctly
+    """
+    encrypt_ige, decrypt_ige = BACKENDS[name]
+    try:
+        return (encrypt_ige(_CHECK_PLAIN, _CHECK_KEY, _CHECK_IV) == _CHECK_CIPHER
+                and decrypt_ige(_CHECK_CIPHER, _CHECK_KEY, _CHECK_IV) == _CHECK_PLAIN)
+    except Exception as e:
+        logger.warning(f"AES backend {name} failed its check: {e!r}")
+        return False
+
+
+def measure_backend(name, size=BENCHMARK_SIZE, seconds=BENCHMARK_SECONDS):
+    """
+    Time a backend encrypting and decrypting size bytes.
+
+    Returns:
+        Throughput in MB/s (both directions counted)
+    """
+    encrypt_ige, decrypt_ige = BACKENDS[name]
+    data, key, iv = os.urandom(size), os.urandom(32), os.urandom(32)
+    processed = 0
+    start = time.perf_counter()
+    while True:
+        decrypt_ige(encrypt_ige(data, key, iv), key, iv)
+        processed += 2 * size
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return processed / elapsed / 1e6
+
+
+def install(name):
+    """Route Telethon's AES.encrypt_ige and AES.decrypt_ige to a backend"""
+    encrypt_ige, decrypt_ige = BACKENDS[name]
+
+    def encrypt(plain_text, key, iv):
+        padding = len(plain_text) % 16
+        if padding:
+            plain_text += os.urandom(16 - padding)
+        return encrypt_ige(plain_text, key, iv)
+
+    telethon_aes.AES.encrypt_ige = staticmethod(encrypt)
+    telethon_aes.AES.decrypt_ige = staticmethod(decrypt_ige)
+
+
+def select(preferred=AES_BACKEND):
+    """
+    Benchmark the available backends and install the chosen one.
+
+    Args:
+        preferred: 'auto' for the fastest correct backend, or a backend name
+
+    Returns:
+        Name of the installed backend
+
+    Raises:
+        ValueError: If preferred is not an available, working backend
+    """
+    global _selected
+    _results.clear()
+    for name in BACKENDS:
+        _results[name] = round(measure_backend(name), 2) if check_backend(name) else None
+    working = {name: mbps for name, mbps in _results.items() if mbps is not None}
+    if preferred == 'auto':
+        name = max(working, key=working.get)
+    elif preferred in working:
+        name = preferred
+    else:
+        raise ValueError(f"AES backend {preferred!r} is not available; working: {', '.join(working)}")
+
+    install(name)
+    _selected = name
+    summary = ', '.join(f"{backend} {mbps} MB/s" for backend, mbps in working.items())
+    logger.info(f"AES-IGE backend: {name} ({summary})")
+    if name in SLOW_BACKENDS:
+        logger.warning(
+            f"AES-IGE is running on the slow pure-Python path ({working[name]} MB/s); "
+            f"install cryptg (pip install cryptg) or OpenSSL's libcrypto for native speed"
+        )
+    return name
+
+
+def stats():
+    """
+    Selected backend and measured throughputs.
+
+    Returns:
+        Dictionary with the backend name, whether it is slow and MB/s per backend
+    """
+    return {
+        'backend': _selected,
+        'slow': _selected in SLOW_BACKENDS,
+        'mbps': dict(_results)
+    }
@@ -0,0 +1,195 @@
+"""
+Pool of Telegram API credentials (api_id / api_hash pairs) for user clients.
+
+Telegram applies flood limits per app as well as per account, so spreading
+logins and validations over several registered apps raises how much the
+bot can do before being throttled. A credential under a FloodWait penalty
+(see flood_ledger.py) is skipped until the penalty expires.
+
+A client keeps the credential it was created with for the whole life of its
+session: sessions created here remember their api_id (in saved sessions and
+flow checkpoints) and are reopened with the same credential.
+"""
+import os
+import json
+import time
+import random
+import logging
+from collections import deque
+from telethon.errors import FloodWaitError
+from flood_ledger import ledger
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated "api_id:api_hash[:weight]" entries
+API_CREDENTIALS = os.environ.get("API_CREDENTIALS", "")
+
+# Path of a JSON list of {"api_id", "api_hash", "weight"}; takes precedence
+API_CREDENTIALS_FILE = os.environ.get("API_CREDENTIALS_FILE", "")
+
+# 'least_loaded' or 'weighted' (random, proportional to weight)
+CREDENTIAL_STRATEGY = os.environ.get("CREDENTIAL_STRATEGY", "least_loaded")
+
+# Seconds over which new clients count towards a credential's load
+CREDENTIAL_LOAD_WINDOW = int(os.environ.get("CREDENTIAL_LOAD_WINDOW", 300))
+
+
+class ApiCredential:
+    """One api_id / api_hash pair with its usage and flood state"""
+
+    def __init__(self, api_id, api_hash, weight=1):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.weight = weight
+        self.clients_created = 0
+        self.flood_waits = 0
+        self.flood_seconds = 0
+        # Creation times of recent clients, oldest first
+        self._recent = deque()
+
+    def flood_remaining(self):
+        """Seconds left of the credential's FloodWait penalty, if any"""
+        return ledger.remaining([('api', self.api_id)])
+
+    def recent_clients(self, now=None):
+        """Number of clients created within CREDENTIAL_LOAD_WINDOW"""
+        cutoff = (now or time.monotonic()) - CREDENTIAL_LOAD_WINDOW
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        return len(self._recent)
+
+    def load(self, now=None):
+        """Recent clients relative to the credential's weight"""
+        return self.recent_clients(now) / self.weight
+
+    def __repr__(self):
+        return f"ApiCredential({self.api_id})"
+
+
+class CredentialPool:
+    """Chooses a credential for each new user client"""
+
+    def __init__(self, credentials, strategy=CREDENTIAL_STRATEGY):
+        """
+        Args:
+            credentials: Non-empty list of ApiCredential; the first one is
+                the default (used by bot clients and unknown api_ids)
+            strategy: 'least_loaded' or 'weighted'
+        """
+        if not credentials:
+            raise ValueError("At least one API credential is required")
+        if strategy not in ('least_loaded', 'weighted'):
+            raise ValueError(f"Unknown credential strategy {strategy!r}")
+        self.credentials = credentials
+        self.strategy = strategy
+        self._by_id = {credential.api_id: credential for credential in credentials}
+
+    @property
+    def default(self):
+        return self.credentials[0]
+
+    def pick(self):
+        """
+        Choose a credential for a new session.
+
+        Credentials under a FloodWait penalty are skipped; if all of them are,
+        the one whose penalty ends first is returned, and logins on it wait
+        for the penalty to end (flood_keys() makes them depend on it).
+
+        Returns:
+            An ApiCredential
+        """
+        now = time.monotonic()
+        available = [credential for credential in self.credentials if not credential.flood_remaining()]
+        if not available:
+            metrics.incr('api_credentials_exhausted')
+            return min(self.credentials, key=lambda credential: credential.flood_remaining())
+        if self.strategy == 'weighted':
+            return random.choices(available, weights=[credential.weight for credential in available])[0]
+        return min(available, key=lambda credential: credential.load(now))
+
+    def get(self, api_id):
+        """
+        Get the credential a session was created with.
+
+        Returns:
+            The matching ApiCredential, or the default one if api_id is
+            unknown (sessions from before pooling, or removed credentials)
+        """
+        return self._by_id.get(api_id, self.default)
+
+    def client_created(self, credential):
+        """Count a new client against a credential's load"""
+        credential.clients_created += 1
+        credential._recent.append(time.monotonic())
+
+    def note_error(self, client, error):
+        """Count a FloodWait charged to a pooled client's credential"""
+        if client is None or not isinstance(error, FloodWaitError):
+            return
+        credential = self._by_id.get(client.api_id)
+        if credential is not None:
+            credential.flood_waits += 1
+            credential.flood_seconds += error.seconds
+
+    def stats(self):
+        """
+        Usage and flood state per credential.
+
+        Returns:
+            Dictionary keyed by api_id
+        """
+        now = time.monotonic()
+        return {
+            str(credential.api_id): {
+                'weight': credential.weight,
+                'clients_created': credential.clients_created,
+                'recent_clients': credential.recent_clients(now),
+                'flood_waits': credential.flood_waits,
+                'flood_seconds': credential.flood_seconds,
+                'flood_remaining': round(credential.flood_remaining())
+            }
+            for credential in self.credentials
+        }
+
+
+def load_credentials(default_id, default_hash):
+    """
+    Load the configured credentials.
+
+    Sources, in order of precedence: API_CREDENTIALS_FILE, API_CREDENTIALS,
+    then the given default pair alone.
+
+    Returns:
+        List of ApiCredential
+
+    Raises:
+        ValueError: If the configuration is malformed
+    """
+    if API_CREDENTIALS_FILE:
+        with open(API_CREDENTIALS_FILE, encoding='utf-8') as f:
+            entries = [
+                (entry['api_id'], entry['api_hash'], entry.get('weight', 1))
+                for entry in json.load(f)
+            ]
+    elif API_CREDENTIALS:
+        entries = []
+        for item in API_CREDENTIALS.split(','):
+            parts = item.strip().split(':')
+            if len(parts) not in (2, 3):
+                raise ValueError(f"Expected api_id:api_hash[:weight] in API_CREDENTIALS, got {item!r}")
+            entries.append((parts[0], parts[1], parts[2] if len(parts) == 3 else 1))
+    else:
+        entries = [(default_id, default_hash, 1)]
+
+    credentials = []
+    for api_id, api_hash, weight in entries:
+        try:
+            api_id, weight = int(api_id), float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid api_id or weight for API credential {api_id!r}")
+        if weight <= 0:
+            raise ValueError(f"Weight of API credential {api_id} must be positive")
+        credentials.append(ApiCredential(api_id, api_hash, weight))
+    return credentials
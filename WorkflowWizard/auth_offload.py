@@ -0,0 +1,281 @@
+"""
+Auth-key generation with the heavy math in a process pool.
+
+Connecting a client without an auth key (every new login) runs the MTProto
+key exchange. Telethon does it inside the event loop: factorizing pq
+(Pollard-Brent in pure Python), RSA-encrypting the inner data, AES-IGE and
+two 2048-bit modular exponentiations for Diffie-Hellman. Tens of
+milliseconds of CPU per login, during which no other user is served.
+
+start_pool() replaces Telethon's do_authentication with a version that
+keeps sending and receiving on the loop and runs those two CPU-bound steps
+in a ProcessPoolExecutor. The protocol and every security check are the
+same as in telethon.network.authenticator.
+
+The workers are forked by start_pool(), which must run while the process
+has a single thread: a child forked while the log listener or a session
+store writer holds a lock would wait on it forever. simple_bot starts the
+pool before either of them exists. 'forkserver' and 'spawn' are no way out,
+since their workers re-run the __main__ script and with it the bot's
+startup. The workers only ever run solve_pq() and complete_dh(); if the
+pool breaks, key exchanges fall back to running in the loop.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from telethon import helpers
+from telethon.crypto import AES, AuthKey, Factorization, rsa
+from telethon.errors import SecurityError
+from telethon.extensions import BinaryReader
+from telethon.network import authenticator
+from telethon.tl.types import (
+    ResPQ, PQInnerData, ServerDHParamsFail, ServerDHParamsOk,
+    ServerDHInnerData, ClientDHInnerData, DhGenOk, DhGenRetry, DhGenFail
+)
+from telethon.tl.functions import ReqPqMultiRequest, ReqDHParamsRequest, SetClientDHParamsRequest
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for key exchanges; 0 keeps Telethon's in-loop version
+AUTH_KEY_WORKERS = int(os.environ.get("AUTH_KEY_WORKERS", 2))
+
+# Lower bound of g_a and g_b away from 1 and dh_prime - 1
+_SAFETY_RANGE = 2 ** (2048 - 64)
+
+_pool = None
+
+
+def _get_int(byte_array, signed=True):
+    return int.from_bytes(byte_array, byteorder='big', signed=signed)
+
+
+def solve_pq(pq, nonce, server_nonce, fingerprints):
+    """
+    Step 2 math: factorize pq and RSA-encrypt the inner data.
+
+    Args:
+        pq: pq from ResPQ (bytes)
+        nonce, server_nonce: Nonces of the exchange
+        fingerprints: Server public key fingerprints offered in ResPQ
+
+    Returns:
+        Tuple of (p bytes, q bytes, new_nonce, encrypted data, fingerprint)
+
+    Raises:
+        SecurityError: If no offered key is known
+    """
+    pq = _get_int(pq)
+    p, q = Factorization.factorize(pq)
+    p, q = rsa.get_byte_array(p), rsa.get_byte_array(q)
+    new_nonce = int.from_bytes(os.urandom(32), 'little', signed=True)
+    pq_inner_data = bytes(PQInnerData(
+        pq=rsa.get_byte_array(pq), p=p, q=q,
+        nonce=nonce,
+        server_nonce=server_nonce,
+        new_nonce=new_nonce
+    ))
+
+    # Current keys first; old keys only if none of them is offered
+    for use_old in (False, True):
+        for fingerprint in fingerprints:
+            cipher_text = rsa.encrypt(fingerprint, pq_inner_data, use_old=use_old)
+            if cipher_text is not None:
+                return p, q, new_nonce, cipher_text, fingerprint
+
+    raise SecurityError(
+        f"Step 2 could not find a valid key for fingerprints: {', '.join(map(str, fingerprints))}"
+    )
+
+
+def complete_dh(encrypted_answer, nonce, server_nonce, new_nonce):
+    """
+    Step 3 math: decrypt the server's DH parameters and compute the key.
+
+    Returns:
+        Tuple of (encrypted client DH data, g_ab bytes, server time)
+
+    Raises:
+        SecurityError: If the server's answer fails a check
+    """
+    key, iv = helpers.generate_key_data_from_nonce(server_nonce, new_nonce)
+    if len(encrypted_answer) % 16 != 0:
+        raise SecurityError('Step 3 AES block size mismatch')
+
+    plain_text_answer = AES.decrypt_ige(encrypted_answer, key, iv)
+    with BinaryReader(plain_text_answer) as reader:
+        reader.read(20)  # hash sum
+        server_dh_inner = reader.tgread_object()
+        if not isinstance(server_dh_inner, ServerDHInnerData):
+            raise SecurityError(f'Step 3 answer was {server_dh_inner}')
+
+    if server_dh_inner.nonce != nonce:
+        raise SecurityError('Step 3 Invalid nonce in encrypted answer')
+    if server_dh_inner.server_nonce != server_nonce:
+        raise SecurityError('Step 3 Invalid server nonce in encrypted answer')
+
+    dh_prime = _get_int(server_dh_inner.dh_prime, signed=False)
+    g = server_dh_inner.g
+    g_a = _get_int(server_dh_inner.g_a, signed=False)
+
+    b = _get_int(os.urandom(256), signed=False)
+    g_b = pow(g, b, dh_prime)
+    gab = pow(g_a, b, dh_prime)
+
+    # https://core.telegram.org/mtproto/auth_key#dh-key-exchange-complete
+    if not (1 < g < (dh_prime - 1)):
+        raise SecurityError('g_a is not within (1, dh_prime - 1)')
+    if not (1 < g_a < (dh_prime - 1)):
+        raise SecurityError('g_a is not within (1, dh_prime - 1)')
+    if not (1 < g_b < (dh_prime - 1)):
+        raise SecurityError('g_b is not within (1, dh_prime - 1)')
+    if not (_SAFETY_RANGE <= g_a <= (dh_prime - _SAFETY_RANGE)):
+        raise SecurityError('g_a is not within (2^{2048-64}, dh_prime - 2^{2048-64})')
+    if not (_SAFETY_RANGE <= g_b <= (dh_prime - _SAFETY_RANGE)):
+        raise SecurityError('g_b is not within (2^{2048-64}, dh_prime - 2^{2048-64})')
+
+    client_dh_inner = bytes(ClientDHInnerData(
+        nonce=nonce,
+        server_nonce=server_nonce,
+        retry_id=0,
+        g_b=rsa.get_byte_array(g_b)
+    ))
+    client_dh_inner_hashed = sha1(client_dh_inner).digest() + client_dh_inner
+    client_dh_encrypted = AES.encrypt_ige(client_dh_inner_hashed, key, iv)
+    return client_dh_encrypted, rsa.get_byte_array(gab), server_dh_inner.server_time
+
+
+async def _offload(func, *args):
+    """Run a step in the pool, or in the loop if the pool has broken"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+    except BrokenProcessPool:
+        metrics.incr('auth_offload_broken')
+        logger.error("Auth-key worker pool is broken; running the key exchange in the event loop")
+        return func(*args)
+
+
+async def do_authentication(sender):
+    """
+    Drop-in replacement for telethon.network.authenticator.do_authentication.
+
+    Args:
+        sender: A connected MTProtoPlainSender
+
+    Returns:
+        Tuple of (authorization key, time offset)
+    """
+    start = time.perf_counter()
+
+    # Step 1: PQ request
+    nonce = int.from_bytes(os.urandom(16), 'big', signed=True)
+    res_pq = await sender.send(ReqPqMultiRequest(nonce))
+    if not isinstance(res_pq, ResPQ):
+        raise SecurityError(f'Step 1 answer was {res_pq}')
+    if res_pq.nonce != nonce:
+        raise SecurityError('Step 1 invalid nonce from server')
+
+    # Step 2: DH exchange request
+    p, q, new_nonce, cipher_text, fingerprint = await _offload(
+        solve_pq, res_pq.pq, res_pq.nonce, res_pq.server_nonce,
+        list(res_pq.server_public_key_fingerprints)
+    )
+    server_dh_params = await sender.send(ReqDHParamsRequest(
+        nonce=res_pq.nonce,
+        server_nonce=res_pq.server_nonce,
+        p=p, q=q,
+        public_key_fingerprint=fingerprint,
+        encrypted_data=cipher_text
+    ))
+    if not isinstance(server_dh_params, (ServerDHParamsOk, ServerDHParamsFail)):
+        raise SecurityError(f'Step 2.1 answer was {server_dh_params}')
+    if server_dh_params.nonce != res_pq.nonce:
+        raise SecurityError('Step 2 invalid nonce from server')
+    if server_dh_params.server_nonce != res_pq.server_nonce:
+        raise SecurityError('Step 2 invalid server nonce from server')
+    if isinstance(server_dh_params, ServerDHParamsFail):
+        nnh = int.from_bytes(
+            sha1(new_nonce.to_bytes(32, 'little', signed=True)).digest()[4:20],
+            'little', signed=True
+        )
+        if server_dh_params.new_nonce_hash != nnh:
+            raise SecurityError('Step 2 invalid DH fail nonce from server')
+        raise SecurityError(f'Step 2.2 answer was {server_dh_params}')
+
+    # Step 3: complete the DH exchange
+    client_dh_encrypted, gab, server_time = await _offload(
+        complete_dh, server_dh_params.encrypted_answer,
+        res_pq.nonce, res_pq.server_nonce, new_nonce
+    )
+    time_offset = server_time - int(time.time())
+    dh_gen = await sender.send(SetClientDHParamsRequest(
+        nonce=res_pq.nonce,
+        server_nonce=res_pq.server_nonce,
+        encrypted_data=client_dh_encrypted,
+    ))
+
+    nonce_types = (DhGenOk, DhGenRetry, DhGenFail)
+    if not isinstance(dh_gen, nonce_types):
+        raise SecurityError(f'Step 3.1 answer was {dh_gen}')
+    name = type(dh_gen).__name__
+    if dh_gen.nonce != res_pq.nonce:
+        raise SecurityError(f'Step 3 invalid {name} nonce from server')
+    if dh_gen.server_nonce != res_pq.server_nonce:
+        raise SecurityError(f'Step 3 invalid {name} server nonce from server')
+
+    auth_key = AuthKey(gab)
+    nonce_number = 1 + nonce_types.index(type(dh_gen))
+    new_nonce_hash = auth_key.calc_new_nonce_hash(new_nonce, nonce_number)
+    if getattr(dh_gen, f'new_nonce_hash{nonce_number}') != new_nonce_hash:
+        raise SecurityError('Step 3 invalid new nonce hash')
+    if not isinstance(dh_gen, DhGenOk):
+        raise SecurityError(f'Step 3.2 answer was {dh_gen}')
+
+    metrics.incr('auth_keys_generated')
+    metrics.observe('auth_key_exchange', time.perf_counter() - start)
+    return auth_key, time_offset
+
+
+def start_pool(workers=AUTH_KEY_WORKERS):
+    """
+    Start the worker processes and route key exchanges through them.
+
+    Must be called before the process starts any thread; otherwise key
+    exchanges stay in the loop.
+
+    Returns:
+        True if offloading is enabled
+    """
+    global _pool
+    if workers <= 0 or _pool is not None:
+        return _pool is not None
+    if threading.active_count() > 1:
+        logger.warning(
+            f"Auth-key generation stays in the event loop: {threading.active_count()} threads "
+            f"are running and forking workers now could deadlock them"
+        )
+        return False
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    # Fork every worker now, and import Telethon's crypto in them
+    for future in [_pool.submit(Factorization.factorize, 15) for _ in range(workers)]:
+        future.result()
+    authenticator.do_authentication = do_authentication
+    return True
+
+
+def stop_pool():
+    """Restore Telethon's in-loop key exchange and stop the workers"""
+    global _pool
+    if _pool is not None:
+        authenticator.do_authentication = _original_do_authentication
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+_original_do_authentication = authenticator.do_authentication
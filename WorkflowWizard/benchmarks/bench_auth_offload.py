@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark of auth-key generation in the event loop versus a process pool.
+
+Runs many simulated logins at once. Each one waits a network round trip,
+does the step 2 math (factorize pq, RSA-encrypt), waits again, does the
+step 3 math (AES-IGE, Diffie-Hellman) and waits a last round trip, exactly
+the CPU work of auth_offload.do_authentication. Server answers are
+generated up front so the fake server costs nothing while measuring.
+
+Reports login throughput and event loop lag (how late a 10 ms heartbeat
+fires) with the math inline and offloaded.
+
+Usage: python benchmarks/bench_auth_offload.py [--logins N] [--concurrency N]
+           [--workers N] [--rtt MS]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from hashlib import sha1
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import helpers
+from telethon.crypto import AES, rsa
+from telethon.tl.types import ServerDHInnerData
+import auth_offload
+from auth_offload import solve_pq, complete_dh
+
+HEARTBEAT = 0.01
+
+
+def is_prime(n):
+    """Deterministic Miller-Rabin for n < 2^64"""
+    if n < 2:
+        return False
+    for prime in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        if n % prime == 0:
+            return n == prime
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    for a in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def random_prime(rng, bits):
+    while True:
+        n = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if is_prime(n):
+            return n
+
+
+def make_exchanges(count, seed=1):
+    """
+    Build inputs for both steps of count key exchanges, like Telegram's.
+
+    Returns:
+        List of (solve_pq args, complete_dh args)
+    """
+    rng = random.Random(seed)
+    fingerprints = [fingerprint for fingerprint, (_, old) in rsa._server_keys.items() if not old]
+    # Only the size of the modulus matters for the cost of the DH math
+    dh_prime = rng.getrandbits(2048) | (1 << 2047) | 1
+    g = 3
+    exchanges = []
+    for _ in range(count):
+        pq = random_prime(rng, 31) * random_prime(rng, 31)
+        nonce = rng.getrandbits(127)
+        server_nonce = rng.getrandbits(127)
+        new_nonce = rng.getrandbits(255)
+        g_a = pow(g, rng.getrandbits(2048), dh_prime)
+        inner = bytes(ServerDHInnerData(
+            nonce=nonce, server_nonce=server_nonce, g=g,
+            dh_prime=rsa.get_byte_array(dh_prime), g_a=rsa.get_byte_array(g_a),
+            server_time=int(time.time())
+        ))
+        answer = sha1(inner).digest() + inner
+        answer += os.urandom(-len(answer) % 16)
+        key, iv = helpers.generate_key_data_from_nonce(server_nonce, new_nonce)
+        encrypted = AES.encrypt_ige(answer, key, iv)
+        exchanges.append((
+            (rsa.get_byte_array(pq), nonce, server_nonce, fingerprints),
+            (encrypted, nonce, server_nonce, new_nonce)
+        ))
+    return exchanges
+
+
+async def run(exchanges, concurrency, rtt, offload):
+    """
+    Run all exchanges with at most concurrency at a time.
+
+    Returns:
+        (seconds, list of heartbeat lags in seconds)
+    """
+    loop = asyncio.get_running_loop()
+    lags = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            expected = time.perf_counter() + HEARTBEAT
+            await asyncio.sleep(HEARTBEAT)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def step(func, args):
+        if offload:
+            return await loop.run_in_executor(auth_offload._pool, func, *args)
+        return func(*args)
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def login(pq_args, dh_args):
+        async with slots:
+            await asyncio.sleep(rtt)
+            await step(solve_pq, pq_args)
+            await asyncio.sleep(rtt)
+            await step(complete_dh, dh_args)
+            await asyncio.sleep(rtt)
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(login(*exchange) for exchange in exchanges))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await beat
+    return elapsed, lags
+
+
+def report(name, count, elapsed, lags):
+    lags = sorted(lags)
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+    print(f"{name:<10} {count / elapsed:>10.1f} logins/s   "
+          f"loop lag p99 {p99 * 1000:>7.1f} ms   max {lags[-1] * 1000 if lags else 0:>7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--logins', type=int, default=100, help="simulated logins per run")
+    parser.add_argument('--concurrency', type=int, default=20, help="logins in flight at once")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="worker processes")
+    parser.add_argument('--rtt', type=float, default=50, help="simulated round trip in ms")
+    args = parser.parse_args()
+
+    print(f"Preparing {args.logins} key exchanges...")
+    exchanges = make_exchanges(args.logins)
+    auth_offload.start_pool(args.workers)
+    print(f"{args.concurrency} concurrent, {args.rtt:.0f} ms RTT, {args.workers} workers\n")
+
+    elapsed, lags = asyncio.run(run(exchanges, args.concurrency, args.rtt / 1000, offload=False))
+    report("inline", len(exchanges), elapsed, lags)
+    elapsed, lags = asyncio.run(run(exchanges, args.concurrency, args.rtt / 1000, offload=True))
+    report("offloaded", len(exchanges), elapsed, lags)
+    auth_offload.stop_pool()
+
+
+if __name__ == "__main__":
+    main()
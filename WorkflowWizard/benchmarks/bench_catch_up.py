@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the catch-up policy for updates missed during a restart.
+
+Feeds a synthetic backlog (a share of it older than CATCH_UP_MAX_AGE)
+through update_backlog.Backlog the way the guard in simple_bot does, with
+handlers simulated by a sleep, and compares it with handling every missed
+update. Reports the time until the backlog is drained, the handlers run,
+the replies sent and the most handlers running at once.
+
+Usage: python benchmarks/bench_catch_up.py [--users N] [--updates N] [--stale-share P]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_backlog import Backlog, STALE
+
+
+def synthetic_backlog(users, updates_per_user, stale_share, max_age, now):
+    """(key, user id, sent at) of a backlog, oldest first"""
+    backlog = []
+    update_id = 0
+    for user_id in range(users):
+        stale = random.random() < stale_share
+        for _ in range(updates_per_user):
+            update_id += 1
+            age = random.uniform(max_age * 1.5, max_age * 20) if stale else random.uniform(0, max_age / 2)
+            backlog.append((('message', user_id, update_id), user_id, now - age))
+    backlog.sort(key=lambda update: update[2])
+    return backlog
+
+
+class Handlers:
+    """Simulated handlers that count what they do"""
+
+    def __init__(self, handler_time):
+        self.handler_time = handler_time
+        self.run = 0
+        self.replies = 0
+        self.running = 0
+        self.peak = 0
+
+    async def handle(self):
+        self.run += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(self.handler_time)
+        self.running -= 1
+        self.replies += 1
+
+    async def notify(self):
+        self.replies += 1
+
+
+async def with_policy(backlog, handlers, max_age, batch_size, batch_interval, now):
+    tagged = Backlog(max_age=max_age, batch_size=batch_size, batch_interval=batch_interval)
+    tagged.waiting.update(key for key, _, _ in backlog)
+    tagged._difference_done = True
+
+    async def guard(key, user_id, sent_at):
+        if tagged.sort(key, sent_at, now) == STALE:
+            if tagged.first_notice(user_id):
+                await handlers.notify()
+            return
+        await tagged.admit()
+        await handlers.handle()
+
+    await asyncio.gather(*(guard(*update) for update in backlog))
+    return tagged.stats()
+
+
+async def without_policy(backlog, handlers):
+    await asyncio.gather(*(handlers.handle() for _ in backlog))
+
+
+def run(label, coroutine, handlers):
+    start = time.perf_counter()
+    result = asyncio.run(coroutine)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<18} {elapsed:>10.2f} {handlers.run:>9,} {handlers.replies:>9,} {handlers.peak:>9,}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=300, help="users with missed updates")
+    parser.add_argument('--updates', type=int, default=4, help="missed updates per user")
+    parser.add_argument('--stale-share', type=float, default=0.7, help="share of users whose updates are stale")
+    parser.add_argument('--max-age', type=float, default=120, help="CATCH_UP_MAX_AGE")
+    parser.add_argument('--batch', type=int, default=20, help="CATCH_UP_BATCH")
+    parser.add_argument('--batch-interval', type=float, default=0.05, help="CATCH_UP_BATCH_INTERVAL")
+    parser.add_argument('--handler-time', type=float, default=0.01, help="seconds one handler takes")
+    args = parser.parse_args()
+    random.seed(1)
+
+    now = time.time()
+    backlog = synthetic_backlog(args.users, args.updates, args.stale_share, args.max_age, now)
+    print(f"{len(backlog):,} missed updates from {args.users:,} users\n")
+    print(f"{'':<18} {'drain (s)':>10} {'handlers':>9} {'replies':>9} {'peak':>9}")
+
+    handlers = Handlers(args.handler_time)
+    stats = run("catch-up policy", with_policy(backlog, handlers, args.max_age, args.batch,
+                                               args.batch_interval, now), handlers)
+    handlers = Handlers(args.handler_time)
+    run("handle everything", without_policy(backlog, handlers), handlers)
+
+    print(f"\nPolicy: {stats['handled']:,} handled, {stats['dropped']:,} dropped, "
+          f"{stats['notices']:,} restart notices")
+
+
+if __name__ == "__main__":
+    main()
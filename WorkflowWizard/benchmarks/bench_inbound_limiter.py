@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the per-user inbound rate limit check.
+
+Reports the time per check() for an update that is let through, one that
+is dropped from a muted user and one that mutes its sender, the memory per
+tracked user, and the time the periodic sweep takes to forget idle users.
+Compare the per-check times with the handler timings of bench_suite.py to
+see what the limiter adds to every update and what a dropped update saves.
+
+Usage: python benchmarks/bench_inbound_limiter.py [--users N] [--checks N]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inbound_limiter import InboundLimiter, ALLOWED, MUTED, DROPPED
+
+
+def per_check(limiter, user_ids, now, expected):
+    """Nanoseconds per check(), asserting every check returns expected"""
+    start = time.perf_counter_ns()
+    for user_id in user_ids:
+        verdict = limiter.check(user_id, 1, now)
+    elapsed = time.perf_counter_ns() - start
+    assert verdict == expected, verdict
+    return elapsed / len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000, help="distinct users tracked")
+    parser.add_argument('--checks', type=int, default=200000, help="checks per timing")
+    args = parser.parse_args()
+    # Every mute logs a warning; keep the output to the results
+    logging.disable(logging.WARNING)
+
+    now = time.monotonic()
+    checked = [i % args.users for i in range(args.checks)]
+
+    # Allowed: a huge bucket, so nobody runs dry
+    limiter = InboundLimiter(rate=1, burst=args.checks, sweep_interval=3600)
+    allowed = per_check(limiter, checked, now, ALLOWED)
+
+    # Dropped: everyone is muted already
+    limiter = InboundLimiter(rate=1, burst=1, sweep_interval=3600)
+    for user_id in range(args.users):
+        limiter.check(user_id, 1, now)
+        limiter.check(user_id, 1, now)
+    dropped = per_check(limiter, checked, now, DROPPED)
+
+    # Muting: each user's second update runs the bucket dry
+    limiter = InboundLimiter(rate=1, burst=1, sweep_interval=3600)
+    for user_id in range(args.users):
+        limiter.check(user_id, 1, now)
+    muting = per_check(limiter, range(args.users), now, MUTED)
+
+    print(f"{'check':<22} {'ns/check':>10}")
+    print(f"{'allowed':<22} {allowed:>10,.0f}")
+    print(f"{'dropped (muted)':<22} {dropped:>10,.0f}")
+    print(f"{'muting':<22} {muting:>10,.0f}")
+
+    # Memory of the buckets and the sweep that forgets them
+    limiter = InboundLimiter(rate=1, burst=20, sweep_interval=3600)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id in range(args.users):
+        limiter.check(user_id, 1, now)
+    per_user = (tracemalloc.get_traced_memory()[0] - before) / args.users
+    tracemalloc.stop()
+    start = time.perf_counter()
+    removed = limiter.sweep(now + 60)
+    sweep_ms = (time.perf_counter() - start) * 1000
+
+    print(f"\n{args.users:,} tracked users: {per_user:,.0f} bytes per user")
+    print(f"Sweep of {removed:,} idle users: {sweep_ms:,.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
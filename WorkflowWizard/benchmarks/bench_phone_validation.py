@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of local phone number validation.
+
+Reports how many numbers per second utils.validate_phone_number and the
+batch utils.normalize_phone_numbers get through on a mix of valid,
+badly formatted and impossible numbers.
+
+Usage: python benchmarks/bench_phone_validation.py [--count N]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import NUMBERING_PLAN, validate_phone_number, normalize_phone_numbers
+
+
+def make_numbers(count, seed=1):
+    """Build a reproducible mix of valid and invalid numbers"""
+    rng = random.Random(seed)
+    codes = list(NUMBERING_PLAN.items())
+    numbers = []
+    for i in range(count):
+        code, (min_length, max_length) = rng.choice(codes)
+        length = rng.randint(min_length, max_length)
+        kind = i % 4
+        if kind == 1:
+            # Impossible length for the country
+            length = max_length + rng.randint(1, 3)
+        digits = ''.join(rng.choice('0123456789') for _ in range(length))
+        if kind == 2:
+            # Human formatting that must be stripped
+            numbers.append(f"+{code} ({digits[:3]}) {digits[3:]}")
+        elif kind == 3:
+            # Missing '+'
+            numbers.append(f"{code}{digits}")
+        else:
+            numbers.append(f"+{code}{digits}")
+    return numbers
+
+
+def bench(name, func, numbers, repeat):
+    """Run func over all numbers and report the best of several rounds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(numbers)
+        best = min(best, time.perf_counter() - start)
+    rate = len(numbers) / best
+    print(f"{name:<28} {rate:>12,.0f} numbers/s  ({best / len(numbers) * 1e9:,.0f} ns/number)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=100000, help="numbers per round")
+    parser.add_argument('--repeat', type=int, default=5, help="rounds per benchmark")
+    args = parser.parse_args()
+
+    numbers = make_numbers(args.count)
+    valid = sum(1 for ok, _ in normalize_phone_numbers(numbers) if ok)
+    print(f"{len(numbers):,} numbers, {valid:,} valid, {len(NUMBERING_PLAN)} country codes\n")
+
+    bench("validate_phone_number", lambda ns: [validate_phone_number(n) for n in ns], numbers, args.repeat)
+    bench("normalize_phone_numbers", normalize_phone_numbers, numbers, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
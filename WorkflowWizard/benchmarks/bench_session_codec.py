@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark of decoding pasted session strings offline.
+
+Reports decodes per second of session_codec.decode() for every supported
+layout and for typical malformed input, next to Telethon's own StringSession
+parser for Telethon strings, and the cost of converting to a Telethon string.
+
+Usage: python benchmarks/bench_session_codec.py [--count N]
+"""
+import os
+import sys
+import time
+import base64
+import struct
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import session_codec
+from session_codec import DecodedSession, MalformedSessionError
+from telethon.sessions import StringSession
+
+AUTH_KEY = bytes(range(256))
+
+
+def sample_strings():
+    """(name, text) of every layout and of common mistakes"""
+    samples = [
+        ("telethon ipv4", session_codec.encode(DecodedSession('telethon', 2, '149.154.167.51', 443, AUTH_KEY))),
+        ("telethon ipv6", session_codec.encode(DecodedSession('telethon', 2, '2001:67c:4e8:f002::a', 443, AUTH_KEY))),
+        ("gramjs", session_codec.encode(DecodedSession('gramjs', 4, '149.154.167.91', 443, AUTH_KEY))),
+        ("pyrogram", session_codec.encode(DecodedSession('pyrogram', 5, None, None, AUTH_KEY, 123456789, 12345))),
+        ("pyrogram 1.x", session_codec.encode(DecodedSession('pyrogram-1', 1, None, None, AUTH_KEY, 123456789))),
+    ]
+    telethon = samples[0][1]
+    samples += [
+        ("bad: free text", "hello, is this the right place?"),
+        ("bad: truncated", telethon[:200]),
+        ("bad: no such DC", '1' + base64.urlsafe_b64encode(
+            struct.pack('>B4sH256s', 9, bytes(4), 443, AUTH_KEY)).decode('ascii')),
+    ]
+    return samples
+
+
+def per_second(func, count):
+    """Best-of-three calls per second"""
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def decode_or_reject(text):
+    try:
+        return session_codec.decode(text)
+    except MalformedSessionError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=20000, help="decodes per measurement")
+    args = parser.parse_args()
+
+    print(f"{'input':<18} {'decode/s':>12} {'to_telethon/s':>14} {'StringSession/s':>16}")
+    for name, text in sample_strings():
+        decoded = decode_or_reject(text)
+        rate = per_second(lambda: decode_or_reject(text), args.count)
+        convert = (f"{per_second(lambda: session_codec.to_telethon(decoded), args.count):>14,.0f}"
+                   if decoded else f"{'-':>14}")
+        telethon = (f"{per_second(lambda: StringSession(text), args.count):>16,.0f}"
+                    if decoded and decoded.layout == 'telethon' else f"{'-':>16}")
+        print(f"{name:<18} {rate:>12,.0f} {convert} {telethon}")
+
+
+if __name__ == "__main__":
+    main()
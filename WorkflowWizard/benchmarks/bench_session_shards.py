@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark of session store write throughput by shard count.
+
+Writes records for random users the way handlers do (one thread, like the
+event loop) and measures writes per second until every write is committed,
+for each shard count, along with the time a write holds up the caller and
+the rows per commit the writers reached. A first row commits every write on
+its own, as the store did before writes were batched.
+
+Usage: python benchmarks/bench_session_shards.py [--writes N] [--users N] [--shards 1,2,4,8]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import SessionStore, SESSION_COMMIT_BATCH
+
+
+def record(number):
+    """A user record the size of one saved session"""
+    return {
+        'sessions': [{
+            'label': f"Session {number}",
+            'sealed': 'x' * 480,
+            'created_at': '2024-01-01 00:00:00',
+            'checks': 'y' * 64
+        }],
+        'settings': {'auto_delete': number % 2 == 0}
+    }
+
+
+def measure(directory, shards, commit_batch, writes, users):
+    """
+    Returns:
+        (writes per second until committed, microseconds per put, rows per commit)
+    """
+    path = os.path.join(directory, f"bench-{shards}-{commit_batch}.db")
+    store = SessionStore(path, shards=shards, commit_batch=commit_batch)
+    user_ids = [random.randrange(users) for _ in range(writes)]
+    records = [record(number) for number in range(100)]
+
+    start = time.perf_counter()
+    for number, user_id in enumerate(user_ids):
+        store.put_user('bench', user_id, records[number % 100])
+    put = time.perf_counter() - start
+    store.flush()
+    elapsed = time.perf_counter() - start
+
+    stats = store.stats()
+    store.close()
+    return writes / elapsed, put / writes * 1e6, stats['rows_committed'] / max(1, stats['commits'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writes', type=int, default=20000, help="writes per measurement")
+    parser.add_argument('--users', type=int, default=100000, help="distinct users written")
+    parser.add_argument('--shards', default="1,2,4,8", help="comma-separated shard counts")
+    args = parser.parse_args()
+    random.seed(1)
+
+    print(f"{'layout':<26} {'writes/s':>10} {'us/put':>8} {'rows/commit':>12}")
+    with tempfile.TemporaryDirectory(prefix='bench-shards-') as directory:
+        # One commit per write is slow; a tenth of the writes is enough
+        rate, put, per_commit = measure(directory, 1, 1, args.writes // 10, args.users)
+        print(f"{'1 shard, commit per write':<26} {rate:>10,.0f} {put:>8.1f} {per_commit:>12.1f}")
+        for shards in (int(count) for count in args.shards.split(',')):
+            rate, put, per_commit = measure(directory, shards, SESSION_COMMIT_BATCH, args.writes, args.users)
+            label = f"{shards} shard{'s' if shards > 1 else ''}"
+            print(f"{label:<26} {rate:>10,.0f} {put:>8.1f} {per_commit:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
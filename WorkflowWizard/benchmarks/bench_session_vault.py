@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark of sealing and opening session strings with the session vault.
+
+Reports operations per second for encrypting and decrypting a session
+string when the user's data key is already cached (warm) and when it has
+to be derived with scrypt first (cold), plus batch decryption of many users'
+sessions with a cold cache.
+
+Usage: python benchmarks/bench_session_vault.py [--ops N] [--users N]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import secure_box
+from session_vault import SessionVault
+
+SESSION_STRING = "1" + "A" * 352
+TENANT = 'default'
+
+
+async def measure(vault, count, cold, operation):
+    """Operations per second of one vault operation"""
+    sealed = await vault.seal_string(TENANT, 1, SESSION_STRING)
+    start = time.perf_counter()
+    for _ in range(count):
+        if cold:
+            vault.clear()
+        if operation == 'encrypt':
+            await vault.seal_string(TENANT, 1, SESSION_STRING)
+        else:
+            await vault.open_string(TENANT, 1, sealed)
+    return count / (time.perf_counter() - start)
+
+
+async def measure_batch(vault, users, per_user=3):
+    """Sessions per second opened by open_batch() with a cold cache"""
+    items = [
+        (TENANT, user_id, await vault.seal_string(TENANT, user_id, SESSION_STRING))
+        for user_id in range(users) for _ in range(per_user)
+    ]
+    vault.clear()
+    start = time.perf_counter()
+    await vault.open_batch(items)
+    return len(items) / (time.perf_counter() - start)
+
+
+async def run(args):
+    vault = SessionVault(master_key=os.urandom(32))
+    print(f"AEAD: {'AES-GCM' if secure_box.AESGCM else 'AES-CTR + HMAC-SHA256 (pure Python)'}, "
+          f"scrypt N={vault.kdf_n}\n")
+    print(f"{'operation':<10} {'warm ops/s':>12} {'cold ops/s':>12}")
+    for operation in ('encrypt', 'decrypt'):
+        warm = await measure(vault, args.ops, False, operation)
+        cold = await measure(vault, max(1, args.ops // 100), True, operation)
+        print(f"{operation:<10} {warm:>12,.0f} {cold:>12,.1f}")
+    batch = await measure_batch(vault, args.users)
+    print(f"\nopen_batch, {args.users} users x 3 sessions, cold: {batch:,.0f} sessions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ops', type=int, default=2000, help="warm operations (cold runs 1%%)")
+    parser.add_argument('--users', type=int, default=20, help="users in the batch run")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark suite of the code that runs on every update, with baselines.
+
+Each case runs a piece of simple_bot.py or utils.py offline, against the
+fake bot and events of replay_traffic.py, in a scratch directory. For every
+case it reports nanoseconds per operation (best of several repeats) and
+bytes allocated per operation (peak traced memory of a single run, averaged).
+
+Results are compared with a stored baseline (benchmarks/baseline.json by
+default) and the run fails if any case is slower than the baseline by more
+than --margin or allocates more by more than --alloc-margin. Allocations are
+nearly deterministic; timings are not, so their margin is wider. Baselines
+are machine specific: refresh them with --update-baseline on the machine
+that runs the check.
+
+Usage: python benchmarks/bench_suite.py [--baseline FILE] [--margin 0.5]
+           [--alloc-margin 0.1] [--update-baseline] [--only SUBSTRING]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from replay_traffic import FakeBot, FakeEvent, FakeMessage
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Seconds one repeat of a case should take at least, and repeats per case
+MIN_REPEAT_SECONDS = 0.1
+REPEATS = 5
+
+# Single runs traced to measure allocations
+ALLOC_SAMPLES = 50
+
+USER_ID = 1000
+SESSION_STRING = "1" + "A" * 352
+
+
+def message(bot, text, user_id=USER_ID):
+    return FakeEvent(bot, {'user_id': user_id, 'chat_id': user_id, 'msg_id': 1, 'event': 'message', 'text': text})
+
+
+def callback(bot, data, user_id=USER_ID):
+    return FakeEvent(bot, {'user_id': user_id, 'chat_id': user_id, 'msg_id': 1, 'event': 'callback', 'data': data})
+
+
+def fake_session(number):
+    return {
+        'sealed': 'x' * 560,
+        'api_id': 1,
+        'phone': '+12345678900',
+        'user_info': {'name': 'Jane Doe', 'username': 'jane', 'id': 123456789},
+        'created_at': '2025-05-08 10:11:41',
+        'device': 'Telethon',
+        'label': f"Session {number}"
+    }
+
+
+class FakeUserClient:
+    """An authorized user client, as finish_login sees it"""
+
+    api_id = 1
+    egress_proxy = None
+
+    def __init__(self):
+        self.session = SimpleNamespace(save=lambda: SESSION_STRING)
+
+    async def get_me(self):
+        return SimpleNamespace(id=123456789, first_name='Jane', last_name='Doe', username='jane', phone='12345678900')
+
+    async def disconnect(self):
+        pass
+
+
+def build_cases(bot_module):
+    """
+    Set up every case.
+
+    Returns:
+        Dictionary of case name -> operation (a function taking no arguments,
+        which may return a coroutine to await)
+    """
+    import utils
+    from tenants import Tenant
+
+    bot = FakeBot()
+    cases = {}
+
+    def tenant_with_sessions(count):
+        tenant = Tenant(f"bench{count}", 'bench', bot, bot_module.session_store)
+        for number in range(count):
+            tenant.store.add_session(USER_ID, fake_session(number + 1))
+        return tenant
+
+    # Dispatch of an ordinary message: nothing waiting, and two waiting flows
+    # without a selector (the bot asks which flow the message is for)
+    idle = tenant_with_sessions(0)
+    idle_event = message(bot, "hello")
+    cases['dispatch: no flow'] = lambda: bot_module.message_handler(idle, idle_event)
+    ambiguous = tenant_with_sessions(0)
+    bot_module.start_flow(ambiguous, USER_ID, 'phone')
+    bot_module.start_flow(ambiguous, USER_ID, 'session_string_to_check')
+    ambiguous_event = message(bot, "hello")
+    cases['dispatch: two waiting flows'] = lambda: bot_module.message_handler(ambiguous, ambiguous_event)
+
+    # The rate limit check in front of every update, with a bucket that never
+    # runs dry
+    from inbound_limiter import InboundLimiter
+    limited = tenant_with_sessions(0)
+    limited.limiter = InboundLimiter(rate=1e9)
+    cases['dispatch: inbound limit check'] = lambda: bot_module.limit_messages(limited, idle_event)
+
+    # Callback data parsing and rendering of one session
+    managed = tenant_with_sessions(10)
+    manage_event = callback(bot, 'manage_session_7')
+    cases['manage_session callback'] = lambda: bot_module.manage_session(managed, manage_event)
+
+    for count in (10, 100, 1000):
+        tenant = tenant_with_sessions(count)
+        event = callback(bot, 'view_sessions')
+        cases[f'view_sessions: {count} sessions'] = (
+            lambda tenant=tenant, event=event: bot_module.view_sessions(tenant, event)
+        )
+
+    cases['validate_phone_number'] = lambda: utils.validate_phone_number('+1 (234) 567-8900')
+    cases['format_verification_code'] = lambda: utils.format_verification_code('1 2 3 4 5')
+
+    # Session record creation at the end of handle_code / handle_password;
+    # the record is deleted again so the user keeps one session
+    finished = tenant_with_sessions(0)
+    client = FakeUserClient()
+    status_msg = FakeMessage(bot)
+
+    async def finish_login():
+        flow = {'id': 1, 'user_id': USER_ID, 'expecting': 'code'}
+        await bot_module.finish_login(finished, flow, client, status_msg, '+12345678900')
+        finished.store.delete_session(USER_ID, 0)
+
+    cases['session record creation'] = finish_login
+
+    cases['main menu markup'] = bot_module.main_menu_markup
+    return cases
+
+
+async def time_op(op, number, is_async):
+    """Nanoseconds per call of op over number calls, with the GC off (as timeit)"""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        if is_async:
+            for _ in range(number):
+                await op()
+        else:
+            for _ in range(number):
+                op()
+        return (time.perf_counter_ns() - start) / number
+    finally:
+        gc.enable()
+
+
+async def measure(op):
+    """
+    Time and trace one case.
+
+    Returns:
+        Dictionary with ns_per_op and bytes_per_op
+    """
+    # One warm-up call, which also tells whether op returns a coroutine
+    result = op()
+    is_async = inspect.isawaitable(result)
+    if is_async:
+        await result
+
+    # Grow the number of calls until a repeat takes long enough
+    number = 1
+    while True:
+        per_op = await time_op(op, number, is_async)
+        if per_op * number >= MIN_REPEAT_SECONDS * 1e9:
+            break
+        number *= 10 if per_op * number * 10 < MIN_REPEAT_SECONDS * 1e9 else 2
+    best = min([per_op] + [await time_op(op, number, is_async) for _ in range(REPEATS - 1)])
+
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(ALLOC_SAMPLES):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = op()
+        if is_async:
+            await result
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {'ns_per_op': round(best, 1), 'bytes_per_op': round(allocated / ALLOC_SAMPLES)}
+
+
+def _change(old, new):
+    return f"{(new - old) / old:+7.1%}" if old else '    n/a'
+
+
+def _slower(result, old, margin):
+    return result['ns_per_op'] > old['ns_per_op'] * (1 + margin)
+
+
+async def run_cases(bot_module, only, baseline, margin):
+    cases = build_cases(bot_module)
+    results = {}
+    for name, op in cases.items():
+        if only and only not in name:
+            continue
+        results[name] = await measure(op)
+        # Timings are noisy: measure a case that looks slower once more and
+        # keep the better time before calling it a regression
+        old = baseline.get(name)
+        if old and _slower(results[name], old, margin):
+            retry = await measure(op)
+            results[name]['ns_per_op'] = min(results[name]['ns_per_op'], retry['ns_per_op'])
+    # Drop leftovers such as checkpoint removals scheduled by the handlers
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--margin', type=float, default=float(os.environ.get("BENCH_MARGIN", 0.5)),
+                        help="allowed relative slowdown over the baseline (default 0.5)")
+    parser.add_argument('--alloc-margin', type=float, default=float(os.environ.get("BENCH_ALLOC_MARGIN", 0.1)),
+                        help="allowed relative growth of allocations over the baseline (default 0.1)")
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--only', help="run only cases whose name contains this text")
+    args = parser.parse_args()
+    baseline_path = os.path.abspath(args.baseline)
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    # Import the bot in a scratch directory, so its database, keys and logs
+    # are throwaway
+    with tempfile.TemporaryDirectory(prefix='bench-') as scratch:
+        os.chdir(scratch)
+        os.environ.pop('TRAFFIC_RECORDING', None)
+        import simple_bot
+        results = asyncio.run(run_cases(simple_bot, args.only, baseline, args.margin))
+        simple_bot.checkpoints.close()
+        simple_bot.session_store.close()
+
+    regressions = []
+    print(f"{'case':<30} {'ns/op':>12} {'change':>8} {'bytes/op':>10} {'change':>8}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        row = f"{name:<30} {result['ns_per_op']:>12,.0f} "
+        if old is None:
+            print(row + f"{'new':>8} {result['bytes_per_op']:>10,} {'new':>8}")
+            continue
+        print(row + f"{_change(old['ns_per_op'], result['ns_per_op'])} {result['bytes_per_op']:>10,} "
+              f"{_change(old['bytes_per_op'], result['bytes_per_op'])}")
+        if _slower(result, old, args.margin):
+            regressions.append(f"{name}: ns/op {old['ns_per_op']:,.0f} -> {result['ns_per_op']:,.0f}")
+        if result['bytes_per_op'] > old['bytes_per_op'] * (1 + args.alloc_margin):
+            regressions.append(f"{name}: bytes/op {old['bytes_per_op']:,} -> {result['bytes_per_op']:,}")
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline written to {baseline_path}")
+        return
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
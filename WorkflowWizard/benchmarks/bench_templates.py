@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark of message rendering cost per message.
+
+Compares rendering the precompiled templates in message_templates.py with
+what every send used to cost: building the Markdown f-string and having
+Telethon parse it.
+
+Usage: python benchmarks/bench_templates.py [--count N]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.extensions import markdown
+import message_templates as templates
+
+SESSION_STRING = "1" + "A" * 352
+
+# (name, template, values)
+CASES = [
+    ("main menu", templates.MAIN_MENU, {}),
+    ("help", templates.HELP, {}),
+    ("session details", templates.SESSION_DETAILS, {
+        'label': "Main Account", 'phone': "+12345678900", 'name': "Jane Doe",
+        'username': "jane", 'created': "2025-05-08 10:11:41",
+        'health': "92% valid over 12 checks, last failure 2025-05-01 10:00"
+    }),
+    ("session generated", templates.SESSION_GENERATED, {
+        'user_name': "Jane Doe", 'username': "@jane", 'user_id': 123456789,
+        'phone': "+12345678900", 'session_string': SESSION_STRING
+    }),
+]
+
+
+def per_call(func, count):
+    """Best-of-three time per call in microseconds"""
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=20000, help="renders per measurement")
+    args = parser.parse_args()
+
+    print(f"{'message':<20} {'template':>12} {'markdown':>12} {'speedup':>9}")
+    for name, template, values in CASES:
+        rendered = per_call(lambda: template.render(**values), args.count)
+        # The old path: format the Markdown source, then parse it on send
+        parsed = per_call(lambda: markdown.parse(template.source.format(**values)), args.count)
+        print(f"{name:<20} {rendered:>9.2f} µs {parsed:>9.2f} µs {parsed / rendered:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the MTProto transports available to user clients.
+
+For each transport in transports.TRANSPORTS, reports the bytes sent for a
+typical mix of packet sizes (handshake header plus per-packet framing) and
+the CPU time spent framing and, for obfuscated variants, encrypting them.
+With --live it also times real handshakes (connect plus one req_pq_multi
+round trip) with every Telegram DC from this host.
+
+Usage: python benchmarks/bench_transports.py [--packets N] [--live] [--rounds N]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.network.connection.connection import ObfuscatedConnection
+from telethon.network.connection.tcpobfuscated import ObfuscatedIO
+from transports import TRANSPORTS, DC_ADDRESSES, measure_rtt
+
+# (payload bytes, share): acks and pings, typical requests, larger
+# responses, and the occasional big one (config, dialogs)
+PACKET_MIX = [(64, 0.5), (320, 0.3), (1536, 0.15), (16384, 0.05)]
+
+
+def make_payloads(count, seed=1):
+    """Build a reproducible list of MTProto-sized payloads (multiples of 4)"""
+    rng = random.Random(seed)
+    sizes, weights = zip(*PACKET_MIX)
+    return [os.urandom(size) for size in rng.choices(sizes, weights, k=count)]
+
+
+def measure_framing(name, payloads):
+    """
+    Frame all payloads as the transport would send them.
+
+    Returns:
+        (bytes on the wire, seconds of CPU)
+    """
+    cls = TRANSPORTS[name]
+    codec = cls.packet_codec(None)
+    if issubclass(cls, ObfuscatedConnection):
+        header, encryptor, _ = ObfuscatedIO.init_header(codec)
+        start = time.perf_counter()
+        sent = len(header) + sum(len(encryptor.encrypt(codec.encode_packet(p))) for p in payloads)
+    else:
+        start = time.perf_counter()
+        sent = len(codec.tag or b'') + sum(len(codec.encode_packet(p)) for p in payloads)
+    return sent, time.perf_counter() - start
+
+
+async def measure_live(rounds):
+    """Best handshake time per (DC, transport) over several rounds"""
+    results = {}
+    for dc_id in DC_ADDRESSES:
+        for name in TRANSPORTS:
+            best = None
+            for _ in range(rounds):
+                try:
+                    rtt = await measure_rtt(dc_id, name)
+                except Exception as e:
+                    results[(dc_id, name)] = f"failed: {type(e).__name__}"
+                    break
+                best = rtt if best is None else min(best, rtt)
+            if best is not None:
+                results[(dc_id, name)] = f"{best * 1000:8.1f} ms"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--packets', type=int, default=20000, help="packets in the framing mix")
+    parser.add_argument('--live', action='store_true', help="also time handshakes with Telegram's DCs")
+    parser.add_argument('--rounds', type=int, default=3, help="handshakes per DC and transport with --live")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.packets)
+    payload_bytes = sum(len(p) for p in payloads)
+    print(f"{len(payloads):,} packets, {payload_bytes:,} payload bytes\n")
+    print(f"{'transport':<26} {'bytes sent':>12} {'overhead':>10} {'CPU ns/packet':>14}")
+    for name in TRANSPORTS:
+        sent, seconds = measure_framing(name, payloads)
+        overhead = (sent - payload_bytes) / payload_bytes * 100
+        print(f"{name:<26} {sent:>12,} {overhead:>9.2f}% {seconds / len(payloads) * 1e9:>14,.0f}")
+
+    if args.live:
+        print("\nHandshake time (connect + req_pq_multi), best of", args.rounds)
+        results = asyncio.run(measure_live(args.rounds))
+        for (dc_id, name), result in results.items():
+            print(f"DC {dc_id}  {name:<26} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the memory and speed of per-session validation histories.
+
+Fills the history of many sessions to capacity and reports the memory this
+takes, scaled to one million tracked sessions, for validation_history's
+bytearray ring buffer and for the obvious alternative of a bounded deque of
+per-check dicts. Also reports the size of the stored (base64) form and the
+time to record a check and read the uptime.
+
+Usage: python benchmarks/bench_validation_history.py [--sessions N] [--size N]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation_history import CheckHistory, CHECK_HISTORY_SIZE, VALID, UNAUTHORIZED, ERROR
+
+OUTCOMES = [VALID] * 8 + [UNAUTHORIZED, ERROR]
+
+
+def make_checks(count, seed=1):
+    """Reproducible (time, outcome, latency) checks"""
+    rng = random.Random(seed)
+    start = int(time.time()) - count * 3600
+    return [(start + i * 3600, rng.choice(OUTCOMES), rng.uniform(0.2, 3.0)) for i in range(count)]
+
+
+def build_ring(sessions, size, checks):
+    histories = []
+    for _ in range(sessions):
+        history = CheckHistory(size)
+        for when, outcome, latency in checks:
+            history.record(outcome, latency, when)
+        histories.append(history)
+    return histories
+
+
+def build_dicts(sessions, size, checks):
+    histories = []
+    for _ in range(sessions):
+        history = deque(maxlen=size)
+        for when, outcome, latency in checks:
+            history.append({'time': when, 'outcome': outcome, 'latency': latency})
+        histories.append(history)
+    return histories
+
+
+def measure_memory(build, sessions, size, checks):
+    """Bytes allocated per session by build"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    histories = build(sessions, size, checks)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del histories
+    return allocated / sessions
+
+
+def per_call(func, count):
+    """Time per call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=20000, help="sessions to build (scaled to a million)")
+    parser.add_argument('--size', type=int, default=CHECK_HISTORY_SIZE, help="checks kept per session")
+    args = parser.parse_args()
+
+    checks = make_checks(args.size)
+    print(f"{args.sessions:,} sessions, {args.size} checks each\n")
+    print(f"{'storage':<22} {'bytes/session':>14} {'MB per million':>15}")
+    for name, build in (("ring buffer", build_ring), ("deque of dicts", build_dicts)):
+        per_session = measure_memory(build, args.sessions, args.size, checks)
+        print(f"{name:<22} {per_session:>14,.0f} {per_session * 1e6 / 2**20:>15,.0f}")
+
+    history = build_ring(1, args.size, checks)[0]
+    print(f"\nStored form: {len(history.to_text())} characters per session")
+    print(f"record():  {per_call(lambda: history.record(VALID, 0.5), 100000):.2f} us")
+    print(f"uptime():  {per_call(history.uptime, 100000):.2f} us")
+
+
+if __name__ == "__main__":
+    main()
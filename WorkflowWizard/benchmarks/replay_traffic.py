@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic recording through the bot's handlers.
+
+Updates recorded with TRAFFIC_RECORDING (see traffic_recorder.py) are fed
+to the handlers of simple_bot.py in a scratch directory, against fake bots
+and a fake user client that answers with the recorded RPC results. Nothing
+connects to Telegram. The run reports latency and memory allocated per
+handler, and two reports can be compared to spot regressions between code
+versions.
+
+Usage:
+    python benchmarks/replay_traffic.py run RECORDING [--fast] [--code-dir DIR] [--output REPORT]
+    python benchmarks/replay_traffic.py compare BASELINE_REPORT REPORT
+
+To compare two versions, run each checkout (e.g. a git worktree) with
+--code-dir and compare the two reports.
+"""
+import os
+import sys
+import json
+import builtins
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from types import SimpleNamespace
+from collections import defaultdict, deque
+
+DEFAULT_CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_recording(path):
+    """Read a recording into its updates and per-user queues of RPC results"""
+    updates = []
+    rpcs = defaultdict(deque)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'update':
+                updates.append(record)
+            elif record['type'] == 'rpc':
+                rpcs[(record['tenant'], record['user_id'], record['method'])].append(record)
+    return updates, rpcs
+
+
+class FakeMessage:
+    """A message sent by a fake bot"""
+
+    def __init__(self, bot, text=''):
+        self.id = bot.next_message_id()
+        self.text = text
+
+    async def edit(self, text=None, **kwargs):
+        if text is not None:
+            self.text = text
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeBot:
+    """Stands in for a tenant's bot client"""
+
+    def __init__(self):
+        self._last_message_id = 0
+
+    def next_message_id(self):
+        self._last_message_id += 1
+        return self._last_message_id
+
+    async def send_message(self, entity, text='', **kwargs):
+        return FakeMessage(self, text)
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        return None
+
+
+class FakeEvent:
+    """A recorded message or button press, with the API the handlers use"""
+
+    def __init__(self, bot, record, reply_to_msg_id=None):
+        self._bot = bot
+        self.sender_id = record['user_id']
+        self.chat_id = record['chat_id']
+        self.id = record['msg_id']
+        self.reply_to_msg_id = reply_to_msg_id
+        if record['event'] == 'callback':
+            self.data = record['data'].encode('latin-1')
+            self.text = None
+        else:
+            self.data = None
+            self.text = self.raw_text = record['text']
+
+    async def respond(self, text='', **kwargs):
+        return FakeMessage(self._bot, text)
+
+    async def edit(self, text=None, **kwargs):
+        message = FakeMessage(self._bot, text or '')
+        message.id = self.id
+        return message
+
+    async def delete(self):
+        pass
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class FakeClient:
+    """User client answering with recorded RPC results, in recorded order"""
+
+    def __init__(self, replay, context, session_string=None, api_id=None):
+        from telethon.sessions import StringSession
+        self._replay = replay
+        self.api_id = api_id
+        self.egress_proxy = None
+        self._context = context or (None, None)
+        self._connected = False
+        # Recorded session strings are masked, so every fake starts empty
+        self.session = StringSession()
+
+    async def _call(self, method, default=None):
+        tenant, user_id = self._context
+        queue = self._replay.rpcs.get((tenant, user_id, method))
+        if not queue:
+            self._replay.unmatched_rpcs += 1
+            return default
+        record = queue.popleft()
+        if self._replay.recorded_speed:
+            await asyncio.sleep(record['duration'])
+        if 'error' in record:
+            raise self._replay.make_error(record)
+        return record.get('result', default)
+
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self):
+        await self._call('connect')
+        self._connected = True
+
+    async def disconnect(self):
+        await self._call('disconnect')
+        self._connected = False
+
+    async def is_user_authorized(self):
+        return await self._call('is_user_authorized', True)
+
+    async def send_code_request(self, phone, **kwargs):
+        await self._call('send_code_request')
+        return SimpleNamespace(phone_code_hash='0' * 18)
+
+    async def sign_in(self, *args, **kwargs):
+        return await self._call('sign_in')
+
+    async def get_me(self):
+        user = await self._call('get_me') or {}
+        return SimpleNamespace(
+            id=user.get('id', self._context[1]),
+            first_name=user.get('first_name', 'x'),
+            last_name=user.get('last_name'),
+            username=user.get('username')
+        )
+
+
+class Replay:
+    """Feeds recorded updates through the handlers and measures them"""
+
+    def __init__(self, bot_module, updates, rpcs, recorded_speed):
+        self.bot_module = bot_module
+        self.updates = updates
+        self.rpcs = rpcs
+        self.recorded_speed = recorded_speed
+        self.unmatched_rpcs = 0
+        self.errors = 0
+        # handler name -> list of (seconds, bytes allocated at peak, bytes retained)
+        self.samples = defaultdict(list)
+        self.tenants = {}
+
+    def make_error(self, record):
+        """Rebuild a recorded exception"""
+        from telethon import errors
+        cls = getattr(errors, record['error'], None)
+        if cls is not None and issubclass(cls, errors.RPCError):
+            if 'capture' in record:
+                return cls(request=None, capture=record['capture'])
+            return cls(request=None)
+        cls = getattr(builtins, record['error'], None)
+        if isinstance(cls, type) and issubclass(cls, Exception):
+            return cls("replayed error")
+        return RuntimeError(record['error'])
+
+    def tenant(self, name):
+        """Get or create the fake tenant a recorded update belongs to"""
+        if name not in self.tenants:
+            from tenants import Tenant
+            tenant = Tenant(name, 'replay', FakeBot(), self.bot_module.session_store)
+            if not self.recorded_speed:
+                # Back-to-back updates would look like a flood to the limiter
+                from inbound_limiter import InboundLimiter
+                tenant.limiter = InboundLimiter(rate=0)
+            self.tenants[name] = tenant
+        return self.tenants[name]
+
+    def new_user_client(self, session_string=None, api_id=None, proxy=None):
+        from traffic_recorder import current_update
+        return FakeClient(self, current_update.get(), session_string, api_id)
+
+    def matches(self, event_type, filters, event):
+        """Apply the subset of Telethon's event filters the handlers use"""
+        import re
+        from telethon import events
+        if event_type is events.CallbackQuery:
+            if event.data is None:
+                return False
+            for name, value in filters.items():
+                if name == 'data' and event.data != value:
+                    return False
+                if name == 'pattern' and not re.compile(value.encode()).match(event.data):
+                    return False
+                if name not in ('data', 'pattern'):
+                    raise ValueError(f"Cannot replay CallbackQuery filter {name!r}")
+            return True
+        if event_type is events.NewMessage:
+            if event.text is None:
+                return False
+            for name, value in filters.items():
+                if name == 'pattern' and not re.compile(value).match(event.text):
+                    return False
+                if name != 'pattern':
+                    raise ValueError(f"Cannot replay NewMessage filter {name!r}")
+            return True
+        raise ValueError(f"Cannot replay {event_type.__name__} handlers")
+
+    async def dispatch(self, record):
+        """Run one update through every matching handler, like Telethon does"""
+        from telethon import events
+        from traffic_recorder import current_update
+        tenant = self.tenant(record['tenant'])
+        reply_to = None
+        if record.get('reply'):
+            # Point the reply at the replayed status message of the same flow
+            flow = tenant.get_flow(record['user_id'], record.get('flow'))
+            status_msg = flow.get('status_msg') if flow else None
+            reply_to = status_msg.id if status_msg else -1
+        event = FakeEvent(tenant.bot, record, reply_to)
+        current_update.set((tenant.name, event.sender_id))
+        for func, event_type, filters in self.bot_module.HANDLERS:
+            if not self.matches(event_type, filters, event):
+                continue
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                await func(tenant, event)
+            except events.StopPropagation:
+                break
+            except Exception as e:
+                self.errors += 1
+                print(f"{func.__name__} failed on update at {record['t']}s: {e!r}", file=sys.stderr)
+            finally:
+                elapsed = time.perf_counter() - start
+                current, peak = tracemalloc.get_traced_memory()
+                self.samples[func.__name__].append((elapsed, peak - before, current - before))
+
+    async def run(self):
+        """Replay all updates, sequentially or at their recorded offsets"""
+        self.bot_module.new_user_client = self.new_user_client
+        tracemalloc.start()
+        start = time.perf_counter()
+        if self.recorded_speed:
+            tasks = []
+            for record in self.updates:
+                delay = record['t'] - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.dispatch(record)))
+            await asyncio.gather(*tasks)
+        else:
+            for record in self.updates:
+                await self.dispatch(record)
+        duration = time.perf_counter() - start
+        tracemalloc.stop()
+
+        # Drop leftovers such as pending auto-delete timers
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+        return duration
+
+    def report(self, recording, duration):
+        handlers = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] * 1000 for s in samples)
+            allocated = [s[1] for s in samples]
+            handlers[name] = {
+                'calls': len(samples),
+                'latency_ms': {
+                    'mean': statistics.fmean(latencies),
+                    'p50': latencies[len(latencies) // 2],
+                    'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                    'max': latencies[-1]
+                },
+                'alloc_bytes': {
+                    'mean': statistics.fmean(allocated),
+                    'max': max(allocated)
+                },
+                'retained_bytes': sum(s[2] for s in samples)
+            }
+        return {
+            'recording': recording,
+            'mode': 'recorded' if self.recorded_speed else 'fast',
+            'updates': len(self.updates),
+            'duration': duration,
+            'errors': self.errors,
+            'unmatched_rpcs': self.unmatched_rpcs,
+            'handlers': handlers
+        }
+
+
+def run(args):
+    recording = os.path.abspath(args.recording)
+    output = os.path.abspath(args.output) if args.output else None
+    updates, rpcs = load_recording(recording)
+
+    # Import the bot from the requested checkout inside a scratch directory,
+    # so its session database, checkpoints and logs are throwaway
+    sys.path.insert(0, os.path.abspath(args.code_dir))
+    with tempfile.TemporaryDirectory(prefix='replay-') as scratch:
+        os.chdir(scratch)
+        os.environ.pop('TRAFFIC_RECORDING', None)
+        import simple_bot
+
+        replay = Replay(simple_bot, updates, rpcs, recorded_speed=not args.fast)
+        duration = asyncio.run(replay.run())
+        simple_bot.checkpoints.close()
+        simple_bot.session_store.close()
+    report = replay.report(recording, duration)
+
+    print(f"Replayed {report['updates']} updates in {duration:.2f}s ({report['mode']} mode), "
+          f"{report['errors']} handler errors, {report['unmatched_rpcs']} RPCs without a recorded result\n")
+    print(f"{'handler':<28} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'alloc B':>10}")
+    for name, stats in report['handlers'].items():
+        print(f"{name:<28} {stats['calls']:>6} {stats['latency_ms']['p50']:>9.3f} "
+              f"{stats['latency_ms']['p95']:>9.3f} {stats['alloc_bytes']['mean']:>10,.0f}")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {output}")
+
+
+def _change(old, new):
+    if not old:
+        return '    n/a'
+    return f"{(new - old) / old:+7.1%}"
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.report, encoding='utf-8') as f:
+        report = json.load(f)
+    if baseline['recording'] != report['recording'] or baseline['mode'] != report['mode']:
+        print("Warning: the reports come from different recordings or modes\n")
+
+    print(f"{'handler':<28} {'p50 ms':>17} {'change':>8} {'p95 ms':>17} {'change':>8} {'alloc B':>21} {'change':>8}")
+    for name in sorted(set(baseline['handlers']) | set(report['handlers'])):
+        old = baseline['handlers'].get(name)
+        new = report['handlers'].get(name)
+        if old is None or new is None:
+            print(f"{name:<28} only in {'report' if old is None else 'baseline'}")
+            continue
+        row = [f"{name:<28}"]
+        for key in ('p50', 'p95'):
+            a, b = old['latency_ms'][key], new['latency_ms'][key]
+            row.append(f"{a:>8.3f}->{b:<8.3f} {_change(a, b)}")
+        a, b = old['alloc_bytes']['mean'], new['alloc_bytes']['mean']
+        row.append(f"{a:>10,.0f}->{b:<10,.0f} {_change(a, b)}")
+        print(' '.join(row))
+
+    for key in ('errors', 'unmatched_rpcs'):
+        if baseline[key] != report[key]:
+            print(f"\n{key}: {baseline[key]} -> {report[key]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="replay a recording and report per-handler costs")
+    run_parser.add_argument('recording', help="file written with TRAFFIC_RECORDING")
+    run_parser.add_argument('--fast', action='store_true',
+                            help="replay updates back to back without RPC delays instead of at recorded speed")
+    run_parser.add_argument('--code-dir', default=DEFAULT_CODE_DIR, help="directory containing simple_bot.py")
+    run_parser.add_argument('--output', help="write the report as JSON to this file")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help="compare two reports")
+    compare_parser.add_argument('baseline', help="report of the old code version")
+    compare_parser.add_argument('report', help="report of the new code version")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
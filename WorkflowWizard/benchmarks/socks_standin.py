@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Local SOCKS5 server standing in for a real egress proxy.
+
+Supports CONNECT with or without username/password authentication and
+relays traffic unchanged, so user clients and the proxy prober can be run
+through it end to end. Latency and failures can be injected to watch the
+pool score and eject a bad proxy.
+
+Usage: python benchmarks/socks_standin.py [--port 1080] [--delay MS]
+           [--fail-rate P] [--username U --password P]
+
+Then start the bot with PROXIES=socks5://127.0.0.1:1080 (several stand-ins
+on different ports make a pool).
+"""
+import socket
+import random
+import asyncio
+import argparse
+
+
+class SocksStandin:
+    """Minimal SOCKS5 CONNECT proxy"""
+
+    def __init__(self, delay=0.0, fail_rate=0.0, username=None, password=None):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.username = username
+        self.password = password
+        self.connections = 0
+        self.failed = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            await self._serve(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        version, count = await reader.readexactly(2)
+        methods = await reader.readexactly(count)
+        wanted = 2 if self.username else 0
+        if version != 5 or wanted not in methods:
+            writer.write(b'\x05\xff')
+            return
+        writer.write(bytes([5, wanted]))
+        if wanted == 2:
+            await reader.readexactly(1)
+            username = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+            password = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+            ok = username == self.username and password == self.password
+            writer.write(b'\x01' + (b'\x00' if ok else b'\x01'))
+            if not ok:
+                return
+
+        _, command, _, address_type = await reader.readexactly(4)
+        if address_type == 1:
+            host = socket.inet_ntoa(await reader.readexactly(4))
+        elif address_type == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        port = int.from_bytes(await reader.readexactly(2), 'big')
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if command != 1 or random.random() < self.fail_rate:
+            self.failed += 1
+            # General failure
+            writer.write(b'\x05\x01\x00\x01' + bytes(6))
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.failed += 1
+            # Host unreachable
+            writer.write(b'\x05\x04\x00\x01' + bytes(6))
+            return
+        writer.write(b'\x05\x00\x00\x01' + bytes(6))
+        await writer.drain()
+        await asyncio.gather(
+            self._pipe(reader, upstream_writer),
+            self._pipe(upstream_reader, writer)
+        )
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port, standin):
+    server = await asyncio.start_server(standin.handle, host, port)
+    print(f"SOCKS5 stand-in listening on socks5://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1080)
+    parser.add_argument('--delay', type=float, default=0, help="added latency per connection, in ms")
+    parser.add_argument('--fail-rate', type=float, default=0, help="share of connections refused (0 to 1)")
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    standin = SocksStandin(args.delay / 1000, args.fail_rate, args.username, args.password)
+    try:
+        asyncio.run(serve(args.host, args.port, standin))
+    except KeyboardInterrupt:
+        print(f"\n{standin.connections} connections, {standin.failed} refused")
+
+
+if __name__ == '__main__':
+    main()
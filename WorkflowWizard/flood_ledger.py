@@ -0,0 +1,225 @@
+"""
+Ledger of FloodWait penalties, and retries for transient RPC errors.
+
+A FloodWaitError says Telegram will refuse a kind of request for a number
+of seconds. The ledger remembers each penalty against what it limits: the
+phone number for login RPCs, the account for RPCs of a signed-in session,
+and the API credential and egress IP (proxy, or the bot's own address) only
+for RPCs made before there is either, such as a QR login. The credential and
+egress are shared by every user, so one user's flood never penalizes them
+for the others. Handlers consult the ledger before an RPC and park or
+postpone the flow instead of hitting the same limit again; the credential
+and proxy pools skip penalized entries when choosing for a new client.
+
+User clients are created with flood_sleep_threshold=0, so Telethon raises
+every FloodWait instead of sleeping inside a handler while it holds an
+admission slot.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from telethon import errors
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Attempts and base delay (seconds) for RPCs failing with transient errors
+RPC_ATTEMPTS = int(os.environ.get("RPC_ATTEMPTS", 3))
+RPC_RETRY_BASE = float(os.environ.get("RPC_RETRY_BASE", 0.5))
+
+# Errors worth retrying for read-only calls (is_user_authorized, get_me):
+# Telegram-side failures and dropped connections. FloodWait is not among
+# them; it is parked instead.
+TRANSIENT_ERRORS = (
+    errors.ServerError,
+    errors.RpcCallFailError,
+    ConnectionError,
+    asyncio.TimeoutError
+)
+
+# Errors that mean Telegram did not carry out the call, the only ones safe
+# to retry for calls with side effects (send_code_request, sign_in). After a
+# timeout or dropped connection the call may have gone through: a second
+# send_code_request would send a new code and invalidate the first, and a
+# second sign_in would fail on the code the first one used.
+UNPROCESSED_ERRORS = (
+    errors.RpcCallFailError,
+    errors.RpcMcgetFailError
+)
+
+
+class FloodLedger:
+    """FloodWait penalties keyed by (kind, value), e.g. ('phone', '+4412...')"""
+
+    def __init__(self):
+        # key -> monotonic time the penalty ends
+        self._until = {}
+        # kind -> count
+        self.recorded = {}
+        self.avoided = {}
+
+    def record(self, keys, seconds):
+        """
+        Record a FloodWait against everything that may have caused it.
+
+        Args:
+            keys: (kind, value) pairs, see flood_keys()
+            seconds: Length of the penalty
+        """
+        until = time.monotonic() + seconds
+        for key in keys:
+            self._until[key] = max(self._until.get(key, 0.0), until)
+            self.recorded[key[0]] = self.recorded.get(key[0], 0) + 1
+        metrics.incr('flood_waits')
+        logger.warning(f"FloodWait of {seconds}s recorded for {', '.join(kind for kind, _ in keys)}")
+
+    def remaining(self, keys):
+        """
+        Get the longest running penalty among keys.
+
+        Returns:
+            Seconds until all of them may be used again (0 if none is penalized)
+        """
+        now = time.monotonic()
+        longest = 0.0
+        for key in keys:
+            until = self._until.get(key)
+            if until is None:
+                continue
+            if until <= now:
+                del self._until[key]
+            else:
+                longest = max(longest, until - now)
+        return longest
+
+    def check(self, keys):
+        """
+        Consult the ledger before an RPC; a positive result is a flood avoided.
+
+        Returns:
+            Seconds to wait before the RPC (0 if it may go ahead)
+        """
+        wait = self.remaining(keys)
+        if wait:
+            for key in keys:
+                if self.remaining([key]):
+                    self.avoided[key[0]] = self.avoided.get(key[0], 0) + 1
+            metrics.incr('floods_avoided')
+        return wait
+
+    def stats(self):
+        """
+        Running penalties, and floods recorded and avoided per key kind.
+
+        Returns:
+            Dictionary for the metrics snapshot
+        """
+        now = time.monotonic()
+        active = {}
+        for (kind, _), until in self._until.items():
+            if until > now:
+                active[kind] = active.get(kind, 0) + 1
+        return {
+            'active': active,
+            'recorded': dict(self.recorded),
+            'avoided': dict(self.avoided)
+        }
+
+
+def _app_keys(client):
+    proxy = getattr(client, 'egress_proxy', None)
+    return [('api', client.api_id), ('egress', proxy.name if proxy else 'direct')]
+
+
+def _account_key(client):
+    # The auth key id identifies the signed-in account without exposing it
+    auth_key = client.session.auth_key
+    return ('account', auth_key.key_id) if auth_key else None
+
+
+def charged_keys(client, phone=None, account=False):
+    """
+    Get the ledger keys a FloodWait of a user client is charged to.
+
+    Args:
+        client: The user client (its credential and proxy are used)
+        phone: Phone number, for login RPCs (send_code_request, sign_in)
+        account: True for RPCs of a signed-in session (get_me, ...)
+
+    Returns:
+        List of (kind, value) pairs: the phone number, or the account, or
+        (without either) the credential and egress
+    """
+    if phone:
+        return [('phone', phone)]
+    if account and _account_key(client):
+        return [_account_key(client)]
+    return _app_keys(client)
+
+
+def flood_keys(client, phone=None, account=False):
+    """
+    Get the ledger keys the next RPC of a user client depends on.
+
+    Login RPCs are refused while their phone number, their credential or
+    their egress is penalized; RPCs of a signed-in session only while its
+    account is.
+
+    Args:
+        client: The user client (its credential and proxy are used)
+        phone: Phone number, for login RPCs
+        account: True for RPCs of a signed-in session
+
+    Returns:
+        List of (kind, value) pairs
+    """
+    if account and not phone and _account_key(client):
+        return [_account_key(client)]
+    keys = _app_keys(client)
+    if phone:
+        keys.append(('phone', phone))
+    return keys
+
+
+async def with_retries(func, *args, retry_on=TRANSIENT_ERRORS, **kwargs):
+    """
+    Await an RPC, retrying transient errors with jittered exponential backoff.
+
+    Not for client.connect(), which Telethon retries itself.
+
+    Args:
+        func: Coroutine function to call, e.g. client.get_me
+        *args, **kwargs: Its arguments
+        retry_on: Errors to retry; UNPROCESSED_ERRORS for calls that must
+            not run twice
+
+    Returns:
+        The RPC result; the last error is raised when all attempts fail
+    """
+    for attempt in range(RPC_ATTEMPTS):
+        try:
+            return await func(*args, **kwargs)
+        except retry_on as e:
+            if attempt == RPC_ATTEMPTS - 1:
+                raise
+            # Full jitter keeps retries of many flows from lining up
+            delay = random.uniform(0, RPC_RETRY_BASE * 2 ** attempt)
+            metrics.incr('rpc_retries')
+            logger.info(f"Retrying {getattr(func, '__name__', 'RPC')} in {delay:.2f}s after {type(e).__name__}")
+            await asyncio.sleep(delay)
+
+
+def describe_wait(seconds):
+    """Format a penalty for users, e.g. '2 minutes'"""
+    seconds = int(seconds) + 1
+    if seconds < 90:
+        return f"{seconds} seconds"
+    if seconds < 5400:
+        return f"{round(seconds / 60)} minutes"
+    return f"{round(seconds / 3600)} hours"
+
+
+# Shared by every hosted bot: the limits are Telegram's, not per tenant
+ledger = FloodLedger()
@@ -0,0 +1,156 @@
+"""
+Encrypted checkpoints of in-flight login flows.
+
+Every transition of a phone -> code -> 2FA flow is written to a small
+encrypted file per (bot, user, flow), so that a bot restarted by the supervisor can
+pick the flow up at the same step instead of asking Telegram for a new code.
+Writes go through a single background thread in submission order.
+
+The key is kept apart from the checkpoints it protects (CHECKPOINT_KEY, or
+CHECKPOINT_KEY_FILE outside CHECKPOINT_DIR), so a copy of the checkpoint
+directory alone reveals nothing.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from secure_box import seal, open_sealed, load_or_create_key, DecryptionError
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", "checkpoints")
+
+# Key file, used when CHECKPOINT_KEY is not set; must not be in CHECKPOINT_DIR
+CHECKPOINT_KEY_FILE = os.environ.get("CHECKPOINT_KEY_FILE", "checkpoint.key")
+
+# Login codes expire after a few minutes, so older checkpoints are useless
+CHECKPOINT_TTL = int(os.environ.get("CHECKPOINT_TTL", 900))
+
+# Stages of the login flow that are worth restoring after a restart
+CHECKPOINT_STAGES = ('phone', 'code', 'password')
+
+_SUFFIX = '.ckpt'
+
+
+def _load_key(directory, key_file):
+    """Load the checkpoint key, refusing to keep it next to the checkpoints"""
+    if os.environ.get('CHECKPOINT_KEY'):
+        return load_or_create_key('CHECKPOINT_KEY', key_file)
+    directory = os.path.realpath(directory)
+    if os.path.commonpath([directory, os.path.realpath(key_file)]) == directory:
+        raise ValueError(f"CHECKPOINT_KEY_FILE {key_file} must be outside CHECKPOINT_DIR {directory}")
+    # Versions before CHECKPOINT_KEY_FILE kept the key in the directory
+    old_key_file = os.path.join(directory, 'checkpoint.key')
+    if os.path.exists(old_key_file) and not os.path.exists(key_file):
+        shutil.move(old_key_file, key_file)
+        logger.warning(f"Moved the checkpoint key out of {directory} to {key_file}")
+    return load_or_create_key('CHECKPOINT_KEY', key_file)
+
+
+class FlowCheckpointStore:
+    """Directory of encrypted flow checkpoints, one file per (tenant, user, flow)"""
+
+    def __init__(self, directory=CHECKPOINT_DIR, key=None, ttl=CHECKPOINT_TTL, key_file=CHECKPOINT_KEY_FILE):
+        """
+        Args:
+            directory: Where checkpoints are written
+            key: 32-byte key; otherwise CHECKPOINT_KEY or key_file is used
+            ttl: Seconds a checkpoint stays restorable
+            key_file: Key file outside directory, created if missing
+
+        Raises:
+            ValueError: If key_file is inside directory
+        """
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.key = key or _load_key(directory, key_file)
+        # One worker keeps writes and deletions for a user in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+
+    def _path(self, tenant, user_id, flow_id):
+        return os.path.join(self.directory, f"{tenant}.{user_id}.{flow_id}{_SUFFIX}")
+
+    def save(self, tenant, user_id, flow_id, state):
+        """
+        Queue a checkpoint write without waiting for it.
+
+        Args:
+            tenant: Name of the bot the flow runs on
+            user_id: Telegram user id owning the flow
+            flow_id: The user's id for the flow
+            state: JSON-serializable flow state
+        """
+        state = dict(state, saved_at=time.time())
+        self._writer.submit(self._write, tenant, user_id, flow_id, state)
+
+    def discard(self, tenant, user_id, flow_id):
+        """Queue removal of a flow's checkpoint, if any"""
+        self._writer.submit(self._remove, tenant, user_id, flow_id)
+
+    def load_all(self):
+        """
+        Read every checkpoint that is still fresh.
+
+        Expired, corrupt or undecryptable checkpoints are removed.
+
+        Returns:
+            Dictionary mapping (tenant, user id, flow id) to the saved flow state
+        """
+        flows = {}
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            try:
+                tenant, user_id, flow_id = name[:-len(_SUFFIX)].rsplit('.', 2)
+                user_id = int(user_id)
+                flow_id = int(flow_id)
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    blob = f.read()
+                state = json.loads(open_sealed(self.key, blob, _aad(tenant, user_id, flow_id)))
+            except (ValueError, OSError, DecryptionError) as e:
+                logger.warning(f"Dropping unreadable checkpoint {name}: {e}")
+                self._remove_file(os.path.join(self.directory, name))
+                continue
+
+            if now - state.get('saved_at', 0) > self.ttl:
+                self._remove(tenant, user_id, flow_id)
+                continue
+            flows[(tenant, user_id, flow_id)] = state
+        return flows
+
+    def close(self):
+        """Wait for pending writes to finish"""
+        self._writer.shutdown(wait=True)
+
+    def _write(self, tenant, user_id, flow_id, state):
+        path = self._path(tenant, user_id, flow_id)
+        blob = seal(self.key, json.dumps(state).encode(), _aad(tenant, user_id, flow_id))
+        tmp_path = path + '.tmp'
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write checkpoint for user {user_id}: {e}")
+
+    def _remove(self, tenant, user_id, flow_id):
+        self._remove_file(self._path(tenant, user_id, flow_id))
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not remove checkpoint {path}: {e}")
+
+
+def _aad(tenant, user_id, flow_id):
+    """Bind a checkpoint to its owner so files cannot be swapped between users"""
+    return f"{tenant}:{user_id}:{flow_id}".encode()
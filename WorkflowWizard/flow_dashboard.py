@@ -0,0 +1,264 @@
+"""
+Live dashboard of in-flight flows: how many users are in each stage and for
+how long.
+
+The bot side (publish_snapshots) aggregates the flows of every tenant once
+per DASHBOARD_INTERVAL and sends the result as one small JSON datagram to
+DASHBOARD_ADDRESS on localhost. Snapshots carry only counts and ages per
+stage and per bot, never user ids or phone numbers. Sending is
+fire-and-forget, so the bot's cost is the same whether nobody or a hundred
+people are watching.
+
+The status app side (SnapshotBuffer, start_receiver) receives the datagrams
+on a thread and keeps the most recent ones, already encoded as
+Server-Sent Events, in one buffer shared by every viewer of
+/dashboard/stream.
+
+The buffer lives in one process, and each viewer holds a server thread for
+as long as it watches. The status app must therefore run as a single
+threaded worker (gunicorn -k gthread --workers 1, as in .replit): a sync
+worker would be blocked by the first viewer and killed by its timeout, and
+with several workers only the one that bound DASHBOARD_ADDRESS would get
+snapshots. At most DASHBOARD_MAX_VIEWERS viewers stream at once, so
+threads are always left for the other pages.
+
+The bot cannot see when a flow entered its stage, so the publisher notes
+the first snapshot in which it saw a flow in its current stage; ages are
+accurate to one interval.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Local UDP address the bot sends snapshots to and the status app listens on
+DASHBOARD_ADDRESS = os.environ.get("DASHBOARD_ADDRESS", "127.0.0.1:8766")
+
+# Seconds between snapshots
+DASHBOARD_INTERVAL = float(os.environ.get("DASHBOARD_INTERVAL", 1))
+
+# Snapshots kept by the status app, sent to a viewer when it connects
+DASHBOARD_HISTORY = int(os.environ.get("DASHBOARD_HISTORY", 120))
+
+# Stages shown even when empty, in flow order
+STAGES = ('phone', 'code', 'password', 'parked', 'qr', 'session_string_to_check', 'session_label')
+
+# Upper bounds in seconds of the age buckets; the last bucket is open-ended
+AGE_BUCKETS = (30, 120, 600)
+
+# Viewers streamed at once; keep it below the status app's thread count
+DASHBOARD_MAX_VIEWERS = int(os.environ.get("DASHBOARD_MAX_VIEWERS", 16))
+
+# Seconds a viewer waits for a snapshot before it is sent a keep-alive
+_KEEPALIVE = 15
+
+# Largest datagram accepted
+_MAX_DATAGRAM = 65507
+
+# The receiver thread of this process, once started
+_receiver = None
+
+
+def parse_address(address):
+    """
+    Split a "host:port" address.
+
+    Returns:
+        Tuple of (host, port)
+
+    Raises:
+        ValueError: If the address is malformed
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep or not host or not port.isdigit():
+        raise ValueError(f"Expected host:port for DASHBOARD_ADDRESS, got {address!r}")
+    return host, int(port)
+
+
+class FlowSnapshotter:
+    """Builds anonymized per-stage aggregates of the tenants' flows"""
+
+    def __init__(self, tenants):
+        self.tenants = tenants
+        # (tenant, user id, flow id) -> (stage, monotonic time first seen in it)
+        self._since = {}
+
+    def snapshot(self, now=None):
+        """
+        Aggregate the current flows.
+
+        Returns:
+            Dictionary with the time, the total, per-stage count, median
+            and maximum age in seconds plus age bucket counts, and the
+            number of flows per bot
+        """
+        now = now or time.monotonic()
+        since = {}
+        ages = {stage: [] for stage in STAGES}
+        per_tenant = {}
+        for tenant in self.tenants:
+            per_tenant[tenant.name] = tenant.count_flows()
+            for flow in tenant.all_flows():
+                key = (tenant.name, flow['user_id'], flow['id'])
+                stage = flow.get('expecting')
+                seen = self._since.get(key)
+                entered = seen[1] if seen and seen[0] == stage else now
+                since[key] = (stage, entered)
+                ages.setdefault(stage, []).append(now - entered)
+        # Forget flows that are gone
+        self._since = since
+
+        stages = {}
+        for stage, values in ages.items():
+            values.sort()
+            buckets = [0] * (len(AGE_BUCKETS) + 1)
+            for age in values:
+                buckets[next((i for i, bound in enumerate(AGE_BUCKETS) if age < bound), len(AGE_BUCKETS))] += 1
+            stages[stage] = {
+                'n': len(values),
+                'p50': round(values[len(values) // 2], 1) if values else 0,
+                'max': round(values[-1], 1) if values else 0,
+                'buckets': buckets
+            }
+        return {
+            't': round(time.time(), 3),
+            'total': len(since),
+            'stages': stages,
+            'bots': per_tenant
+        }
+
+
+async def publish_snapshots(tenants, address=DASHBOARD_ADDRESS, interval=DASHBOARD_INTERVAL):
+    """Send a snapshot of the tenants' flows every interval seconds"""
+    try:
+        target = parse_address(address)
+    except ValueError as e:
+        logger.error(f"Flow dashboard disabled: {e}")
+        return
+    snapshotter = FlowSnapshotter(tenants)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        while True:
+            await asyncio.sleep(interval)
+            data = json.dumps(snapshotter.snapshot(), separators=(',', ':')).encode()
+            try:
+                sock.sendto(data, target)
+            except OSError:
+                # Nobody is listening (or the buffer is full); the next
+                # snapshot supersedes this one anyway
+                pass
+
+
+class SnapshotBuffer:
+    """Recent snapshots as ready-to-send SSE frames, shared by all viewers"""
+
+    def __init__(self, size=DASHBOARD_HISTORY, max_viewers=DASHBOARD_MAX_VIEWERS):
+        # (sequence number, encoded event), oldest first
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._changed = threading.Condition()
+        self.received = 0
+        self.max_viewers = max_viewers
+        self.viewers = 0
+
+    def add_viewer(self):
+        """
+        Take a viewer slot; release it with remove_viewer().
+
+        Returns:
+            False if DASHBOARD_MAX_VIEWERS viewers are streaming already
+        """
+        with self._changed:
+            if self.viewers >= self.max_viewers:
+                return False
+            self.viewers += 1
+            return True
+
+    def remove_viewer(self):
+        """
+        Release a viewer slot.
+
+        A viewer that went away is only noticed on the next write to it, a
+        snapshot or a keep-alive at most _KEEPALIVE seconds later.
+        """
+        with self._changed:
+            self.viewers -= 1
+
+    def put(self, snapshot):
+        """Add a snapshot (JSON text) and wake every waiting viewer"""
+        with self._changed:
+            self._seq += 1
+            self.received += 1
+            self._events.append((self._seq, f"id: {self._seq}\ndata: {snapshot}\n\n".encode()))
+            self._changed.notify_all()
+
+    def wait(self, after, timeout=_KEEPALIVE):
+        """
+        Wait for snapshots newer than a sequence number.
+
+        Args:
+            after: Last sequence number the viewer has, 0 for none
+            timeout: Seconds to wait at most
+
+        Returns:
+            List of (sequence number, encoded event), empty on timeout
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._seq > after, timeout)
+            return [(seq, event) for seq, event in self._events if seq > after]
+
+    def stream(self):
+        """Generate SSE frames for one viewer, starting with the buffered history"""
+        # Sent at once, so the response starts before the first snapshot
+        yield b": connected\n\n"
+        last = 0
+        while True:
+            events = self.wait(last)
+            if not events:
+                yield b": keep-alive\n\n"
+                continue
+            for last, event in events:
+                yield event
+
+
+def start_receiver(buffer, address=DASHBOARD_ADDRESS):
+    """
+    Receive the bot's snapshots into a buffer on a daemon thread.
+
+    Only the first call in a process binds the address; later calls return
+    the running thread.
+
+    Returns:
+        The thread, or None if the address could not be bound
+    """
+    global _receiver
+    if _receiver is not None:
+        return _receiver
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(parse_address(address))
+    except (OSError, ValueError) as e:
+        # Typically another worker process has it; see the module docstring
+        logger.error(f"Flow dashboard disabled in process {os.getpid()}, cannot listen on {address}: {e}")
+        sock.close()
+        return None
+
+    def receive():
+        while True:
+            data = sock.recv(_MAX_DATAGRAM)
+            try:
+                snapshot = json.loads(data)
+            except ValueError:
+                logger.warning("Ignoring malformed dashboard snapshot")
+                continue
+            buffer.put(json.dumps(snapshot, separators=(',', ':')))
+
+    _receiver = threading.Thread(target=receive, name='flow-dashboard', daemon=True)
+    _receiver.start()
+    return _receiver
@@ -0,0 +1,142 @@
+"""
+Per-user rate limit on incoming updates, applied before any handler runs.
+
+Every message and button press of a user spends tokens from that user's
+bucket; /start costs INBOUND_START_COST tokens as it tears down the user's
+flows and their clients. A user who runs their bucket dry is muted for
+INBOUND_MUTE_SECONDS: they get a single notice, and everything they send
+until the mute ends is dropped without touching a handler or the API.
+
+Buckets are kept in GCRA form: one float per user, the time at which the
+bucket will be full again. A full bucket needs no entry at all, so entries
+that reach that time are dropped by a sweep every INBOUND_SWEEP_INTERVAL
+seconds and memory follows the number of recently active users only.
+"""
+import os
+import time
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tokens refilled per second and bucket size; INBOUND_RATE=0 turns the
+# limit off
+INBOUND_RATE = float(os.environ.get("INBOUND_RATE", 1))
+INBOUND_BURST = int(os.environ.get("INBOUND_BURST", 20))
+
+# Tokens spent by /start (other updates spend one)
+INBOUND_START_COST = int(os.environ.get("INBOUND_START_COST", 5))
+
+# Seconds a user who ran out of tokens is ignored
+INBOUND_MUTE_SECONDS = float(os.environ.get("INBOUND_MUTE_SECONDS", 60))
+
+# Seconds between sweeps of idle buckets and ended mutes
+INBOUND_SWEEP_INTERVAL = float(os.environ.get("INBOUND_SWEEP_INTERVAL", 60))
+
+# Verdicts of InboundLimiter.check()
+ALLOWED = 0
+# The update is dropped and the user muted; tell them once
+MUTED = 1
+# The update is dropped silently; the user already got the notice
+DROPPED = 2
+
+
+class InboundLimiter:
+    """Token buckets and mutes of one bot's users"""
+
+    def __init__(self, rate=INBOUND_RATE, burst=INBOUND_BURST, mute_seconds=INBOUND_MUTE_SECONDS,
+                 sweep_interval=INBOUND_SWEEP_INTERVAL):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.mute_seconds = mute_seconds
+        self.sweep_interval = sweep_interval
+        # Seconds one token takes to refill, and the most a bucket's full
+        # time may run ahead of now
+        self._interval = 1 / rate if rate > 0 else 0.0
+        self._tolerance = self.burst * self._interval
+        # user id -> monotonic time the bucket is full again
+        self._full_at = {}
+        # user id -> monotonic time the mute ends
+        self._muted_until = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.allowed = 0
+        self.dropped = 0
+        self.mutes = 0
+
+    def check(self, user_id, cost=1, now=None):
+        """
+        Spend tokens for one update of a user.
+
+        Args:
+            user_id: Sender of the update
+            cost: Tokens the update spends (at most the bucket size)
+            now: Monotonic time, now by default
+
+        Returns:
+            ALLOWED, MUTED (first update over the limit) or DROPPED
+        """
+        if not self._interval:
+            return ALLOWED
+        if now is None:
+            now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        muted_until = self._muted_until.get(user_id)
+        if muted_until is not None:
+            if now < muted_until:
+                self.dropped += 1
+                metrics.incr('inbound_dropped')
+                return DROPPED
+            # The mute ended: start over with a full bucket
+            del self._muted_until[user_id]
+            self._full_at.pop(user_id, None)
+
+        full_at = max(self._full_at.get(user_id, now), now) + min(cost, self.burst) * self._interval
+        if full_at - now <= self._tolerance:
+            self._full_at[user_id] = full_at
+            self.allowed += 1
+            return ALLOWED
+
+        self._muted_until[user_id] = now + self.mute_seconds
+        self._full_at.pop(user_id, None)
+        self.dropped += 1
+        self.mutes += 1
+        metrics.incr('inbound_dropped')
+        metrics.incr('inbound_mutes')
+        logger.warning(f"Muted user {user_id} for {self.mute_seconds:.0f}s: too many updates")
+        return MUTED
+
+    def sweep(self, now=None):
+        """
+        Forget full buckets and ended mutes.
+
+        Returns:
+            Number of entries removed
+        """
+        if now is None:
+            now = time.monotonic()
+        idle = [user_id for user_id, full_at in self._full_at.items() if full_at <= now]
+        for user_id in idle:
+            del self._full_at[user_id]
+        ended = [user_id for user_id, until in self._muted_until.items() if until <= now]
+        for user_id in ended:
+            del self._muted_until[user_id]
+        self._next_sweep = now + self.sweep_interval
+        return len(idle) + len(ended)
+
+    def stats(self):
+        """
+        Get limiter statistics.
+
+        Returns:
+            Dictionary with tracked and muted users, allowed and dropped
+            updates and mutes
+        """
+        return {
+            'tracked_users': len(self._full_at),
+            'muted_users': len(self._muted_until),
+            'allowed': self.allowed,
+            'dropped': self.dropped,
+            'mutes': self.mutes
+        }
@@ -0,0 +1,273 @@
+"""
+Non-blocking logging pipeline shared by the bot and its supervisor.
+
+Log calls only put the record on a bounded in-memory queue. A background
+listener thread does the expensive part: rate-limiting repetitive messages,
+redacting phone numbers, codes, passwords and session strings, and writing
+JSON lines to a size-rotated file alongside a plain console stream.
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Where log files are written and how they are rotated
+LOG_DIR = os.environ.get("LOG_DIR", ".")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 3))
+
+# Maximum number of records waiting for the listener thread; beyond this
+# records are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Rate limiting: each kind of message may be logged LOG_BURST times per
+# LOG_WINDOW seconds, after which only every LOG_SAMPLE_EVERY-th one passes
+LOG_WINDOW = float(os.environ.get("LOG_WINDOW", 60))
+LOG_BURST = int(os.environ.get("LOG_BURST", 5))
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", 0))
+
+CONSOLE_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Phone numbers without a leading '+' need at least this many digits when
+# written as one run; shorter runs are usually Telegram user ids
+_BARE_PHONE_MIN_DIGITS = 11
+_SPACED_PHONE_MIN_DIGITS = 10
+_PHONE_MAX_DIGITS = 15
+
+
+def _redact_bare_phone(match):
+    """Mask a number without '+' if it has as many digits as a phone number"""
+    number = match.group(0)
+    digits = sum(char.isdigit() for char in number)
+    minimum = _BARE_PHONE_MIN_DIGITS if number.isdigit() else _SPACED_PHONE_MIN_DIGITS
+    return '[PHONE]' if minimum <= digits <= _PHONE_MAX_DIGITS else number
+
+
+# Precompiled redaction patterns, applied in order
+REDACTION_PATTERNS = [
+    # Telethon StringSession: version byte '1' followed by ~350 base64 chars
+    (re.compile(r'\b1[A-Za-z0-9_\-]{200,}={0,2}'), '[SESSION]'),
+    # Long hex blobs such as phone_code_hash values and auth keys
+    (re.compile(r'\b[0-9a-fA-F]{16,}\b'), '[HEX]'),
+    # Passwords and 2FA secrets given as "password: value", quoted or not
+    (re.compile(r'(?i)\b((?:password|passwd|2fa|two[- ]factor)\b\s*[:=]\s*)(?:"[^"]*"|\'[^\']*\'|\S+)'),
+     r'\1[SECRET]'),
+    # Verification codes and passwords given with their keyword
+    (re.compile(r'(?i)\b((?:code|password)\b\W{0,3})\d[\d \-]{2,10}\d'), r'\1[CODE]'),
+    # International phone numbers, optionally spaced or dashed
+    (re.compile(r'\+\d[\d \-()]{5,18}\d'), '[PHONE]'),
+    # Phone numbers without '+', such as 15551234567 or 555 123 4567; not
+    # part of a longer id, a negative chat id, a decimal or a time
+    (re.compile(r'(?<![\w\-+.:])\(?\d[\d \-()]{8,18}\d(?![\w\-.:])'), _redact_bare_phone),
+]
+
+# Normalizes digits so that messages differing only in ids, IPs or counters
+# share a rate-limit key
+_DIGITS = re.compile(r'\d+')
+
+
+def redact(text: str) -> str:
+    """
+    Remove sensitive values from a log message.
+
+    Args:
+        text: The rendered log message
+
+    Returns:
+        The message with phone numbers, codes, passwords and session
+        strings masked
+    """
+    for pattern, replacement in REDACTION_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFormatter(logging.Formatter):
+    """Formatter that redacts the fully rendered record, traceback included"""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter producing one redacted JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': redact(record.getMessage()),
+        }
+        if record.exc_info:
+            entry['exc'] = redact(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry['exc'] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimiter:
+    """
+    Per-message-kind rate limiter with optional sampling.
+
+    Only used from the listener thread, so it keeps no locks.
+    """
+
+    def __init__(self, window=LOG_WINDOW, burst=LOG_BURST, sample_every=LOG_SAMPLE_EVERY):
+        self.window = window
+        self.burst = burst
+        self.sample_every = sample_every
+        self.window_start = time.monotonic()
+        # key -> [seen in window, suppressed in window]
+        self.counts = {}
+
+    def allow(self, record):
+        """
+        Decide whether a record should be written.
+
+        Args:
+            record: The log record
+
+        Returns:
+            Tuple containing:
+            - Boolean indicating if the record passes
+            - List of summary records for messages suppressed in the last window
+        """
+        summaries = []
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            summaries = self._flush_window()
+            self.window_start = now
+
+        # Warnings and errors are never dropped
+        if record.levelno >= logging.WARNING:
+            return True, summaries
+
+        # Redacted first: the key becomes the text of the summary record, and
+        # normalizing digits would stop the patterns from recognizing secrets
+        key = (record.name, record.levelno, _DIGITS.sub('#', redact(record.getMessage()))[:200])
+        count = self.counts.get(key)
+        if count is None:
+            self.counts[key] = [1, 0]
+            return True, summaries
+
+        count[0] += 1
+        if count[0] <= self.burst:
+            return True, summaries
+        if self.sample_every and (count[0] - self.burst) % self.sample_every == 0:
+            return True, summaries
+        count[1] += 1
+        return False, summaries
+
+    def _flush_window(self):
+        """Build summary records for suppressed messages and reset counters"""
+        summaries = []
+        for (name, levelno, message), (_, suppressed) in self.counts.items():
+            if suppressed:
+                summaries.append(logging.LogRecord(
+                    name, levelno, __file__, 0,
+                    "Suppressed %d similar messages in %ds: %s",
+                    (suppressed, int(self.window), message), None
+                ))
+        self.counts = {}
+        return summaries
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and defers formatting to the listener"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message now so later mutation of args cannot change it,
+        # but leave traceback formatting to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class FilteringQueueListener(logging.handlers.QueueListener):
+    """QueueListener that rate-limits records before handing them on"""
+
+    def __init__(self, log_queue, *handlers, limiter=None):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.limiter = limiter or RateLimiter()
+        self.running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        super().stop()
+
+    def handle(self, record):
+        allowed, summaries = self.limiter.allow(record)
+        for summary in summaries:
+            super().handle(summary)
+        if allowed:
+            super().handle(record)
+
+
+def setup_logging(log_name, level=logging.INFO):
+    """
+    Route all logging through a background thread.
+
+    Replaces the root handlers with a non-blocking queue handler. The
+    listener thread writes redacted JSON lines to a size-rotated file in
+    LOG_DIR and a redacted plain copy to stderr.
+
+    Args:
+        log_name: Base name of the log file, e.g. 'bot' writes 'bot.log'
+        level: Minimum level for the root logger
+
+    Returns:
+        The started listener
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(LOG_DIR, f"{log_name}.log"),
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(RedactingFormatter(CONSOLE_FORMAT))
+
+    listener = FilteringQueueListener(log_queue, file_handler, console_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener):
+    """Stop the listener if it is still running"""
+    if listener.running:
+        listener.stop()
@@ -0,0 +1,182 @@
+"""
+Event loop lag watchdog and on-demand profiler.
+
+All hosted bots share one event loop, so a handler that blocks it (CPU-bound
+crypto, synchronous I/O, a huge render) stalls every user. The watchdog runs
+a heartbeat task that measures how late the loop wakes it up. A monitor
+thread notices when the heartbeat is overdue and, while the loop is still
+blocked, captures the loop thread's stack and attributes it to the handler
+it is running in. Stalls are logged and exported through the metrics
+snapshot.
+
+capture_profile() runs cProfile over the live loop for a few seconds and
+writes a stats file for later analysis with pstats or snakeviz.
+"""
+import os
+import sys
+import time
+import asyncio
+import cProfile
+import logging
+import threading
+import traceback
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.25))
+
+# Lag in seconds beyond which the loop counts as blocked
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD", 0.2))
+
+# Where profiler captures are written, and the longest allowed capture
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", 120))
+
+# Frames of the blocking stack included in the log message
+_STACK_LIMIT = 15
+
+
+class LoopWatchdog:
+    """Measures event loop lag and attributes stalls to handlers"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalls_by_handler = {}
+        # code object -> handler name
+        self._handler_codes = {}
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._beats = 0
+        # Beat number of the stall already captured, and what was captured
+        self._captured_beat = -1
+        self._capture = None
+        self._stopped = threading.Event()
+
+    def start(self, handlers=()):
+        """
+        Start watching the running event loop.
+
+        Args:
+            handlers: Handler functions that stalls are attributed to
+        """
+        self._handler_codes = {func.__code__: func.__name__ for func in handlers}
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        """Stop the monitor thread"""
+        self._stopped.set()
+
+    async def _heartbeat(self):
+        while not self._stopped.is_set():
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            self._beats += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self._report_stall(lag)
+
+    def _report_stall(self, lag):
+        capture, self._capture = self._capture, None
+        handler, stack = capture or ('unknown', None)
+        self.stalls += 1
+        self.stalls_by_handler[handler] = self.stalls_by_handler.get(handler, 0) + 1
+        metrics.incr('loop_stalls')
+        if stack:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms in {handler}:\n{stack}")
+        else:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms")
+
+    def _monitor(self):
+        """Thread that captures the loop's stack while it is blocked"""
+        poll = self.threshold / 4
+        while not self._stopped.wait(poll):
+            beat = self._beats
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue > self.threshold and beat != self._captured_beat:
+                self._captured_beat = beat
+                self._capture = self._capture_stack()
+
+    def _capture_stack(self):
+        """Get the handler the loop thread is running and its stack"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        handler = None
+        walk = frame
+        # The outermost registered handler on the stack owns the stall
+        while walk is not None:
+            name = self._handler_codes.get(walk.f_code)
+            if name is not None:
+                handler = name
+            walk = walk.f_back
+        stack = ''.join(traceback.format_stack(frame, limit=_STACK_LIMIT))
+        return handler or 'unknown', stack
+
+    def stats(self):
+        """
+        Get lag statistics.
+
+        Returns:
+            Dictionary with the last and maximum lag and stall counts per handler
+        """
+        return {
+            'last_lag_ms': round(self.last_lag * 1000, 1),
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'threshold_ms': self.threshold * 1000,
+            'stalls': self.stalls,
+            'stalls_by_handler': dict(self.stalls_by_handler)
+        }
+
+
+# Guards against overlapping captures; cProfile profiles one at a time
+_profiling = False
+
+
+async def capture_profile(seconds, directory=PROFILE_DIR):
+    """
+    Profile everything the event loop runs for a while.
+
+    Args:
+        seconds: Length of the capture, capped at PROFILE_MAX_SECONDS
+        directory: Where the stats file is written
+
+    Returns:
+        Path of the written stats file
+
+    Raises:
+        RuntimeError: If a capture is already running
+    """
+    global _profiling
+    if _profiling:
+        raise RuntimeError("A profile capture is already running")
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    _profiling = True
+    try:
+        # Enabled from the loop thread, so it sees every callback the loop runs
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _profiling = False
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{seconds}s.pstats")
+    await asyncio.to_thread(profiler.dump_stats, path)
+    logger.info(f"Wrote {seconds}s profile to {path}")
+    return path
@@ -12,7 +12,10 @@ import logging
 import subprocess
 import threading
 import time
-from flask import Flask, render_template_string
+from flask import Flask, Response, render_template_string, jsonify
+import metrics
+from flow_dashboard import SnapshotBuffer, start_receiver, STAGES
+from log_pipeline import setup_logging
 
 # Create a Flask app
 app = Flask(__name__)
@@ -21,19 +24,19 @@ app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
-# Configure our own logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+# Configure our own logging (handled on a background thread, see log_pipeline.py)
+setup_logging('app')
 logger = logging.getLogger(__name__)
 
 # Global variable to track the bot process
 bot_process = None
 
+# Any of these configures the bot(s) hosted by simple_bot.py
+BOT_CONFIG_VARIABLES = ("TELEGRAM_BOT_TOKEN", "TELEGRAM_BOT_TOKENS", "BOTS_CONFIG")
+
+# Flow snapshots pushed by the bot, shared by every dashboard viewer
+dashboard_buffer = SnapshotBuffer()
+
 @app.route('/')
 def index():
     """Main route that shows the bot status"""
@@ -65,6 +68,17 @@ def index():
                 <div class="card-body">
                     <h4 class="text-success">✅ Bot is running</h4>
                     <p>The Telegram bot is actively running in the background.</p>
+                    <p><a href="/dashboard"><i class="bi bi-activity"></i> Live flow dashboard</a></p>
+                    {% if aes %}
+                    <p>Encryption backend: <strong>{{ aes.backend }}</strong>
+                        ({{ aes.mbps[aes.backend] }} MB/s AES-IGE)</p>
+                    {% if aes.slow %}
+                    <div class="alert alert-warning">
+                        <i class="bi bi-speedometer"></i> Encryption is running on the slow pure-Python path.
+                        Install <code>cryptg</code> for native speed.
+                    </div>
+                    {% endif %}
+                    {% endif %}
                     
                     <h5>Key Features:</h5>
                     <ul>
@@ -113,19 +127,115 @@ def index():
     </body>
     </html>
     """
-    return render_template_string(template)
+    snapshot = metrics.read_snapshot() or {}
+    return render_template_string(template, aes=snapshot.get('gauges', {}).get('aes_backend'))
+
+@app.route('/dashboard')
+def dashboard():
+    """Auto-updating view of in-flight flows per stage"""
+    template = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>In-flight flows</title>
+        <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
+        <style>
+            .container {
+                max-width: 800px;
+                margin-top: 50px;
+            }
+        </style>
+    </head>
+    <body data-bs-theme="dark">
+        <div class="container">
+            <div class="card">
+                <div class="card-header d-flex justify-content-between align-items-center">
+                    <h2>In-flight flows</h2>
+                    <span id="status" class="badge bg-secondary">Waiting for the bot...</span>
+                </div>
+                <div class="card-body">
+                    <h4><span id="total">0</span> flows in progress</h4>
+                    <table class="table">
+                        <thead>
+                            <tr>
+                                <th>Stage</th><th>Users</th><th>Median age</th><th>Oldest</th>
+                                <th>&lt;30s</th><th>&lt;2m</th><th>&lt;10m</th><th>10m+</th>
+                            </tr>
+                        </thead>
+                        <tbody id="stages"></tbody>
+                    </table>
+                    <p id="bots" class="text-muted"></p>
+                </div>
+            </div>
+        </div>
+        <script>
+            const order = {{ stages | tojson }};
+            const seconds = s => s < 60 ? s.toFixed(0) + 's' : (s / 60).toFixed(1) + 'm';
+            let last = 0;
+            const source = new EventSource('/dashboard/stream');
+            source.onmessage = e => {
+                const snap = JSON.parse(e.data);
+                last = snap.t;
+                document.getElementById('total').textContent = snap.total;
+                const names = order.concat(Object.keys(snap.stages).filter(s => !order.includes(s)));
+                document.getElementById('stages').innerHTML = names.map(name => {
+                    const s = snap.stages[name] || {n: 0, p50: 0, max: 0, buckets: [0, 0, 0, 0]};
+                    return '<tr><td>' + name + '</td><td>' + s.n + '</td><td>' + seconds(s.p50) +
+                        '</td><td>' + seconds(s.max) + '</td>' +
+                        s.buckets.map(b => '<td>' + b + '</td>').join('') + '</tr>';
+                }).join('');
+                document.getElementById('bots').textContent = Object.entries(snap.bots)
+                    .map(([bot, n]) => bot + ': ' + n).join(', ');
+            };
+            setInterval(() => {
+                const status = document.getElementById('status');
+                const age = Date.now() / 1000 - last;
+                status.textContent = last ? (age < 5 ? 'Live' : 'No update for ' + seconds(age)) : 'Waiting for the bot...';
+                status.className = 'badge ' + (last && age < 5 ? 'bg-success' : 'bg-warning');
+            }, 1000);
+        </script>
+    </body>
+    </html>
+    """
+    return render_template_string(template, stages=STAGES)
+
+@app.route('/dashboard/stream')
+def dashboard_stream():
+    """Server-Sent Events stream of the bot's flow snapshots"""
+    # Each viewer holds a server thread until it disconnects
+    if not dashboard_buffer.add_viewer():
+        return Response("Too many dashboard viewers, try again later\n", status=503, mimetype='text/plain')
+    response = Response(
+        dashboard_buffer.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(dashboard_buffer.remove_viewer)
+    return response
+
+@app.route('/metrics')
+def bot_metrics():
+    """Latest counters and gauges exported by the bot process"""
+    snapshot = metrics.read_snapshot()
+    if snapshot is None:
+        return jsonify({'error': 'No metrics exported yet'}), 503
+    return jsonify(snapshot)
 
 def start_bot_process():
     """Start the bot process"""
     global bot_process
     try:
-        # Check if TELEGRAM_BOT_TOKEN is set
-        if not os.environ.get("TELEGRAM_BOT_TOKEN"):
-            logger.error("TELEGRAM_BOT_TOKEN not set")
+        # Check that at least one bot is configured
+        if not any(os.environ.get(name) for name in BOT_CONFIG_VARIABLES):
+            logger.error("No bot configured: set TELEGRAM_BOT_TOKEN, TELEGRAM_BOT_TOKENS or BOTS_CONFIG")
             return
 
         logger.info("Starting Telegram bot process...")
-        bot_process = subprocess.Popen(["python", "simple_bot.py"], stderr=subprocess.PIPE)
+        # Let the bot inherit our stderr: an undrained pipe would eventually
+        # fill up and block the bot on its next log write
+        bot_process = subprocess.Popen(["python", "simple_bot.py"])
         logger.info(f"Bot process started with PID: {bot_process.pid}")
     except Exception as e:
         logger.error(f"Error starting bot process: {e}")
@@ -143,6 +253,9 @@ def monitor_bot_process():
         # Wait before checking again
         time.sleep(30)
 
+# Listen for the bot's flow snapshots
+start_receiver(dashboard_buffer)
+
 # Start the bot process
 start_bot_process()
 
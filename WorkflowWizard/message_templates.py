@@ -0,0 +1,338 @@
+"""
+Precompiled message templates.
+
+Each template is written in Telethon's Markdown and parsed exactly once, at
+import, into plain text plus a list of formatting entities. Rendering splices
+the values into the text and shifts the entity offsets, so no Markdown is
+parsed when a message is sent and values (such as user-chosen labels) can
+never break or inject formatting: they are always plain text.
+
+Send rendered templates with parse_mode disabled:
+
+    text, entities = MAIN_MENU.render()
+    await event.respond(text, formatting_entities=entities, buttons=markup)
+"""
+import re
+from telethon.extensions import markdown
+
+# Placeholders look like {name}; braces are not Markdown, so they survive parsing
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+def _utf16_len(text):
+    """Length of text in UTF-16 code units, the unit of entity offsets"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class MessageTemplate:
+    """A Markdown message parsed once into text segments and entities"""
+
+    def __init__(self, source):
+        self.source = source
+        text, entities = markdown.parse(source)
+
+        # Split the parsed text into literal segments and placeholders
+        self.segments = []
+        self.names = []
+        # UTF-16 offset and length of each placeholder in the parsed text
+        placeholder_spans = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(text):
+            self.segments.append(text[position:match.start()])
+            self.names.append(match.group(1))
+            placeholder_spans.append((_utf16_len(text[:match.start()]), _utf16_len(match.group(0))))
+            position = match.end()
+        self.segments.append(text[position:])
+        self.placeholder_lengths = [length for _, length in placeholder_spans]
+
+        # For every entity, remember how many placeholders precede its start
+        # and its end; rendering then only needs prefix sums of the growth
+        self.entities = []
+        for entity in entities:
+            extra = entity.to_dict()
+            for key in ('_', 'offset', 'length'):
+                extra.pop(key, None)
+            end = entity.offset + entity.length
+            before_start = sum(1 for start, _ in placeholder_spans if start < entity.offset)
+            before_end = sum(1 for start, _ in placeholder_spans if start < end)
+            self.entities.append((type(entity), entity.offset, entity.length, extra, before_start, before_end))
+
+    def render(self, **values):
+        """
+        Fill in the template.
+
+        Args:
+            **values: A value for every placeholder; converted with str()
+
+        Returns:
+            Tuple of (text, formatting entities)
+        """
+        parts = [self.segments[0]]
+        # growth[i]: total UTF-16 length change caused by the first i placeholders
+        growth = [0]
+        for name, placeholder_length, segment in zip(self.names, self.placeholder_lengths, self.segments[1:]):
+            value = str(values[name])
+            parts.append(value)
+            parts.append(segment)
+            growth.append(growth[-1] + _utf16_len(value) - placeholder_length)
+
+        entities = []
+        for cls, offset, length, extra, before_start, before_end in self.entities:
+            start_shift = growth[before_start]
+            entities.append(cls(
+                offset=offset + start_shift,
+                length=length + growth[before_end] - start_shift,
+                **extra
+            ))
+        return ''.join(parts), entities
+
+
+# Main menu
+MAIN_MENU = MessageTemplate(
+    "🔐 **Advanced Telethon Session Manager** 🔐\n\n"
+    "This bot helps you generate, validate, and manage multiple Telethon session strings with enhanced security features.\n\n"
+    "Select an option from the menu below:"
+)
+
+PROCESS_CANCELLED = MessageTemplate(
+    "❌ Process cancelled.\n\n"
+    "What would you like to do next? Choose an option from the menu below:"
+)
+
+# Login flow
+CODE_SENT = MessageTemplate(
+    "✅ Verification code sent!\n\n"
+    "Please enter the verification code you received.\n"
+    "You can add spaces between digits if needed (e.g. `1 2 3 4 5`)"
+)
+
+SESSION_GENERATED = MessageTemplate(
+    "✅ Session generated successfully!\n\n"
+    "📱 User: {user_name}\n"
+    "{username}\n"
+    "🆔 ID: {user_id}\n"
+    "☎️ Phone: {phone}\n\n"
+    "🔐 Session String:\n`{session_string}`\n\n"
+    "⚠️ **IMPORTANT**: This session string gives full access to your account. "
+    "Never share it with anyone!\n\n"
+    "Your session was automatically saved. You can access it later from the main menu."
+)
+
+QR_LOGIN = MessageTemplate(
+    "📷 **Log In with QR Code** 📷\n\n"
+    "On a device where you are already logged in, open Telegram and go to "
+    "Settings > Devices > Link Desktop Device, then scan this code.\n\n"
+    "On that device you can also open this link directly:\n`{url}`\n\n"
+    "The code is refreshed automatically until it is accepted."
+)
+
+# Checking pasted session strings
+CHECK_SESSION_PROMPT = MessageTemplate(
+    "🔍 **Check Session Validity** 🔍\n\n"
+    "Please send the session string you want to check.\n\n"
+    "This will verify if the session is still valid and show information about it."
+)
+
+PASTED_SESSION_MALFORMED = MessageTemplate(
+    "❌ **This is not a session string**\n\n"
+    "{reason}\n\n"
+    "Please send a Telethon, GramJS or Pyrogram session string."
+)
+
+# Shown as soon as the string is decoded, while the network check runs
+PASTED_SESSION_CHECKING = MessageTemplate(
+    "🔍 **Validating session string...**\n\n"
+    "🗂 Format: {layout}\n"
+    "🌐 Data center: DC {dc_id}\n"
+    "📍 Address: {address}\n"
+    "🔑 Auth key ID: `{key_id}`"
+)
+
+PASTED_SESSION_VALID = MessageTemplate(
+    "✅ **Session is valid!**\n\n"
+    "**Account Information:**\n"
+    "👤 User: {user_name}\n"
+    "🔖 Username: {username}\n"
+    "🆔 User ID: `{user_id}`\n\n"
+    "This session is currently active and can be used."
+)
+
+PASTED_SESSION_VALID_CONVERTED = MessageTemplate(
+    "✅ **Session is valid!**\n\n"
+    "**Account Information:**\n"
+    "👤 User: {user_name}\n"
+    "🔖 Username: {username}\n"
+    "🆔 User ID: `{user_id}`\n\n"
+    "This session is currently active and can be used.\n\n"
+    "🔄 Converted from {layout}. The same session for Telethon:\n`{session_string}`"
+)
+
+PASTED_SESSION_UNAUTHORIZED = MessageTemplate(
+    "❌ **Session is not valid**\n\n"
+    "The session string you provided is not authorized.\n"
+    "This could happen if the session was revoked or expired."
+)
+
+PASTED_SESSION_REVOKED = MessageTemplate(
+    "❌ **Session is invalid**\n\n"
+    "This session string has been revoked or the account has been deactivated."
+)
+
+PASTED_SESSION_ERROR = MessageTemplate(
+    "❌ **Error validating session**\n\n"
+    "An error occurred: {error}"
+)
+
+# Saved sessions
+SESSION_RENAMED = MessageTemplate("✅ Session renamed to: **{label}**")
+
+AUTO_DELETE_STATUS = MessageTemplate(
+    "🔒 **Auto-Delete Security** 🔒\n\n"
+    "Auto-deletion of messages containing sensitive data is now:\n"
+    "**{status}**\n\n"
+    "Security features:\n"
+    "• Phone numbers are always deleted immediately after processing\n"
+    "• Verification codes are always deleted after submission\n"
+    "• 2FA passwords are always deleted for maximum security\n"
+    "• Session strings will be automatically deleted after 5 minutes when this setting is enabled"
+)
+
+NO_SAVED_SESSIONS = MessageTemplate(
+    "📋 **Your Saved Sessions** 📋\n\n"
+    "You don't have any saved sessions yet.\n\n"
+    "Generate a new session to get started."
+)
+
+# Parsing strips surrounding whitespace, so list parts are joined with
+# join_rendered(..., separator='\n\n')
+SAVED_SESSIONS_HEADER = MessageTemplate("📋 **Your Saved Sessions** 📋")
+
+SAVED_SESSION_ENTRY = MessageTemplate(
+    "{number}. **{label}**\n"
+    "   📱 Phone: `{phone}`\n"
+    "   🕒 Created: {created}"
+)
+
+SAVED_SESSIONS_FOOTER = MessageTemplate("Click on a session to manage it:")
+
+LABEL_PROMPT = MessageTemplate(
+    "📝 **Custom Session Label** 📝\n\n"
+    "Please send a name for this session. This will help you identify it later.\n\n"
+    "Examples: 'Main Account', 'Business Account', 'Bot Development'"
+)
+
+SESSION_DETAILS = MessageTemplate(
+    "🔐 **Session: {label}** 🔐\n\n"
+    "📱 Phone: `{phone}`\n"
+    "👤 User: {name}\n"
+    "🔖 Username: {username}\n"
+    "🕒 Created: {created}\n"
+    "🩺 Checks: {health}\n\n"
+    "Select an action to perform with this session:"
+)
+
+VERIFYING_SESSION = MessageTemplate("🔄 Verifying session **{label}**...")
+
+SAVED_SESSION_VALID = MessageTemplate(
+    "✅ **Session is valid!**\n\n"
+    "**{label}** is active and can be used.\n\n"
+    "👤 User: {user_name}\n"
+    "🔖 Username: {username}"
+)
+
+SAVED_SESSION_UNAUTHORIZED = MessageTemplate(
+    "❌ **Session is not valid**\n\n"
+    "**{label}** is no longer authorized.\n"
+    "This could happen if the session was revoked or expired."
+)
+
+SAVED_SESSION_REVOKED = MessageTemplate(
+    "❌ **Session is invalid**\n\n"
+    "**{label}** has been revoked or the account has been deactivated."
+)
+
+SAVED_SESSION_ERROR = MessageTemplate(
+    "❌ **Error verifying session**\n\n"
+    "An error occurred: {error}"
+)
+
+SHOW_SESSION_STRING = MessageTemplate(
+    "🔐 **Session String for: {label}**\n\n"
+    "`{session_string}`\n\n"
+    "⚠️ **IMPORTANT**: This session string gives full access to your account. "
+    "Never share it with anyone!"
+)
+
+EDIT_LABEL_PROMPT = MessageTemplate(
+    "✏️ **Edit Session Label** ✏️\n\n"
+    "Current label: **{label}**\n\n"
+    "Please send a new name for this session:"
+)
+
+DELETE_CONFIRM = MessageTemplate(
+    "⚠️ **Delete Session** ⚠️\n\n"
+    "Are you sure you want to delete **{label}**?\n\n"
+    "This action cannot be undone."
+)
+
+SESSION_DELETED = MessageTemplate(
+    "✅ **Session Deleted**\n\n"
+    "**{label}** has been deleted successfully."
+)
+
+HELP = MessageTemplate(
+    "❓ **Advanced Telethon Session Manager Help** ❓\n\n"
+    "This bot helps you generate, validate, and manage Telethon session strings with an intuitive button-based interface.\n\n"
+    "**Key Features:**\n"
+    "• Button-based interface (no command memorization needed)\n"
+    "• Generate multiple session strings for various accounts\n"
+    "• Custom labeling for easy session identification\n"
+    "• Session validation with detailed account information\n"
+    "• Enhanced security with automatic data protection\n"
+    "• Manage multiple sessions in one place\n\n"
+    "**Enhanced Security Features:**\n"
+    "• Phone numbers are automatically deleted from chat history\n"
+    "• Verification codes are immediately removed after submission\n"
+    "• 2FA passwords are deleted for maximum security\n"
+    "• Session strings can be auto-deleted after viewing (configurable)\n"
+    "• All security features designed to protect your account\n\n"
+    "**Security Recommendations:**\n"
+    "• Keep auto-deletion enabled for session strings\n"
+    "• Always validate sessions before using them\n"
+    "• Never share session strings with unauthorized parties\n"
+    "• Use descriptive labels to identify sessions\n"
+    "• Store session strings in a secure location\n\n"
+    "**Usage Tips:**\n"
+    "• Use the main menu to access all features\n"
+    "• Follow the on-screen prompts for each action\n"
+    "• Provide verification codes with or without spaces\n\n"
+    "**Need more help?**\n"
+    "If you have questions or need assistance, please contact the bot administrator."
+)
+
+
+def join_rendered(rendered, separator=''):
+    """
+    Concatenate several rendered templates into one message.
+
+    Args:
+        rendered: Iterable of (text, entities) tuples
+        separator: Plain text placed between the parts
+
+    Returns:
+        Tuple of (text, formatting entities)
+    """
+    texts = []
+    entities = []
+    offset = 0
+    separator_length = _utf16_len(separator)
+    for i, (text, part_entities) in enumerate(rendered):
+        if i:
+            texts.append(separator)
+            offset += separator_length
+        for entity in part_entities:
+            entity.offset += offset
+            entities.append(entity)
+        texts.append(text)
+        offset += _utf16_len(text)
+    return ''.join(texts), entities
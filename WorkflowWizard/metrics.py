@@ -0,0 +1,125 @@
+"""
+Process-wide counters, gauges and timings exported for the status page.
+
+The bot increments counters on its hot paths (a dict update, nothing more)
+and records durations into bounded windows of recent observations. A
+background task periodically writes a JSON snapshot to METRICS_FILE, which
+the Flask app in main.py serves at /metrics.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = os.environ.get("METRICS_FILE", "bot_metrics.json")
+METRICS_INTERVAL = int(os.environ.get("METRICS_INTERVAL", 15))
+
+# Number of recent observations kept per timing
+TIMING_WINDOW = int(os.environ.get("TIMING_WINDOW", 1000))
+
+# name -> running total
+counters = {}
+
+# name -> value, or a callable evaluated at snapshot time
+gauges = {}
+
+# name -> most recent observations (seconds)
+timings = {}
+
+
+def incr(name, amount=1):
+    """Increase a counter"""
+    counters[name] = counters.get(name, 0) + amount
+
+
+def observe(name, seconds):
+    """Record one duration of a timing"""
+    window = timings.get(name)
+    if window is None:
+        window = timings[name] = deque(maxlen=TIMING_WINDOW)
+    window.append(seconds)
+
+
+def summarize_timing(values):
+    """
+    Summarize a window of observations.
+
+    Returns:
+        Dictionary with the count, median, 90th percentile and maximum
+    """
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': values[len(values) // 2],
+        'p90': values[min(len(values) - 1, int(len(values) * 0.9))],
+        'max': values[-1]
+    }
+
+
+def set_gauge(name, value):
+    """
+    Set a gauge to a value or to a callable that returns the current value.
+
+    Args:
+        name: Gauge name
+        value: A JSON-serializable value, or a function producing one
+    """
+    gauges[name] = value
+
+
+def snapshot():
+    """
+    Collect the current value of every counter and gauge.
+
+    Returns:
+        Dictionary with a timestamp, all counters, gauges and timings
+    """
+    values = {}
+    for name, value in gauges.items():
+        try:
+            values[name] = value() if callable(value) else value
+        except Exception as e:
+            logger.warning(f"Could not read gauge {name}: {e}")
+    return {
+        'timestamp': time.time(),
+        'pid': os.getpid(),
+        'counters': dict(counters),
+        'gauges': values,
+        'timings': {name: summarize_timing(window) for name, window in timings.items() if window}
+    }
+
+
+def write_snapshot(data, path=METRICS_FILE):
+    """Atomically write a snapshot to disk"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path=METRICS_FILE):
+    """
+    Read the last exported snapshot.
+
+    Returns:
+        The snapshot dictionary, or None if none has been written yet
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def export_metrics(path=METRICS_FILE, interval=METRICS_INTERVAL):
+    """Write a snapshot every interval seconds, off the event loop thread"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(write_snapshot, snapshot(), path)
+        except OSError as e:
+            logger.warning(f"Could not export metrics: {e}")
@@ -0,0 +1,352 @@
+"""
+Pool of egress proxies for user clients.
+
+Telegram throttles per IP as well as per app, so user clients can be spread
+over several SOCKS5 proxies or MTProxy servers (PROXIES). A background
+prober keeps each proxy's latency (an exponentially weighted average) and
+error rate fresh by connecting through it to a Telegram data center. Proxies
+that fail several times in a row are ejected for a while and only come back
+after a successful probe.
+
+New clients go to the least-loaded proxy, lowest latency first. A client
+keeps its proxy for its whole life, and so does the login flow owning it:
+checkpoints record the proxy by name.
+
+SOCKS5 clients need python-socks (Telethon's proxy support, a declared
+dependency); MTProxy works with Telethon alone. benchmarks/socks_standin.py is a
+local SOCKS5 server for trying the whole path without real proxies.
+"""
+import os
+import time
+import socket
+import asyncio
+import logging
+from collections import deque
+from urllib.parse import urlsplit, unquote
+from telethon import connection
+from flood_ledger import ledger
+import metrics
+
+try:
+    # Telethon routes SOCKS5 through python-socks and ignores the proxy without it
+    import python_socks
+except ImportError:
+    python_socks = None
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated proxy URLs: socks5://[user:pass@]host:port or
+# mtproxy://secret@host:port
+PROXIES = os.environ.get("PROXIES", "")
+
+# Connect directly when every proxy is ejected, instead of using a bad one
+PROXY_DIRECT_FALLBACK = os.environ.get("PROXY_DIRECT_FALLBACK", "1") == "1"
+
+# Seconds between probes, the probe timeout, and the address probed through
+# each proxy (a Telegram data center)
+PROXY_PROBE_INTERVAL = int(os.environ.get("PROXY_PROBE_INTERVAL", 30))
+PROXY_PROBE_TIMEOUT = float(os.environ.get("PROXY_PROBE_TIMEOUT", 5))
+PROXY_PROBE_TARGET = os.environ.get("PROXY_PROBE_TARGET", "149.154.167.51:443")
+
+# Consecutive failures that eject a proxy, and the minimum ejection time
+PROXY_EJECT_FAILURES = int(os.environ.get("PROXY_EJECT_FAILURES", 3))
+PROXY_EJECT_SECONDS = int(os.environ.get("PROXY_EJECT_SECONDS", 120))
+
+# Seconds over which new clients count towards a proxy's load
+PROXY_LOAD_WINDOW = int(os.environ.get("PROXY_LOAD_WINDOW", 300))
+
+# Weight of the newest sample in the latency and error averages
+_SMOOTHING = 0.3
+
+# Errors that say something about the proxy rather than the request
+CONNECTION_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+
+
+class Proxy:
+    """One egress proxy with its health and load"""
+
+    def __init__(self, kind, host, port, username=None, password=None, secret=None):
+        self.kind = kind
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.secret = secret
+        self.name = f"{kind}://{host}:{port}"
+        # Smoothed probe latency in seconds; None until the first success
+        self.latency = None
+        # Smoothed share of failed probes and connections (0 to 1)
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected = False
+        self.ejected_until = 0.0
+        self.clients_created = 0
+        # Creation times of recent clients, oldest first
+        self._recent = deque()
+
+    def client_args(self):
+        """
+        Get the TelegramClient keyword arguments that route through this proxy.
+
+        Returns:
+            Dictionary with 'proxy' and, for MTProxy, 'connection'
+        """
+        if self.kind == 'mtproxy':
+            return {
+                'connection': connection.ConnectionTcpMTProxyRandomizedIntermediate,
+                'proxy': (self.host, self.port, self.secret)
+            }
+        return {'proxy': ('socks5', self.host, self.port, True, self.username, self.password)}
+
+    def recent_clients(self, now=None):
+        """Number of clients created within PROXY_LOAD_WINDOW"""
+        cutoff = (now or time.monotonic()) - PROXY_LOAD_WINDOW
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        return len(self._recent)
+
+    def record(self, ok, latency=None):
+        """
+        Update health after a probe or a client connection.
+
+        Args:
+            ok: Whether the connection through the proxy worked
+            latency: Seconds it took, for successful probes and connections
+        """
+        self.error_rate += _SMOOTHING * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.consecutive_failures += 1
+            if not self.ejected and self.consecutive_failures >= PROXY_EJECT_FAILURES:
+                self.ejected = True
+                self.ejected_until = time.monotonic() + PROXY_EJECT_SECONDS
+                metrics.incr('proxy_ejections')
+                logger.warning(f"Ejected proxy {self.name} after {self.consecutive_failures} failures")
+            return
+
+        self.consecutive_failures = 0
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + _SMOOTHING * (latency - self.latency)
+        if self.ejected and time.monotonic() >= self.ejected_until:
+            self.ejected = False
+            logger.info(f"Proxy {self.name} is healthy again")
+
+    def __repr__(self):
+        return f"Proxy({self.name!r})"
+
+
+def parse_proxy(url):
+    """
+    Parse a proxy URL.
+
+    Args:
+        url: socks5://[user:pass@]host:port or mtproxy://secret@host:port
+
+    Returns:
+        A Proxy
+
+    Raises:
+        ValueError: If the URL is malformed
+    """
+    parts = urlsplit(url.strip())
+    if parts.scheme not in ('socks5', 'mtproxy') or not parts.hostname or not parts.port:
+        raise ValueError(f"Invalid proxy {url!r}: expected socks5://host:port or mtproxy://secret@host:port")
+    if parts.scheme == 'mtproxy':
+        if not parts.username:
+            raise ValueError(f"MTProxy {parts.hostname}:{parts.port} needs a secret")
+        return Proxy('mtproxy', parts.hostname, parts.port, secret=unquote(parts.username))
+    return Proxy(
+        'socks5', parts.hostname, parts.port,
+        username=unquote(parts.username) if parts.username else None,
+        password=unquote(parts.password) if parts.password else None
+    )
+
+
+async def socks5_connect(proxy, host, port):
+    """
+    Open a connection to host:port through a SOCKS5 proxy.
+
+    Returns:
+        (reader, writer) of the established tunnel
+
+    Raises:
+        ConnectionError: If the proxy refuses the handshake or the connection
+    """
+    reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+    try:
+        methods = b'\x00\x02' if proxy.username else b'\x00'
+        writer.write(b'\x05' + bytes([len(methods)]) + methods)
+        await writer.drain()
+        _, method = await reader.readexactly(2)
+        if method == 2:
+            username = proxy.username.encode()
+            password = (proxy.password or '').encode()
+            writer.write(b'\x01' + bytes([len(username)]) + username + bytes([len(password)]) + password)
+            await writer.drain()
+            _, status = await reader.readexactly(2)
+            if status:
+                raise ConnectionError("SOCKS5 authentication failed")
+        elif method != 0:
+            raise ConnectionError("SOCKS5 proxy accepts none of our authentication methods")
+
+        try:
+            address = b'\x01' + socket.inet_aton(host)
+        except OSError:
+            encoded = host.encode()
+            address = b'\x03' + bytes([len(encoded)]) + encoded
+        writer.write(b'\x05\x01\x00' + address + port.to_bytes(2, 'big'))
+        await writer.drain()
+        _, reply, _, address_type = await reader.readexactly(4)
+        if reply:
+            raise ConnectionError(f"SOCKS5 connect failed with reply code {reply}")
+        # Skip the bound address
+        if address_type == 1:
+            await reader.readexactly(4 + 2)
+        elif address_type == 4:
+            await reader.readexactly(16 + 2)
+        else:
+            length = (await reader.readexactly(1))[0]
+            await reader.readexactly(length + 2)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+class ProxyPool:
+    """Assigns proxies to new clients and keeps their health up to date"""
+
+    def __init__(self, proxies, direct_fallback=PROXY_DIRECT_FALLBACK):
+        self.proxies = proxies
+        self.direct_fallback = direct_fallback
+        self._by_name = {proxy.name: proxy for proxy in proxies}
+        self._prober = None
+
+    def pick(self):
+        """
+        Choose the proxy for a new client.
+
+        Returns:
+            The least-loaded healthy proxy (lowest latency among equals), or
+            None to connect directly (no proxies, or none usable and direct
+            fallback is enabled)
+        """
+        if not self.proxies:
+            return None
+        now = time.monotonic()
+        # Ejected proxies are broken; flood-penalized ones are throttled by Telegram
+        healthy = [
+            proxy for proxy in self.proxies
+            if not proxy.ejected and not ledger.remaining([('egress', proxy.name)])
+        ]
+        if not healthy:
+            metrics.incr('proxy_pool_exhausted')
+            if self.direct_fallback:
+                return None
+            healthy = self.proxies
+        return min(healthy, key=lambda proxy: (
+            proxy.recent_clients(now),
+            proxy.latency if proxy.latency is not None else float('inf')
+        ))
+
+    def get(self, name):
+        """
+        Get a proxy by name, for reopening a flow on the proxy it started on.
+
+        Returns:
+            The proxy if it is configured and not ejected; otherwise a newly
+            picked one
+        """
+        proxy = self._by_name.get(name)
+        if proxy is None or proxy.ejected:
+            return self.pick()
+        return proxy
+
+    def client_created(self, proxy):
+        """Count a new client against a proxy's load"""
+        if proxy is not None:
+            proxy.clients_created += 1
+            proxy._recent.append(time.monotonic())
+
+    def note_connected(self, client, latency=None):
+        """
+        Count a successful client connection toward its proxy's health.
+
+        Args:
+            client: The connected client
+            latency: Seconds the connection took, if comparable with a probe
+        """
+        proxy = getattr(client, 'egress_proxy', None)
+        if proxy is not None:
+            proxy.record(True, latency)
+
+    def note_error(self, client, error):
+        """Count a connection error of a client against its proxy"""
+        proxy = getattr(client, 'egress_proxy', None)
+        if proxy is not None and isinstance(error, CONNECTION_ERRORS):
+            proxy.record(False)
+
+    async def probe(self, proxy):
+        """Connect through a proxy once and record the outcome"""
+        host, _, port = PROXY_PROBE_TARGET.rpartition(':')
+        start = time.perf_counter()
+        try:
+            if proxy.kind == 'socks5':
+                _, writer = await asyncio.wait_for(socks5_connect(proxy, host, int(port)), PROXY_PROBE_TIMEOUT)
+            else:
+                # MTProxy speaks its own protocol; reaching it is what we can check
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(proxy.host, proxy.port), PROXY_PROBE_TIMEOUT
+                )
+            writer.close()
+        except CONNECTION_ERRORS as e:
+            logger.debug(f"Probe through {proxy.name} failed: {e!r}")
+            proxy.record(False)
+            return
+        proxy.record(True, time.perf_counter() - start)
+
+    async def _probe_forever(self):
+        while True:
+            await asyncio.gather(*(self.probe(proxy) for proxy in self.proxies))
+            await asyncio.sleep(PROXY_PROBE_INTERVAL)
+
+    def start(self):
+        """Start probing in the background (no-op without proxies)"""
+        if self.proxies and self._prober is None:
+            self._prober = asyncio.create_task(self._probe_forever())
+
+    def stats(self):
+        """
+        Health and load of each proxy.
+
+        Returns:
+            Dictionary keyed by proxy name
+        """
+        now = time.monotonic()
+        return {
+            proxy.name: {
+                'latency_ms': round(proxy.latency * 1000, 1) if proxy.latency is not None else None,
+                'error_rate': round(proxy.error_rate, 3),
+                'ejected': proxy.ejected,
+                'clients_created': proxy.clients_created,
+                'recent_clients': proxy.recent_clients(now)
+            }
+            for proxy in self.proxies
+        }
+
+
+def load_proxies():
+    """
+    Parse PROXIES.
+
+    Returns:
+        List of usable Proxy (empty when no proxies are configured)
+
+    Raises:
+        ValueError: If a proxy URL is malformed
+    """
+    proxies = [parse_proxy(url) for url in PROXIES.split(',') if url.strip()]
+    if python_socks is None and any(proxy.kind == 'socks5' for proxy in proxies):
+        # Counting clients as proxied while they connect directly would be worse
+        logger.error("SOCKS5 proxies need the python-socks package (uv sync); they are ignored")
+        proxies = [proxy for proxy in proxies if proxy.kind != 'socks5']
+    return proxies
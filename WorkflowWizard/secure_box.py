@@ -0,0 +1,156 @@
+"""
+Authenticated encryption for data the bot keeps on local disk.
+
+Uses AES-GCM from the `cryptography` package when it is installed. Otherwise
+it falls back to AES-CTR from `pyaes` (already required by Telethon) with an
+HMAC-SHA256 tag over the ciphertext (encrypt-then-MAC). The first byte of
+every sealed blob records which construction produced it.
+"""
+import os
+import hmac
+import base64
+import hashlib
+import logging
+import pyaes
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 32
+
+FORMAT_GCM = 1
+FORMAT_CTR_HMAC = 2
+
+_GCM_NONCE_SIZE = 12
+_CTR_NONCE_SIZE = 16
+_TAG_SIZE = 32
+
+
+class DecryptionError(Exception):
+    """Raised when a sealed blob is corrupt, truncated or was tampered with"""
+
+
+def seal(key: bytes, plaintext: bytes, aad: bytes = b'') -> bytes:
+    """
+    Encrypt and authenticate data.
+
+    Args:
+        key: 32-byte secret key
+        plaintext: Data to encrypt
+        aad: Additional data that is authenticated but not encrypted
+
+    Returns:
+        The sealed blob (format byte, nonce, ciphertext and tag)
+    """
+    if AESGCM is not None:
+        nonce = os.urandom(_GCM_NONCE_SIZE)
+        return bytes([FORMAT_GCM]) + nonce + AESGCM(key).encrypt(nonce, plaintext, aad)
+
+    enc_key, mac_key = _split_key(key)
+    nonce = os.urandom(_CTR_NONCE_SIZE)
+    counter = pyaes.Counter(initial_value=int.from_bytes(nonce, 'big'))
+    ciphertext = pyaes.AESModeOfOperationCTR(enc_key, counter=counter).encrypt(plaintext)
+    header = bytes([FORMAT_CTR_HMAC]) + nonce
+    return header + ciphertext + _tag(mac_key, header, ciphertext, aad)
+
+
+def open_sealed(key: bytes, blob: bytes, aad: bytes = b'') -> bytes:
+    """
+    Verify and decrypt a blob produced by seal().
+
+    Args:
+        key: The key the blob was sealed with
+        blob: The sealed blob
+        aad: The additional data given to seal()
+
+    Returns:
+        The decrypted plaintext
+
+    Raises:
+        DecryptionError: If the blob cannot be authenticated
+    """
+    if not blob:
+        raise DecryptionError("Empty blob")
+
+    if blob[0] == FORMAT_GCM:
+        if AESGCM is None:
+            raise DecryptionError("Blob needs the 'cryptography' package to decrypt")
+        nonce = blob[1:1 + _GCM_NONCE_SIZE]
+        try:
+            return AESGCM(key).decrypt(nonce, blob[1 + _GCM_NONCE_SIZE:], aad)
+        except Exception as e:
+            raise DecryptionError("Authentication failed") from e
+
+    if blob[0] == FORMAT_CTR_HMAC:
+        header_size = 1 + _CTR_NONCE_SIZE
+        if len(blob) < header_size + _TAG_SIZE:
+            raise DecryptionError("Blob is truncated")
+        enc_key, mac_key = _split_key(key)
+        header = blob[:header_size]
+        ciphertext = blob[header_size:-_TAG_SIZE]
+        if not hmac.compare_digest(blob[-_TAG_SIZE:], _tag(mac_key, header, ciphertext, aad)):
+            raise DecryptionError("Authentication failed")
+        counter = pyaes.Counter(initial_value=int.from_bytes(header[1:], 'big'))
+        return pyaes.AESModeOfOperationCTR(enc_key, counter=counter).decrypt(ciphertext)
+
+    raise DecryptionError(f"Unknown blob format {blob[0]}")
+
+
+def load_or_create_key(env_var: str, key_file: str) -> bytes:
+    """
+    Load a secret key from the environment or a local key file.
+
+    The environment variable takes precedence and holds the key as urlsafe
+    base64. Without it, the key is read from key_file, which is created with
+    owner-only permissions on first use.
+
+    Args:
+        env_var: Name of the environment variable holding the key
+        key_file: Path of the fallback key file
+
+    Returns:
+        The 32-byte key
+    """
+    encoded = os.environ.get(env_var)
+    if encoded:
+        key = base64.urlsafe_b64decode(encoded)
+        if len(key) != KEY_SIZE:
+            raise ValueError(f"{env_var} must decode to {KEY_SIZE} bytes")
+        return key
+
+    if os.path.exists(key_file):
+        with open(key_file, 'rb') as f:
+            key = f.read()
+        if len(key) == KEY_SIZE:
+            return key
+        logger.warning(f"Ignoring malformed key file {key_file}")
+
+    key_dir = os.path.dirname(key_file)
+    if key_dir:
+        os.makedirs(key_dir, exist_ok=True)
+    key = os.urandom(KEY_SIZE)
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    logger.info(f"Created new key file {key_file}; set {env_var} to manage the key yourself")
+    return key
+
+
+def _split_key(key: bytes):
+    """Derive independent encryption and MAC keys from one secret"""
+    enc_key = hmac.new(key, b'enc', hashlib.sha256).digest()
+    mac_key = hmac.new(key, b'mac', hashlib.sha256).digest()
+    return enc_key, mac_key
+
+
+def _tag(mac_key: bytes, header: bytes, ciphertext: bytes, aad: bytes) -> bytes:
+    """Compute the HMAC tag over header, additional data and ciphertext"""
+    mac = hmac.new(mac_key, header, hashlib.sha256)
+    mac.update(len(aad).to_bytes(8, 'big'))
+    mac.update(aad)
+    mac.update(ciphertext)
+    return mac.digest()
@@ -0,0 +1,265 @@
+"""
+Offline decoding and sanity checks of pasted session strings.
+
+A session string is a data center id, the address and port of that data
+center and a 256-byte auth key, encoded as base64. decode() parses it
+locally, so text that is not a session string is rejected before any
+connection is made, and the data center is known before the network check.
+
+Layouts understood:
+- telethon: "1" + urlsafe base64 of DC id, IPv4 or IPv6 address (packed),
+  port and auth key
+- gramjs: "1" + base64 of DC id, address length, address (text), port and
+  auth key
+- pyrogram: urlsafe base64 (unpadded) of DC id, [API id,] test mode flag,
+  auth key, user id and bot flag, in Pyrogram 1.x and 2.x variants
+
+Every layout is converted to a Telethon string with to_telethon(), which
+uses Telegram's own address of the session's data center rather than the
+address found in the string.
+"""
+import base64
+import struct
+import hashlib
+import ipaddress
+
+AUTH_KEY_SIZE = 256
+
+# Production data centers (Telegram's help.getConfig); a session connects to
+# its own data center here, whatever address its string carries
+DC_ADDRESSES = {
+    1: '149.154.175.53',
+    2: '149.154.167.51',
+    3: '149.154.175.100',
+    4: '149.154.167.91',
+    5: '91.108.56.130',
+}
+DC_PORT = 443
+
+# Longer input is rejected before decoding; real strings are under 400 chars
+MAX_LENGTH = 1024
+
+_VERSION = '1'
+
+# Telethon: DC id, packed IPv4 or IPv6 address, port, auth key
+_TELETHON_V4 = struct.Struct('>B4sH256s')
+_TELETHON_V6 = struct.Struct('>B16sH256s')
+
+# GramJS: DC id and address length, then address, port and auth key
+_GRAMJS_HEAD = struct.Struct('>BH')
+_GRAMJS_TAIL = struct.Struct('>H256s')
+
+# Pyrogram: 2.x has the API id and a 64-bit user id, 1.x a 32-bit or
+# (later) 64-bit user id
+_PYROGRAM = {
+    'pyrogram': struct.Struct('>BI?256sQ?'),
+    'pyrogram-1': struct.Struct('>B?256sI?'),
+    'pyrogram-1-64': struct.Struct('>B?256sQ?'),
+}
+_PYROGRAM_BY_SIZE = {layout_struct.size: layout for layout, layout_struct in _PYROGRAM.items()}
+
+# Layouts as shown to users
+LAYOUT_NAMES = {
+    'telethon': "Telethon",
+    'gramjs': "GramJS",
+    'pyrogram': "Pyrogram",
+    'pyrogram-1': "Pyrogram 1.x",
+    'pyrogram-1-64': "Pyrogram 1.x",
+}
+
+_BASE64_CHARS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/-_=')
+
+
+class MalformedSessionError(Exception):
+    """Raised when text cannot be a session string; the message says why"""
+
+
+class DecodedSession:
+    """The contents of a session string"""
+
+    __slots__ = ('layout', 'dc_id', 'address', 'port', 'auth_key', 'user_id', 'api_id')
+
+    def __init__(self, layout, dc_id, address, port, auth_key, user_id=None, api_id=None):
+        self.layout = layout
+        self.dc_id = dc_id
+        # Address and port stored in the string (Pyrogram strings have none)
+        self.address = address
+        self.port = port
+        self.auth_key = auth_key
+        # Known for Pyrogram strings only
+        self.user_id = user_id
+        self.api_id = api_id
+
+    @property
+    def key_id(self):
+        """The auth key id Telegram knows the key by (sent in every request)"""
+        return struct.unpack('<Q', hashlib.sha1(self.auth_key).digest()[12:20])[0]
+
+    def describe_address(self):
+        """Text such as "149.154.167.51:443 (IPv4)" for the status message"""
+        if self.address is None:
+            return "not stored in this format"
+        version = ipaddress.ip_address(self.address).version
+        host = f"[{self.address}]" if version == 6 else self.address
+        return f"{host}:{self.port} (IPv{version})"
+
+    def __repr__(self):
+        return f"DecodedSession({self.layout!r}, dc_id={self.dc_id}, address={self.address!r})"
+
+
+def _b64decode(text):
+    """Decode standard or urlsafe base64, padded or not"""
+    data = text.encode('ascii')
+    data += b'=' * (-len(data) % 4)
+    try:
+        return base64.b64decode(data, altchars=b'-_', validate=True)
+    except ValueError:
+        raise MalformedSessionError("It is not valid base64.") from None
+
+
+def _check(dc_id, port, auth_key):
+    if dc_id not in DC_ADDRESSES:
+        raise MalformedSessionError(f"It names data center {dc_id}, which does not exist.")
+    if not port:
+        raise MalformedSessionError("It has no port.")
+    if not any(auth_key):
+        raise MalformedSessionError("Its auth key is empty.")
+
+
+def _decode_telethon(data):
+    if len(data) == _TELETHON_V4.size:
+        dc_id, ip, port, auth_key = _TELETHON_V4.unpack(data)
+    elif len(data) == _TELETHON_V6.size:
+        dc_id, ip, port, auth_key = _TELETHON_V6.unpack(data)
+    else:
+        return None
+    _check(dc_id, port, auth_key)
+    return DecodedSession('telethon', dc_id, str(ipaddress.ip_address(ip)), port, auth_key)
+
+
+def _decode_gramjs(data):
+    if len(data) < _GRAMJS_HEAD.size + _GRAMJS_TAIL.size:
+        return None
+    dc_id, address_length = _GRAMJS_HEAD.unpack_from(data)
+    if len(data) != _GRAMJS_HEAD.size + address_length + _GRAMJS_TAIL.size:
+        return None
+    address = data[_GRAMJS_HEAD.size:_GRAMJS_HEAD.size + address_length]
+    port, auth_key = _GRAMJS_TAIL.unpack_from(data, _GRAMJS_HEAD.size + address_length)
+    try:
+        address = str(ipaddress.ip_address(address.decode('ascii')))
+    except ValueError:
+        return None
+    _check(dc_id, port, auth_key)
+    return DecodedSession('gramjs', dc_id, address, port, auth_key)
+
+
+def _decode_pyrogram(data):
+    layout = _PYROGRAM_BY_SIZE.get(len(data))
+    if layout is None:
+        return None
+    if layout == 'pyrogram':
+        dc_id, api_id, test_mode, auth_key, user_id, _ = _PYROGRAM[layout].unpack(data)
+    else:
+        dc_id, test_mode, auth_key, user_id, _ = _PYROGRAM[layout].unpack(data)
+        api_id = None
+    if test_mode:
+        raise MalformedSessionError("It belongs to Telegram's test servers.")
+    _check(dc_id, DC_PORT, auth_key)
+    return DecodedSession(layout, dc_id, None, None, auth_key, user_id=user_id, api_id=api_id)
+
+
+def decode(text):
+    """
+    Parse a session string without connecting.
+
+    Surrounding whitespace and quotes, and line breaks inside the string
+    (from copying a wrapped message), are ignored.
+
+    Returns:
+        DecodedSession
+
+    Raises:
+        MalformedSessionError: If text is not a session string of a known
+            layout, or names an impossible data center, port or key
+    """
+    text = ''.join(text.split()).strip('"\'`')
+    if not text:
+        raise MalformedSessionError("It is empty.")
+    if len(text) > MAX_LENGTH:
+        raise MalformedSessionError("It is far too long.")
+    if not _BASE64_CHARS.issuperset(text.encode('utf-8')):
+        raise MalformedSessionError("It contains characters that never appear in a session string.")
+
+    if text[0] == _VERSION:
+        data = _b64decode(text[1:])
+        # GramJS first: its length prefix and textual address cannot occur in
+        # a real Telethon IPv6 string of the same size
+        session = _decode_gramjs(data) or _decode_telethon(data)
+        if session:
+            return session
+    elif text[0].isdigit():
+        raise MalformedSessionError(f"It is a version {text[0]} session string; only version 1 is supported.")
+    else:
+        session = _decode_pyrogram(_b64decode(text))
+        if session:
+            return session
+    raise MalformedSessionError("It has the wrong length for a session string.")
+
+
+def encode(session, layout=None):
+    """
+    Write a session string.
+
+    Args:
+        session: DecodedSession
+        layout: Layout to write, the session's own by default
+
+    Returns:
+        The session string
+    """
+    layout = layout or session.layout
+    address = session.address or DC_ADDRESSES[session.dc_id]
+    port = session.port or DC_PORT
+    if layout == 'telethon':
+        ip = ipaddress.ip_address(address)
+        layout_struct = _TELETHON_V4 if ip.version == 4 else _TELETHON_V6
+        data = layout_struct.pack(session.dc_id, ip.packed, port, session.auth_key)
+        return _VERSION + base64.urlsafe_b64encode(data).decode('ascii')
+    if layout == 'gramjs':
+        address = address.encode('ascii')
+        data = (_GRAMJS_HEAD.pack(session.dc_id, len(address)) + address
+                + _GRAMJS_TAIL.pack(port, session.auth_key))
+        return _VERSION + base64.b64encode(data).decode('ascii')
+    if layout == 'pyrogram':
+        data = _PYROGRAM[layout].pack(session.dc_id, session.api_id or 0, False, session.auth_key,
+                                      session.user_id or 0, False)
+    elif layout in _PYROGRAM:
+        data = _PYROGRAM[layout].pack(session.dc_id, False, session.auth_key, session.user_id or 0, False)
+    else:
+        raise ValueError(f"Unknown session string layout {layout!r}")
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def to_telethon(session):
+    """
+    Get a Telethon session string that connects to the session's data
+    center at Telegram's own address.
+    """
+    pinned = DecodedSession('telethon', session.dc_id, DC_ADDRESSES[session.dc_id], DC_PORT, session.auth_key)
+    return encode(pinned)
+
+
+def mask(text):
+    """
+    Hide the auth key of a session string, keeping its layout.
+
+    Returns:
+        The same string with a dummy auth key, or text of the same length if
+        it is not a session string
+    """
+    try:
+        session = decode(text)
+    except MalformedSessionError:
+        return 'x' * len(text)
+    session.auth_key = b'\x01' * AUTH_KEY_SIZE
+    return encode(session)
@@ -0,0 +1,617 @@
+"""
+Storage for saved sessions and per-user settings.
+
+A single store is shared by every hosted bot. Records are keyed by
+(tenant, user id), so tenants never see each other's data, and handlers only
+ever work through a TenantStore view bound to their own tenant.
+
+Storage is tiered: every record is written through to SQLite, while
+recently active users are kept in memory in an LRU bounded by a byte budget.
+Idle users are dropped from memory and loaded lazily on their next update,
+so resident memory stays flat as the user base grows. Handlers load them
+with preload_user(), which reads the shard in a worker thread so a cache
+miss does not stall the event loop.
+
+On disk, users are partitioned by Telegram user id into SESSION_SHARDS
+SQLite files. Each shard has its own writer thread: a write only queues the
+serialized record, and the writer commits everything queued for its shard
+in one transaction, so writes for users on different shards never wait on
+each other and a burst of writes costs one commit per shard. Reads see
+queued writes before they are committed. A write is durable once its shard
+has committed it, normally within milliseconds; flush() waits for that.
+
+The shard count can be changed while the bot runs with reshard(), and
+scan() streams every stored user across all shards for admin reports.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# On-disk (cold) tier; with several shards, sessions.db becomes
+# sessions.0of4.db, sessions.1of4.db, ...
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+
+# Number of shard files users are partitioned into (changed at startup by
+# moving every record, or while running with /reshard)
+SESSION_SHARDS = int(os.environ.get("SESSION_SHARDS", 1))
+
+# Most queued writes a shard commits in one transaction
+SESSION_COMMIT_BATCH = int(os.environ.get("SESSION_COMMIT_BATCH", 256))
+
+# Memory budget of the hot tier, measured as serialized record size
+SESSION_CACHE_BYTES = int(os.environ.get("SESSION_CACHE_BYTES", 8 * 1024 * 1024))
+
+# Users untouched for this long are dropped from memory by evict_idle()
+SESSION_IDLE_SECONDS = int(os.environ.get("SESSION_IDLE_SECONDS", 1800))
+
+# Rows read from disk at a time by scans and resharding
+SCAN_BATCH = 500
+
+# Marks a user with no queued write (None queues a delete)
+_NOT_QUEUED = object()
+
+
+def shard_paths(path, count):
+    """Paths of the shard files of a store with count shards"""
+    if count == 1:
+        # A single shard is the plain file, as written by older versions
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{index}of{count}{ext}" for index in range(count)]
+
+
+def read_layout(path):
+    """Shard count the store at path was last written with"""
+    try:
+        with open(f"{path}.shards", encoding='utf-8') as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 1
+
+
+def write_layout(path, count):
+    """Record the shard count of the store at path"""
+    tmp = f"{path}.shards.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(str(count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, f"{path}.shards")
+
+
+def remove_database(path):
+    """Delete an SQLite file along with its WAL files"""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class Shard:
+    """One shard file of a SessionStore, with a dedicated writer thread"""
+
+    def __init__(self, path, commit_batch=SESSION_COMMIT_BATCH):
+        self.path = path
+        self.commit_batch = max(1, commit_batch)
+        # (tenant, user_id) -> serialized record, or None to delete; queued
+        # and not yet committed
+        self._queued = {}
+        self._lock = threading.Lock()
+        # Signalled when a write is queued, and when a batch is committed
+        self._work = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._closing = False
+        self.commits = 0
+        self.rows_committed = 0
+        # Reads from the event loop; the writer has its own connection
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        with self._read_lock, self._reader:
+            self._reader.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "tenant TEXT NOT NULL, user_id INTEGER NOT NULL, record TEXT NOT NULL, "
+                "PRIMARY KEY (tenant, user_id))"
+            )
+        self._writer = threading.Thread(
+            target=self._write_loop, name=f"shard-writer-{os.path.basename(path)}", daemon=True
+        )
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def load(self, key):
+        """Serialized record of a user, or None if the user has no data"""
+        with self._lock:
+            data = self._queued.get(key, _NOT_QUEUED)
+        if data is not _NOT_QUEUED:
+            return data
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT record FROM users WHERE tenant = ? AND user_id = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def store(self, key, data):
+        """Queue a serialized record for a user, or None to delete the user"""
+        with self._lock:
+            self._queued[key] = data
+            self._work.notify()
+
+    def queued(self):
+        """Snapshot of the writes not yet committed, as (key, data) pairs"""
+        with self._lock:
+            return list(self._queued.items())
+
+    def rows(self, tenant=None):
+        """
+        Read the committed rows of the shard in batches.
+
+        Uses its own connection, so it may run in any thread.
+
+        Yields:
+            Lists of (tenant, user id, serialized record)
+        """
+        db = self._connect()
+        try:
+            if tenant is None:
+                cursor = db.execute("SELECT tenant, user_id, record FROM users")
+            else:
+                cursor = db.execute("SELECT tenant, user_id, record FROM users WHERE tenant = ?", (tenant,))
+            while True:
+                batch = cursor.fetchmany(SCAN_BATCH)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            db.close()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued write is committed.
+
+        Returns:
+            False if the timeout expired first
+        """
+        with self._lock:
+            return self._committed.wait_for(lambda: not self._queued, timeout)
+
+    def close(self):
+        """Commit the queued writes and stop the writer"""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._work.notify()
+        self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            with self._lock:
+                while not self._queued and not self._closing:
+                    self._work.wait()
+                if not self._queued:
+                    break
+                batch = []
+                for item in self._queued.items():
+                    batch.append(item)
+                    if len(batch) == self.commit_batch:
+                        break
+            try:
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO users (tenant, user_id, record) VALUES (?, ?, ?)",
+                        [(tenant, user_id, data) for (tenant, user_id), data in batch if data is not None]
+                    )
+                    db.executemany(
+                        "DELETE FROM users WHERE tenant = ? AND user_id = ?",
+                        [key for key, data in batch if data is None]
+                    )
+            except sqlite3.Error as e:
+                if self._closing:
+                    logger.error(f"Dropped {len(self._queued)} unsaved writes to {self.path}: {e}")
+                    break
+                logger.error(f"Commit to {self.path} failed, retrying: {e}")
+                time.sleep(1)
+                continue
+            with self._lock:
+                for key, data in batch:
+                    # Unless the user was written again meanwhile
+                    if self._queued.get(key, _NOT_QUEUED) is data:
+                        del self._queued[key]
+                self.commits += 1
+                self.rows_committed += len(batch)
+                self._committed.notify_all()
+        db.close()
+
+    def stats(self):
+        """Queued writes, commits and rows committed"""
+        with self._lock:
+            queued = len(self._queued)
+        return {'queued': queued, 'commits': self.commits, 'rows_committed': self.rows_committed}
+
+
+class SessionStore:
+    """Store of users' saved sessions and settings with an in-memory hot tier"""
+
+    def __init__(self, path=SESSION_DB, cache_bytes=SESSION_CACHE_BYTES, shards=SESSION_SHARDS,
+                 commit_batch=SESSION_COMMIT_BATCH):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.commit_batch = commit_batch
+        # (tenant, user_id) -> [record, serialized size, last access]
+        # where record is {'sessions': [...], 'settings': {...}}
+        self._hot = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Guards the shard layout, which a reshard swaps from another thread
+        self._layout_lock = threading.Lock()
+        self._shards = [Shard(shard_path, commit_batch) for shard_path in shard_paths(path, read_layout(path))]
+        # Incremented by every write, so a read off the event loop can tell
+        # that what it read may be outdated
+        self._writes = 0
+        # Shards being filled by a running reshard, and the users written
+        # to them since it started
+        self._next = None
+        self._rewritten = set()
+        self._closed = False
+        if shards != len(self._shards):
+            self.reshard(shards)
+
+    @property
+    def shard_count(self):
+        """Number of shard files in use"""
+        return len(self._shards)
+
+    def get_user(self, tenant, user_id):
+        """Return the user's record, or None if the user has no data"""
+        key = (tenant, user_id)
+        entry = self._hot.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[2] = time.monotonic()
+            self._hot.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        with self._layout_lock:
+            data = self._shards[user_id % len(self._shards)].load(key)
+        if data is None:
+            return None
+        record = json.loads(data)
+        self._admit(key, record, len(data))
+        return record
+
+    async def preload_user(self, tenant, user_id):
+        """
+        Bring a user's record into memory without blocking the event loop.
+
+        On a cache miss the shard is read in the default executor, so the
+        get_user() calls that follow are served from memory.
+
+        Returns:
+            The user's record, or None if the user has no data
+        """
+        key = (tenant, user_id)
+        if key in self._hot:
+            return self.get_user(tenant, user_id)
+        writes = self._writes
+        with self._layout_lock:
+            shard = self._shards[user_id % len(self._shards)]
+        data = await asyncio.get_running_loop().run_in_executor(None, shard.load, key)
+        if key in self._hot or self._writes != writes:
+            # Written (or loaded by another handler) while we were reading
+            return self.get_user(tenant, user_id)
+        self.misses += 1
+        if data is None:
+            return None
+        record = json.loads(data)
+        self._admit(key, record, len(data))
+        return record
+
+    def put_user(self, tenant, user_id, record):
+        """Replace the user's record, removing it when it holds no data"""
+        key = (tenant, user_id)
+        self._writes += 1
+        if record['sessions'] or record['settings']:
+            data = json.dumps(record, ensure_ascii=False)
+            self._store(key, data)
+            self._admit(key, record, len(data))
+        else:
+            self._store(key, None)
+            self._drop(key)
+
+    def _store(self, key, data):
+        """Queue a write on the user's shard, and on its new shard while resharding"""
+        user_id = key[1]
+        with self._layout_lock:
+            self._shards[user_id % len(self._shards)].store(key, data)
+            if self._next is not None:
+                self._next[user_id % len(self._next)].store(key, data)
+                self._rewritten.add(key)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every write made so far is committed to disk.
+
+        Returns:
+            False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for shard in list(self._shards):
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not shard.flush(remaining):
+                return False
+        return True
+
+    def scan(self, tenant=None):
+        """
+        Iterate over every stored user, one shard after another.
+
+        Records are read from disk in batches and do not enter the hot tier,
+        so scanning a large store neither holds it in memory nor evicts
+        active users. Writes queued when a shard's scan starts are included.
+        Blocking; run it in a thread. It may be resumed from different
+        threads, one at a time.
+
+        Args:
+            tenant: Only this tenant's users, or every tenant's
+
+        Yields:
+            (tenant, user id, record)
+        """
+        for shard in list(self._shards):
+            queued = {key: data for key, data in shard.queued() if tenant is None or key[0] == tenant}
+            for rows in shard.rows(tenant):
+                for row_tenant, user_id, data in rows:
+                    data = queued.pop((row_tenant, user_id), data)
+                    if data is not None:
+                        yield row_tenant, user_id, json.loads(data)
+            for (row_tenant, user_id), data in queued.items():
+                if data is not None:
+                    yield row_tenant, user_id, json.loads(data)
+
+    def reshard(self, count):
+        """
+        Move every user to a new number of shards, while the store stays in use.
+
+        New shard files are filled from the current ones; writes made
+        meanwhile go to both, and the new layout takes over once it is
+        committed. If the process stops halfway, the old layout stays in use
+        and the next reshard starts over. Blocking; run it in a thread.
+
+        Args:
+            count: New number of shards
+
+        Returns:
+            Number of users moved
+
+        Raises:
+            ValueError: If count is below 1
+            RuntimeError: If another reshard is running
+        """
+        if count < 1:
+            raise ValueError(f"Shard count must be at least 1, not {count}")
+        started = time.monotonic()
+        with self._layout_lock:
+            if self._next is not None:
+                raise RuntimeError("A reshard is already running")
+            if count == len(self._shards):
+                return 0
+            old_count = len(self._shards)
+            for shard_path in shard_paths(self.path, count):
+                # Left over from an interrupted reshard
+                remove_database(shard_path)
+            self._next = [Shard(shard_path, self.commit_batch) for shard_path in shard_paths(self.path, count)]
+            self._rewritten = set()
+            # Queued writes are newer than the rows they will replace
+            for shard in self._shards:
+                for key, data in shard.queued():
+                    self._next[key[1] % count].store(key, data)
+                    self._rewritten.add(key)
+        logger.info(f"Resharding session store from {old_count} to {count} shards")
+
+        try:
+            moved = 0
+            for shard in list(self._shards):
+                for rows in shard.rows():
+                    with self._layout_lock:
+                        for tenant, user_id, data in rows:
+                            key = (tenant, user_id)
+                            # Written since the reshard started: the new shard has it already
+                            if key not in self._rewritten:
+                                self._next[user_id % count].store(key, data)
+                    moved += len(rows)
+            for shard in self._next:
+                shard.flush()
+        except BaseException:
+            with self._layout_lock:
+                abandoned, self._next, self._rewritten = self._next, None, set()
+            for shard in abandoned:
+                shard.close()
+                remove_database(shard.path)
+            raise
+
+        with self._layout_lock:
+            write_layout(self.path, count)
+            old, self._shards, self._next, self._rewritten = self._shards, self._next, None, set()
+        # Nothing reads or writes the old shards any more
+        for shard in old:
+            shard.close()
+            remove_database(shard.path)
+        logger.info(f"Moved {moved} users into {count} shards in {time.monotonic() - started:.1f}s")
+        return moved
+
+    def evict_idle(self, max_idle=SESSION_IDLE_SECONDS):
+        """
+        Drop users that have been idle for too long from memory.
+
+        Their records stay on disk and are reloaded on next access.
+
+        Args:
+            max_idle: Seconds since last access after which a user is evicted
+
+        Returns:
+            Number of users evicted
+        """
+        cutoff = time.monotonic() - max_idle
+        evicted = 0
+        # The LRU order means idle users are all at the front
+        while self._hot:
+            key, entry = next(iter(self._hot.items()))
+            if entry[2] > cutoff:
+                break
+            self._drop(key)
+            evicted += 1
+        self.evictions += evicted
+        if evicted:
+            logger.debug(f"Evicted {evicted} idle users from the session cache")
+        return evicted
+
+    def stats(self):
+        """
+        Get cache and shard statistics.
+
+        Returns:
+            Dictionary with hit rate, eviction count, resident users and
+            bytes, and per shard the writes not yet committed
+        """
+        lookups = self.hits + self.misses
+        shards = [shard.stats() for shard in self._shards]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'resident_users': len(self._hot),
+            'resident_bytes': self.resident_bytes,
+            'budget_bytes': self.cache_bytes,
+            'shards': len(shards),
+            'resharding': self._next is not None,
+            'queued_writes': [shard['queued'] for shard in shards],
+            'commits': sum(shard['commits'] for shard in shards),
+            'rows_committed': sum(shard['rows_committed'] for shard in shards)
+        }
+
+    def close(self):
+        """Commit the queued writes and close the on-disk tier"""
+        with self._layout_lock:
+            if self._closed:
+                return
+            self._closed = True
+            shards = self._shards
+        for shard in shards:
+            shard.close()
+
+    def _admit(self, key, record, size):
+        """Insert or refresh a record in the hot tier and enforce the budget"""
+        self._drop(key)
+        self._hot[key] = [record, size, time.monotonic()]
+        self.resident_bytes += size
+        # Always keep the record just admitted, even if it alone is too big
+        while self.resident_bytes > self.cache_bytes and len(self._hot) > 1:
+            self._drop(next(iter(self._hot)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        """Remove a record from the hot tier"""
+        entry = self._hot.pop(key, None)
+        if entry is not None:
+            self.resident_bytes -= entry[1]
+
+    def for_tenant(self, tenant):
+        """Return a view of the store restricted to one tenant"""
+        return TenantStore(self, tenant)
+
+
+class TenantStore:
+    """View of a SessionStore bound to a single tenant"""
+
+    def __init__(self, store, tenant):
+        self.store = store
+        self.tenant = tenant
+
+    def _record(self, user_id):
+        record = self.store.get_user(self.tenant, user_id)
+        if record is None:
+            record = {'sessions': [], 'settings': {}}
+        return record
+
+    async def preload(self, user_id):
+        """Load the user's record into memory off the event loop, see SessionStore.preload_user"""
+        await self.store.preload_user(self.tenant, user_id)
+
+    def sessions(self, user_id):
+        """
+        Get the user's saved sessions.
+
+        The returned list must not be modified; use the methods below.
+
+        Args:
+            user_id: Telegram user id
+
+        Returns:
+            List of session info dictionaries, oldest first
+        """
+        record = self.store.get_user(self.tenant, user_id)
+        return record['sessions'] if record else []
+
+    def add_session(self, user_id, session_info):
+        """Append a session and return its index"""
+        record = self._record(user_id)
+        record['sessions'].append(session_info)
+        self.store.put_user(self.tenant, user_id, record)
+        return len(record['sessions']) - 1
+
+    def update_session(self, user_id, index, **fields):
+        """Update fields of a saved session; returns False if it does not exist"""
+        record = self._record(user_id)
+        if index >= len(record['sessions']):
+            return False
+        record['sessions'][index].update(fields)
+        self.store.put_user(self.tenant, user_id, record)
+        return True
+
+    def replace_session(self, user_id, index, session_info):
+        """Replace a saved session entirely; returns False if it does not exist"""
+        record = self._record(user_id)
+        if index >= len(record['sessions']):
+            return False
+        record['sessions'][index] = session_info
+        self.store.put_user(self.tenant, user_id, record)
+        return True
+
+    def delete_session(self, user_id, index):
+        """Delete a saved session and return it, or None if it does not exist"""
+        record = self._record(user_id)
+        if index >= len(record['sessions']):
+            return None
+        session_info = record['sessions'].pop(index)
+        self.store.put_user(self.tenant, user_id, record)
+        return session_info
+
+    def get_setting(self, user_id, name, default=None):
+        """Get one of the user's settings"""
+        record = self.store.get_user(self.tenant, user_id)
+        return record['settings'].get(name, default) if record else default
+
+    def set_setting(self, user_id, name, value):
+        """Change one of the user's settings"""
+        record = self._record(user_id)
+        record['settings'][name] = value
+        self.store.put_user(self.tenant, user_id, record)
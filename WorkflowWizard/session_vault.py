@@ -0,0 +1,226 @@
+"""
+Encrypted-at-rest storage of saved session strings.
+
+A session string grants full access to its account, so saved sessions keep
+it sealed (secure_box AEAD, bound to the owning bot and user) under
+'sealed' instead of in plain text under 'string'.
+
+Every user has their own data key, derived from the vault's master key with
+scrypt. scrypt is deliberately expensive, so derived keys are cached in
+memory for VAULT_KEY_TTL seconds (bounded by VAULT_KEY_CACHE_SIZE, least
+recently used first out) and derivations run on a worker thread instead of
+the event loop. A user who opens a few sessions in a row pays for one
+derivation. Evicted keys are overwritten in place; Python may still hold
+transient copies, so this limits rather than rules out exposure in memory.
+
+open_batch() decrypts many sessions at once, deriving each user's key only
+once, for bulk jobs such as revalidating every saved session.
+"""
+import os
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from secure_box import seal, open_sealed, load_or_create_key, DecryptionError, KEY_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Master key file, used when SESSION_VAULT_KEY is not set
+VAULT_KEY_FILE = os.environ.get("VAULT_KEY_FILE", "vault.key")
+
+# Seconds a derived data key stays cached after its last use, and the most
+# keys cached at once
+VAULT_KEY_TTL = int(os.environ.get("VAULT_KEY_TTL", 600))
+VAULT_KEY_CACHE_SIZE = int(os.environ.get("VAULT_KEY_CACHE_SIZE", 10000))
+
+# scrypt cost (CPU/memory) of deriving one data key
+VAULT_KDF_N = int(os.environ.get("VAULT_KDF_N", 2 ** 14))
+_KDF_R = 8
+_KDF_P = 1
+
+
+def _zeroize(key):
+    """Overwrite a cached key in place"""
+    key[:] = bytes(len(key))
+
+
+class SessionVault:
+    """Seals and opens session strings with cached per-user data keys"""
+
+    def __init__(self, master_key=None, ttl=VAULT_KEY_TTL, cache_size=VAULT_KEY_CACHE_SIZE,
+                 kdf_n=VAULT_KDF_N):
+        self._master_key = master_key or load_or_create_key('SESSION_VAULT_KEY', VAULT_KEY_FILE)
+        self.ttl = ttl
+        # The key just derived must fit, or it would be zeroized before use
+        self.cache_size = max(1, cache_size)
+        self.kdf_n = kdf_n
+        # (tenant, user_id) -> [bytearray key, monotonic time of last use]
+        self._keys = OrderedDict()
+        # Derivations in progress, so concurrent requests share one
+        self._pending = {}
+        self.hits = 0
+        self.derivations = 0
+        self.evictions = 0
+
+    def derive_key(self, tenant, user_id):
+        """
+        Derive a user's data key (slow; does not use the cache).
+
+        Returns:
+            The 32-byte key
+        """
+        salt = hashlib.sha256(f"session-vault:{tenant}:{user_id}".encode()).digest()
+        return hashlib.scrypt(
+            self._master_key, salt=salt, n=self.kdf_n, r=_KDF_R, p=_KDF_P,
+            maxmem=256 * self.kdf_n * _KDF_R, dklen=KEY_SIZE
+        )
+
+    def _cached(self, key_id, now):
+        """Get a cached key that has not expired, refreshing its TTL"""
+        entry = self._keys.get(key_id)
+        if entry is None:
+            return None
+        if now - entry[1] > self.ttl:
+            self._evict(key_id)
+            return None
+        entry[1] = now
+        self._keys.move_to_end(key_id)
+        self.hits += 1
+        return entry[0]
+
+    def _store(self, key_id, key, now):
+        self._keys[key_id] = [key, now]
+        self._keys.move_to_end(key_id)
+        while len(self._keys) > self.cache_size:
+            self._evict(next(iter(self._keys)))
+
+    def _evict(self, key_id):
+        entry = self._keys.pop(key_id, None)
+        if entry is not None:
+            _zeroize(entry[0])
+            self.evictions += 1
+
+    async def data_key(self, tenant, user_id):
+        """
+        Get a user's data key, deriving it on a worker thread if not cached.
+
+        Returns:
+            The key as a bytearray; do not keep it beyond the current operation
+        """
+        key_id = (tenant, user_id)
+        key = self._cached(key_id, time.monotonic())
+        if key is not None:
+            return key
+
+        pending = self._pending.get(key_id)
+        if pending is None:
+            pending = self._pending[key_id] = asyncio.ensure_future(
+                asyncio.to_thread(self.derive_key, tenant, user_id)
+            )
+            pending.add_done_callback(lambda _: self._pending.pop(key_id, None))
+            self.derivations += 1
+        derived = await asyncio.shield(pending)
+        # Another waiter on the same derivation may have cached it already
+        entry = self._keys.get(key_id)
+        if entry is not None:
+            return entry[0]
+        key = bytearray(derived)
+        self._store(key_id, key, time.monotonic())
+        return key
+
+    async def seal_string(self, tenant, user_id, session_string):
+        """
+        Encrypt a session string for storage.
+
+        Returns:
+            The sealed blob as base64 text
+        """
+        key = await self.data_key(tenant, user_id)
+        blob = seal(bytes(key), session_string.encode(), _aad(tenant, user_id))
+        return base64.b64encode(blob).decode('ascii')
+
+    async def open_string(self, tenant, user_id, sealed):
+        """
+        Decrypt a session string sealed with seal_string().
+
+        Raises:
+            DecryptionError: If the blob is corrupt or belongs to someone else
+        """
+        key = await self.data_key(tenant, user_id)
+        return open_sealed(bytes(key), base64.b64decode(sealed), _aad(tenant, user_id)).decode()
+
+    async def open_batch(self, items):
+        """
+        Decrypt many sealed session strings, deriving each user's key once.
+
+        Keys missing from the cache are derived concurrently.
+
+        Args:
+            items: Iterable of (tenant, user_id, sealed)
+
+        Returns:
+            List of session strings in the same order, with None for blobs
+            that could not be decrypted
+        """
+        items = list(items)
+        owners = list(dict.fromkeys((tenant, user_id) for tenant, user_id, _ in items))
+
+        async def fetch(owner):
+            # Copy right away: with more owners than the cache holds, early
+            # keys are evicted (and zeroized) before the batch is done
+            return bytes(await self.data_key(*owner))
+
+        keys = dict(zip(owners, await asyncio.gather(*(fetch(owner) for owner in owners))))
+        results = []
+        for tenant, user_id, sealed in items:
+            try:
+                key = keys[(tenant, user_id)]
+                results.append(open_sealed(key, base64.b64decode(sealed), _aad(tenant, user_id)).decode())
+            except (DecryptionError, ValueError) as e:
+                logger.warning(f"Could not open a sealed session of user {user_id} on {tenant}: {e}")
+                results.append(None)
+        return results
+
+    def expire(self):
+        """
+        Evict and zeroize keys unused for longer than the TTL.
+
+        Returns:
+            Number of keys evicted
+        """
+        cutoff = time.monotonic() - self.ttl
+        expired = 0
+        # Least recently used first, so expired keys are all at the front
+        while self._keys:
+            key_id, entry = next(iter(self._keys.items()))
+            if entry[1] > cutoff:
+                break
+            self._evict(key_id)
+            expired += 1
+        return expired
+
+    def clear(self):
+        """Evict and zeroize every cached key"""
+        for key_id in list(self._keys):
+            self._evict(key_id)
+
+    def stats(self):
+        """
+        Get key cache statistics.
+
+        Returns:
+            Dictionary with cached keys, hits, derivations and evictions
+        """
+        return {
+            'cached_keys': len(self._keys),
+            'hits': self.hits,
+            'derivations': self.derivations,
+            'evictions': self.evictions
+        }
+
+
+def _aad(tenant, user_id):
+    """Bind a sealed session to its owner"""
+    return f"session:{tenant}:{user_id}".encode()
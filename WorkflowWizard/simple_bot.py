@@ -6,11 +6,40 @@ A feature-rich bot for generating and managing Telethon session strings,
 with multiple session support, validation features, and enhanced security.
 """
 import os
+import re
 import sys
 import time
 import logging
 import asyncio
 import datetime
+import functools
+import itertools
+import atexit
+import metrics
+import aes_backend
+import message_templates as templates
+from log_pipeline import setup_logging
+from flow_checkpoint import FlowCheckpointStore, CHECKPOINT_STAGES
+from session_store import SessionStore
+from session_vault import SessionVault
+from secure_box import DecryptionError
+from tenants import Tenant, load_tenant_config, session_name_for
+from utils import validate_phone_number, make_qr_png
+from admission import login_admission, validation_admission, QueueFullError
+from traffic_recorder import recorder_from_env
+from loop_watchdog import LoopWatchdog, capture_profile
+from api_credentials import CredentialPool, load_credentials
+from proxy_pool import ProxyPool, load_proxies
+from flood_ledger import (
+    ledger as flood_ledger, flood_keys, charged_keys, with_retries, describe_wait, UNPROCESSED_ERRORS, RPC_ATTEMPTS, RPC_RETRY_BASE
+)
+from transports import TransportSelector
+from auth_offload import start_pool as start_auth_offload, AUTH_KEY_WORKERS
+from flow_dashboard import publish_snapshots
+from inbound_limiter import INBOUND_START_COST, MUTED, ALLOWED
+from update_backlog import CATCH_UP, CATCH_UP_READY_TIMEOUT, RECENT, STALE
+import session_codec
+from validation_history import CheckHistory, VALID, UNAUTHORIZED, REVOKED, ERROR, describe as describe_checks
 from telethon import TelegramClient, events, Button
 from telethon.sessions import StringSession
 from telethon.errors import (
@@ -19,206 +48,869 @@ from telethon.errors import (
     SessionPasswordNeededError,
     PasswordHashInvalidError,
     AuthKeyUnregisteredError,
-    UserDeactivatedError
+    UserDeactivatedError,
+    FloodWaitError
 )
 
-# Configure logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+# Fork the key-exchange workers while this is the only thread; the log
+# listener and the session store writers started below must not be forked
+AUTH_OFFLOAD_ENABLED = start_auth_offload() if __name__ == "__main__" else False
+
+# Configure logging (handled on a background thread, see log_pipeline.py)
+setup_logging('bot')
 logger = logging.getLogger(__name__)
 
 # Telegram API credentials - confirmed by user
 API_ID = 20584497
 API_HASH = "73dcd3a22805af2f3d5c2693475c1746"
 
+# User clients spread over these credentials (API_CREDENTIALS); the pair
+# above is the default and the only one unless more are configured
+api_pool = CredentialPool(load_credentials(API_ID, API_HASH))
+
+# Egress proxies for user clients (PROXIES); clients connect directly if none
+proxy_pool = ProxyPool(load_proxies())
+
+# MTProto transport of user clients (USER_TRANSPORT, probed when 'auto')
+transport_selector = TransportSelector()
+
 # Device model for session info
 DEVICE_MODEL = "Advanced Telethon Session Manager"
 
-# Settings for auto-deletion of messages containing sensitive data
-auto_delete_settings = {}
+# Saved sessions and settings of all hosted bots, isolated per tenant
+session_store = SessionStore()
+# Shard writers commit in the background; commit what is queued on exit
+atexit.register(session_store.close)
 
-# Bot token from environment
-BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-if not BOT_TOKEN:
-    logger.error("TELEGRAM_BOT_TOKEN environment variable not set")
-    print("Error: No Telegram bot token found! Please set the TELEGRAM_BOT_TOKEN environment variable.")
-    print("You can get a token from @BotFather on Telegram.")
-    sys.exit(1)
+# Saved session strings are kept sealed with a per-user key
+vault = SessionVault()
 
-# Create the bot client
-bot = TelegramClient('simple_bot', API_ID, API_HASH)
+# How often idle users are evicted from memory and cache stats are logged
+STORE_MAINTENANCE_INTERVAL = 300
 
-# Store active sessions - simple key/value storage
-active_processes = {}
+# Encrypted checkpoints of in-flight login flows, restored after a restart
+checkpoints = FlowCheckpointStore()
 
-# Store saved sessions
-saved_sessions = {}
+# Measures event loop lag and attributes stalls to handlers
+watchdog = LoopWatchdog()
 
-@bot.on(events.NewMessage(pattern='/start'))
-async def start_command(event):
-    """Handler for /start command"""
-    # Clear any existing process for this user
-    user_id = event.sender_id
-    if user_id in active_processes:
-        # Clean up any existing clients
-        if 'client' in active_processes[user_id]:
-            try:
-                client = active_processes[user_id]['client']
-                if client:
-                    await client.disconnect()
-            except:
-                pass
-        # Remove the data
-        del active_processes[user_id]
-    
-    # Create main menu with buttons
-    markup = [
+# Telegram user ids allowed to use admin commands such as /profile
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+}
+
+# Default length of a /profile capture in seconds
+PROFILE_DEFAULT_SECONDS = 30
+
+# Users read per step of a /storage scan; the report is updated after each
+STORAGE_SCAN_STEP = 5000
+
+# Handlers registered on every hosted bot, as (callback, event type, filters)
+HANDLERS = []
+
+def on(event_type, **filters):
+    """Register a handler to be added to each tenant's bot at startup"""
+    def decorator(func):
+        HANDLERS.append((func, event_type, filters))
+        return func
+    return decorator
+
+def register_handlers(tenant):
+    """Attach all handlers to a tenant's bot, bound to that tenant"""
+    if recorder:
+        # Added first so the update is recorded before any handler runs
+        for event_type in (events.NewMessage, events.CallbackQuery):
+            tenant.bot.add_event_handler(functools.partial(recorder.record_update, tenant), event_type())
+    for func, event_type, filters in HANDLERS:
+        # Builders keep per-client state, so every bot gets its own
+        tenant.bot.add_event_handler(functools.partial(func, tenant), event_type(**filters))
+
+# Sent once to a user whose updates from while the bot was down were too old
+RESTART_NOTICE = ("🔄 The bot was restarted and missed what you sent while it was down. "
+                  "Please send /start to begin again.")
+
+async def sort_backlog(tenant, event, key, sent_at):
+    """
+    Handle a missed update according to the catch-up policy.
+    
+    Raises:
+        events.StopPropagation: If the update is stale, so no other handler runs
+    """
+    verdict = tenant.backlog.sort(key, sent_at)
+    if verdict == RECENT:
+        await tenant.backlog.admit()
+    if verdict != STALE:
+        return
+    # A user whose login was resumed already got its prompt instead
+    if not tenant.user_flows(event.sender_id) and tenant.backlog.first_notice(event.sender_id):
+        try:
+            await tenant.bot.send_message(event.sender_id, RESTART_NOTICE)
+        except Exception as e:
+            logger.warning(f"Could not send restart notice to user {event.sender_id}: {e}")
+    raise events.StopPropagation
+
+# Registered first: missed updates are sorted before the rate limit and routing
+@on(events.NewMessage)
+async def catch_up_messages(tenant, event):
+    """Drop or pace messages sent while the bot was down"""
+    if tenant.backlog.waiting:
+        await sort_backlog(tenant, event, ('message', event.chat_id, event.id), event.date.timestamp())
+
+@on(events.CallbackQuery)
+async def catch_up_callbacks(tenant, event):
+    """Drop or pace button presses made while the bot was down"""
+    if tenant.backlog.waiting:
+        await sort_backlog(tenant, event, ('callback', event.id), None)
+
+# Sent once when a user is muted for flooding the bot
+MUTE_NOTICE = "🚫 Too many requests. The bot will ignore you for {seconds} seconds."
+
+async def limit_inbound(tenant, event, cost):
+    """
+    Drop an update if its sender is over their rate limit.
+    
+    Raises:
+        events.StopPropagation: If the update is dropped, so no other handler runs
+    """
+    if event.sender_id in ADMIN_USER_IDS:
+        return
+    verdict = tenant.limiter.check(event.sender_id, cost)
+    if verdict == ALLOWED:
+        return
+    notice = MUTE_NOTICE.format(seconds=round(tenant.limiter.mute_seconds)) if verdict == MUTED else None
+    try:
+        if isinstance(event, events.CallbackQuery.Event):
+            # Answered even when dropped silently, or the button keeps spinning
+            await event.answer(notice, alert=notice is not None)
+        elif notice:
+            await event.respond(notice)
+    except Exception as e:
+        logger.warning(f"Could not answer dropped update of user {event.sender_id}: {e}")
+    raise events.StopPropagation
+
+# Registered before every other handler, so dropped updates cost no routing
+@on(events.NewMessage)
+async def limit_messages(tenant, event):
+    """Rate-limit incoming messages; /start costs more as it discards flows"""
+    cost = INBOUND_START_COST if (event.text or '').startswith('/start') else 1
+    await limit_inbound(tenant, event, cost)
+
+@on(events.CallbackQuery)
+async def limit_callbacks(tenant, event):
+    """Rate-limit button presses"""
+    await limit_inbound(tenant, event, 1)
+
+# Prompts shown when a checkpointed flow is restored after a restart
+RESUME_PROMPTS = {
+    'phone': "🔄 The bot was restarted. Please send your phone number in international format.",
+    'code': "🔄 The bot was restarted, but your login was kept.\n\n"
+            "Please enter the verification code you already received. No new code was requested.",
+    'password': "🔄 The bot was restarted, but your login was kept.\n\n"
+                "Please enter your 2FA password:",
+}
+
+# Shown when a flow parked on a FloodWait is restored after a restart
+RESUME_PARKED_PROMPT = ("🔄 The bot was restarted, but login #{flow_id} was kept. It will continue "
+                        "automatically in {wait}; there is nothing you need to do.")
+
+# Stages during which a flow counts against the login caps; a parked flow
+# waits for a FloodWait penalty to expire
+LOGIN_STAGES = CHECKPOINT_STAGES + ('qr', 'parked')
+
+# Stages during which a flow waits for the user's next message, and how they
+# are described when the bot has to ask which flow a message is for
+INPUT_STAGES = {
+    'phone': "waiting for a phone number",
+    'code': "waiting for the verification code",
+    'password': "waiting for the 2FA password",
+    'session_string_to_check': "waiting for a session string to check",
+    'session_label': "waiting for a session label",
+}
+
+# "#2 12345" sends "12345" to the user's flow number 2
+FLOW_SELECTOR = re.compile(r'^#(\d+)\s+(.*)$', re.DOTALL)
+
+# QR login: how often an unused token is replaced before giving up, and how
+# many seconds before its expiry the replacement is shown
+QR_LOGIN_MAX_REFRESHES = int(os.environ.get("QR_LOGIN_MAX_REFRESHES", 5))
+QR_REFRESH_MARGIN = 3
+
+# FloodWait penalties up to this many seconds are waited out by parking the
+# flow; longer ones end it, asking the user to come back later
+FLOOD_PARK_MAX = int(os.environ.get("FLOOD_PARK_MAX", 600))
+
+# Shown when a request is shed because the admission queue is full
+BUSY_TEXT = "⏳ The bot is very busy right now. Please try again in a few minutes."
+
+def note_client_error(client, error, phone=None, account=False):
+    """
+    Charge an RPC error to what caused it.
+    
+    A FloodWait goes to the phone number of a login, the account of a
+    signed-in session, or else the credential and egress (see
+    charged_keys); connection errors go to the proxy.
+    """
+    if client is not None and isinstance(error, FloodWaitError):
+        keys = charged_keys(client, phone, account)
+        flood_ledger.record(keys, error.seconds)
+        if ('api', client.api_id) in keys:
+            api_pool.note_error(client, error)
+    proxy_pool.note_error(client, error)
+
+def queue_position_notifier(msg):
+    """Build a callback that shows a waiting user their place in the queue"""
+    async def notify(position):
+        await msg.edit(
+            f"⏳ Many requests are being processed right now.\n\n"
+            f"You are number {position} in the queue. This message will update as you move up."
+        )
+    return notify
+
+def new_user_client(session_string=None, api_id=None, proxy=None):
+    """
+    Create a user client, optionally from an existing session string.
+    
+    Args:
+        session_string: Session to reopen, or None for a new login
+        api_id: Credential the session was created with; a new session
+            gets the credential chosen by the pool
+        proxy: Name of the proxy a resumed flow used; otherwise the proxy
+            pool picks one
+    """
+    # Counted against their load once connected, see connect_client()
+    credential = api_pool.get(api_id) if api_id else api_pool.pick()
+    egress = proxy_pool.get(proxy) if proxy else proxy_pool.pick()
+    session = StringSession(session_string)
+    # An MTProxy replaces the transport with its own
+    options = {'connection': transport_selector.choose(session.dc_id)}
+    options.update(egress.client_args() if egress else {})
+    client = TelegramClient(
+        session, credential.api_id, credential.api_hash,
+        # Raise every FloodWait so it reaches the ledger instead of being
+        # slept out inside a handler
+        flood_sleep_threshold=0,
+        # connect() retries dropped connections itself, as many times as
+        # with_retries() would
+        connection_retries=RPC_ATTEMPTS,
+        retry_delay=RPC_RETRY_BASE,
+        **options
+    )
+    # The client keeps this proxy for its lifetime
+    client.egress_proxy = egress
+    if recorder:
+        client = recorder.wrap_client(client)
+    return client
+
+async def connect_client(client):
+    """
+    Connect a user client.
+    
+    A client counts toward the load of its credential and proxy from its
+    first connection on; clients given up before connecting (parked flows,
+    a full queue, a known penalty) do not skew the choice for new ones.
+    Each connection also counts toward its proxy's health.
+    """
+    # Without an auth key, connecting includes the key exchange, which says
+    # nothing about the proxy's latency
+    has_key = client.session.auth_key is not None
+    started = time.perf_counter()
+    await client.connect()
+    proxy_pool.note_connected(client, time.perf_counter() - started if has_key else None)
+    if not getattr(client, 'load_counted', False):
+        client.load_counted = True
+        api_pool.client_created(api_pool.get(client.api_id))
+        proxy_pool.client_created(client.egress_proxy)
+
+def start_flow(tenant, user_id, expecting, **fields):
+    """
+    Start a new flow for a user.
+    
+    Logins run side by side; any other prompt (such as asking for a label)
+    replaces the user's previous prompt.
+    
+    Args:
+        tenant: Bot the flow runs on
+        user_id: Telegram user id owning the flow
+        expecting: Initial stage of the flow
+        **fields: Initial flow state, such as the status message
+        
+    Returns:
+        The new flow dictionary
+    """
+    if expecting not in LOGIN_STAGES:
+        for flow in tenant.user_flows(user_id):
+            if flow['expecting'] not in LOGIN_STAGES:
+                clear_flow(tenant, flow)
+    flow = dict(fields, id=tenant.next_flow_id(user_id), user_id=user_id, expecting=expecting)
+    tenant.add_flow(flow)
+    return flow
+
+def checkpoint_flow(tenant, flow):
+    """Persist a login flow after a state transition"""
+    parked = flow.get('expecting') == 'parked'
+    # A parked flow is saved at the stage it was parked in
+    stage = flow.get('parked_stage') if parked else flow.get('expecting')
+    if stage not in CHECKPOINT_STAGES:
+        checkpoints.discard(tenant.name, flow['user_id'], flow['id'])
+        return
+
+    client = flow.get('client')
+    status_msg = flow.get('status_msg')
+    checkpoints.save(tenant.name, flow['user_id'], flow['id'], {
+        'stage': stage,
+        # Unix time a parked flow continues at, and the step it continues with
+        'resume_at': flow['resume_at'] if parked else None,
+        'resume_step': flow['resume_step'].__name__ if parked else None,
+        'phone': flow.get('phone'),
+        'phone_code_hash': flow.get('phone_code_hash'),
+        # Includes the auth key, so the restored client needs no new code
+        'session': client.session.save() if client else None,
+        'api_id': client.api_id if client else None,
+        'proxy': client.egress_proxy.name if client and client.egress_proxy else None,
+        'status_msg_id': status_msg.id if status_msg else None
+    })
+
+def clear_flow(tenant, flow):
+    """Forget a flow and its checkpoint"""
+    tenant.remove_flow(flow)
+    checkpoints.discard(tenant.name, flow['user_id'], flow['id'])
+    # Stop waiting for a QR code that is no longer shown, or for a penalty
+    for name in ('qr_task', 'retry_task'):
+        task = flow.get(name)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+
+async def discard_flow(tenant, flow):
+    """Abandon a flow, disconnecting its user client if it has one"""
+    client = flow.get('client')
+    if client:
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"Could not disconnect client of abandoned flow: {e}")
+    clear_flow(tenant, flow)
+
+def count_login_flows(tenant, user_id=None):
+    """Number of logins in progress on a bot, or of one of its users"""
+    flows = tenant.all_flows() if user_id is None else tenant.user_flows(user_id)
+    return sum(1 for flow in flows if flow.get('expecting') in LOGIN_STAGES)
+
+def login_cap_message(tenant, user_id):
+    """Explain why a new login cannot start now, or return None if it can"""
+    if count_login_flows(tenant) >= tenant.max_active_flows:
+        return "⏳ Too many logins in progress. Please try again in a minute."
+    if count_login_flows(tenant, user_id) >= tenant.max_flows_per_user:
+        return (f"⏳ You already have {tenant.max_flows_per_user} logins in progress. "
+                "Finish one or send /cancel first.")
+    return None
+
+def is_command(text):
+    """Whether a message is handled by a command handler rather than a flow"""
+    return any(
+        event_type is events.NewMessage and 'pattern' in filters and re.match(filters['pattern'], text)
+        for _, event_type, filters in HANDLERS
+    )
+
+def waiting_flows(tenant, user_id):
+    """Get the user's flows that are waiting for a message, oldest first"""
+    return [flow for flow in tenant.user_flows(user_id) if flow['expecting'] in INPUT_STAGES]
+
+def route_message(tenant, event):
+    """
+    Find the flow a user's message is meant for.
+    
+    A reply to a flow's status message goes to that flow, as does a message
+    starting with a flow selector ("#2 ..."). Otherwise the message goes to
+    the user's only waiting flow, if there is just one.
+    
+    Returns:
+        Tuple of (flow or None, message text without the flow selector)
+    """
+    text = event.text or ''
+    waiting = waiting_flows(tenant, event.sender_id)
+    if not waiting:
+        return None, text
+    
+    reply_to = event.reply_to_msg_id
+    if reply_to:
+        for flow in waiting:
+            status_msg = flow.get('status_msg')
+            if status_msg and status_msg.id == reply_to:
+                return flow, text
+    
+    match = FLOW_SELECTOR.match(text.strip())
+    if match:
+        flow_id = int(match.group(1))
+        for flow in waiting:
+            if flow['id'] == flow_id:
+                return flow, match.group(2)
+    
+    if len(waiting) == 1:
+        return waiting[0], text
+    return None, text
+
+def describe_message(tenant, event):
+    """
+    Tell the traffic recorder which flow a message goes to.
+    
+    Returns:
+        Tuple of (flow id or None, stage the message is treated as)
+    """
+    flow, _ = route_message(tenant, event)
+    if flow is not None:
+        return flow['id'], flow['expecting']
+    # Unroutable, but possibly a code or password meant for one of the flows
+    if any(flow['expecting'] in CHECKPOINT_STAGES for flow in waiting_flows(tenant, event.sender_id)):
+        return None, 'password'
+    return None, None
+
+# Opt-in recording of updates and user-client RPCs (TRAFFIC_RECORDING)
+recorder = recorder_from_env(describe_message)
+
+async def resume_flows(tenants):
+    """Restore login flows that were checkpointed before the last restart"""
+    tenants_by_name = {tenant.name: tenant for tenant in tenants}
+    for (tenant_name, user_id, flow_id), state in checkpoints.load_all().items():
+        tenant = tenants_by_name.get(tenant_name)
+        if tenant is None:
+            # The bot is no longer configured; its checkpoint will expire
+            continue
+        stage = state['stage']
+        flow = {
+            'id': flow_id,
+            'user_id': user_id,
+            'expecting': stage,
+            'phone': state.get('phone'),
+            'phone_code_hash': state.get('phone_code_hash')
+        }
+        if state.get('session'):
+            flow['client'] = new_user_client(state['session'], state.get('api_id'), state.get('proxy'))
+        step = PARKED_STEPS.get(state.get('resume_step'))
+        if step:
+            delay = max(0, state['resume_at'] - time.time())
+            prompt = RESUME_PARKED_PROMPT.format(flow_id=flow_id, wait=describe_wait(delay))
+        else:
+            prompt = RESUME_PROMPTS[stage]
+
+        msg = None
+        try:
+            if state.get('status_msg_id'):
+                msg = await tenant.bot.get_messages(user_id, ids=state['status_msg_id'])
+            if msg:
+                msg = await msg.edit(prompt)
+            else:
+                msg = await tenant.bot.send_message(user_id, prompt)
+        except Exception as e:
+            logger.warning(f"Could not notify user {user_id} about resumed flow: {e}")
+
+        flow['status_msg'] = msg
+        tenant.add_flow(flow)
+        if step:
+            # The penalty may have expired while the bot was down
+            schedule_step(tenant, flow, delay, step)
+            logger.info(f"Resumed parked flow {flow_id} for user {user_id} on bot {tenant.name}, "
+                        f"continuing in {delay:.0f}s")
+        else:
+            logger.info(f"Resumed {stage} flow {flow_id} for user {user_id} on bot {tenant.name}")
+
+def main_menu_markup():
+    """Buttons of the main menu"""
+    return [
         [Button.inline('📱 Generate New Session', b'start_session')],
+        [Button.inline('📷 Log In with QR Code', b'start_qr_session')],
         [Button.inline('🔍 Check Session Validity', b'check_session')],
         [Button.inline('📋 View My Sessions', b'view_sessions')],
         [Button.inline('🔒 Auto-Delete Messages', b'toggle_autodelete')],
         [Button.inline('❓ Help', b'show_help')]
     ]
 
-    await event.respond(
-        "🔐 *Advanced Telethon Session Manager* 🔐\n\n"
-        "This bot helps you generate, validate, and manage multiple Telethon session strings with enhanced security features.\n\n"
-        "Select an option from the menu below:",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+@on(events.NewMessage, pattern='/start')
+async def start_command(tenant, event):
+    """Handler for /start command"""
+    # Abandon all of this user's flows
+    for flow in tenant.user_flows(event.sender_id):
+        await discard_flow(tenant, flow)
+    
+    text, entities = templates.MAIN_MENU.render()
+    await event.respond(text, formatting_entities=entities, buttons=main_menu_markup())
 
-@bot.on(events.CallbackQuery(data=b'start_session'))
-async def start_session(event):
+@on(events.CallbackQuery, data=b'start_session')
+async def start_session(tenant, event):
     """Start the session generation process"""
-    # Edit the button message to ask for the phone number
-    msg = await event.edit(
-        "📱 Please send your phone number in international format.\n"
+    user_id = event.sender_id
+    
+    # Enforce the bot's and the user's caps on concurrent login flows
+    refusal = login_cap_message(tenant, user_id)
+    if refusal:
+        await event.answer(refusal, alert=True)
+        return
+    await event.answer()
+    
+    # Each login gets its own status message, so the menu stays usable for
+    # starting more logins in parallel
+    flow = start_flow(tenant, user_id, 'phone', login_method='phone', started_at=time.monotonic())
+    prompt = (
+        f"📱 Login #{flow['id']}\n\n"
+        "Please send your phone number in international format.\n"
         "Example: +12345678900"
     )
-    
-    # Store a flag to recognize the next message as phone number
-    user_id = event.sender_id
-    active_processes[user_id] = {
-        'expecting': 'phone',
-        'status_msg': msg  # Save the message to edit it later
-    }
+    if len(waiting_flows(tenant, user_id)) > 1:
+        prompt += (
+            f"\n\nYou have other requests in progress: reply to this message, or start "
+            f"your message with #{flow['id']}, so it reaches this login."
+        )
+    flow['status_msg'] = await event.respond(prompt)
+    checkpoint_flow(tenant, flow)
 
-@bot.on(events.NewMessage)
-async def message_handler(event):
-    """Handle all incoming messages based on user state"""
+@on(events.CallbackQuery, data=b'start_qr_session')
+async def start_qr_session(tenant, event):
+    """Start generating a session by scanning a QR code on a logged-in device"""
     user_id = event.sender_id
+    refusal = login_cap_message(tenant, user_id)
+    if refusal:
+        await event.answer(refusal, alert=True)
+        return
+    await event.answer()
     
-    # If no active process for this user, ignore
-    if user_id not in active_processes:
+    flow = start_flow(tenant, user_id, 'qr', login_method='qr', started_at=time.monotonic())
+    msg = flow['status_msg'] = await event.respond(f"📷 Login #{flow['id']}: preparing QR code login...")
+    
+    # Wait for a login slot; it is only held while the token is requested
+    try:
+        await login_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(BUSY_TEXT, buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]])
+        clear_flow(tenant, flow)
         return
     
-    # Get what we're expecting from this user
-    expecting = active_processes[user_id].get('expecting')
+    client = None
+    try:
+        client = new_user_client()
+        wait = flood_ledger.check(flood_keys(client))
+        if wait:
+            await msg.edit(
+                flood_message(wait, "start a QR login"),
+                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+            )
+            clear_flow(tenant, flow)
+            return
+        await connect_client(client)
+        flow['client'] = client
+        # Safe to repeat: a second export only replaces the token
+        qr_login = await with_retries(client.qr_login)
+    except Exception as e:
+        logger.error(f"Error starting QR login: {e}")
+        note_client_error(client, e)
+        await msg.edit(
+            f"❌ Error starting QR login: {str(e)}",
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+        )
+        if client:
+            await client.disconnect()
+        clear_flow(tenant, flow)
+        return
+    finally:
+        login_admission.release()
+    
+    # Waiting can take minutes, so it runs outside the handler
+    flow['qr_task'] = asyncio.create_task(wait_for_qr_login(tenant, flow, client, qr_login))
+
+async def show_qr_code(tenant, flow, msg, qr_login):
+    """
+    Show the current QR login token, as an image when possible.
+    
+    Returns:
+        The message now showing the token
+    """
+    text, entities = templates.QR_LOGIN.render(url=qr_login.url)
+    markup = [[Button.inline('❌ Cancel', f"cancel_qr_{flow['id']}".encode())]]
+    # Rendering the image is CPU work, so keep it off the event loop
+    image = await asyncio.to_thread(make_qr_png, qr_login.url)
+    if image is None:
+        return await msg.edit(text, formatting_entities=entities, buttons=markup)
+    if msg.photo:
+        return await msg.edit(text, formatting_entities=entities, file=image, buttons=markup)
+    # A text message cannot be edited into a photo
+    await msg.delete()
+    return await tenant.bot.send_file(
+        flow['user_id'], image, caption=text, formatting_entities=entities, buttons=markup
+    )
+
+@on(events.CallbackQuery, pattern=r"cancel_qr_(\d+)")
+async def cancel_qr_session(tenant, event):
+    """Cancel a QR login and remove the QR code from the chat"""
+    flow_id = int(event.data.decode().split('_')[-1])
+    flow = tenant.get_flow(event.sender_id, flow_id)
+    if flow:
+        # Cancels the waiting task, which disconnects the client
+        clear_flow(tenant, flow)
+    
+    # The QR code may be a photo, which cannot be edited into the menu
+    try:
+        await event.delete()
+    except Exception as e:
+        logger.warning(f"Could not delete QR code message: {e}")
+    
+    markup = main_menu_markup()
+    
+    text, entities = templates.PROCESS_CANCELLED.render()
+    await event.respond(text, formatting_entities=entities, buttons=markup)
+
+async def wait_for_qr_login(tenant, flow, client, qr_login):
+    """Keep a fresh QR code on screen until another device accepts it"""
+    user_id = flow['user_id']
+    msg = flow['status_msg']
+    try:
+        for attempt in range(QR_LOGIN_MAX_REFRESHES + 1):
+            if attempt:
+                await qr_login.recreate()
+            msg = flow['status_msg'] = await show_qr_code(tenant, flow, msg, qr_login)
+            
+            # Replace the token shortly before it expires
+            remaining = (qr_login.expires - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            try:
+                await qr_login.wait(max(1, remaining - QR_REFRESH_MARGIN))
+                break
+            except asyncio.TimeoutError:
+                continue
+        else:
+            await msg.delete()
+            await tenant.bot.send_message(
+                user_id,
+                f"⌛ Login #{flow['id']}: the QR code was not scanned in time.",
+                buttons=[
+                    [Button.inline('📷 Try Again', b'start_qr_session')],
+                    [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
+                ]
+            )
+            await client.disconnect()
+            clear_flow(tenant, flow)
+            return
+        
+        # Show the session in a fresh text message rather than a photo caption
+        await msg.delete()
+        msg = flow['status_msg'] = await tenant.bot.send_message(user_id, "🔄 QR code accepted, generating session...")
+        await finish_login(tenant, flow, client, msg, None, label_suffix=' (QR)')
+    
+    except asyncio.CancelledError:
+        # The user cancelled or started over; the flow was already cleared
+        await client.disconnect()
+        raise
+    
+    except SessionPasswordNeededError:
+        await msg.delete()
+        flow['status_msg'] = await tenant.bot.send_message(
+            user_id,
+            f"🔐 Login #{flow['id']}: two-factor authentication is enabled.\n\n"
+            "Please enter your 2FA password:"
+        )
+        # Continue in the regular password step
+        flow['expecting'] = 'password'
+        checkpoint_flow(tenant, flow)
+    
+    except Exception as e:
+        logger.error(f"Error in QR login: {e}")
+        try:
+            await tenant.bot.send_message(
+                user_id,
+                f"❌ Error during QR login: {str(e)}",
+                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+            )
+        except Exception as e:
+            logger.warning(f"Could not report QR login error to user {user_id}: {e}")
+        await client.disconnect()
+        clear_flow(tenant, flow)
+
+async def ask_which_flow(event, flows):
+    """Ask a user with several waiting flows which one a message is for"""
+    deleted = False
+    # The message may be a code or password meant for one of the logins
+    if any(flow['expecting'] in CHECKPOINT_STAGES for flow in flows):
+        try:
+            await event.delete()
+            deleted = True
+        except Exception as e:
+            logger.warning(f"Could not delete unrouted message: {e}")
+    
+    lines = [f"#{flow['id']}: {INPUT_STAGES[flow['expecting']]}" for flow in flows]
+    await event.respond(
+        "❓ You have several requests in progress:\n\n" + "\n".join(lines) + "\n\n"
+        "Please reply to the message of the one you mean, or start your message with its number, "
+        f"e.g. #{flows[-1]['id']} followed by your answer."
+        + ("\n\n(Your message has been deleted from chat for security.)" if deleted else "")
+    )
+
+@on(events.NewMessage)
+async def message_handler(tenant, event):
+    """Route incoming messages to the flow they are meant for"""
+    if is_command(event.text or ''):
+        return
+    
+    flow, text = route_message(tenant, event)
+    
+    if flow is None:
+        # Nothing is waiting for a message, or it is unclear which flow is
+        waiting = waiting_flows(tenant, event.sender_id)
+        if len(waiting) > 1:
+            await ask_which_flow(event, waiting)
+        return
     
-    # Handle based on what we're expecting
+    # Handle based on what the flow is waiting for
+    expecting = flow['expecting']
     if expecting == 'phone':
-        await handle_phone(event, user_id)
+        await handle_phone(tenant, event, flow, text)
     elif expecting == 'code':
-        await handle_code(event, user_id)
+        await handle_code(tenant, event, flow, text)
     elif expecting == 'password':
-        await handle_password(event, user_id)
+        await handle_password(tenant, event, flow, text)
     elif expecting == 'session_string_to_check':
-        await handle_session_validation(event, user_id)
+        await handle_session_validation(tenant, event, flow, text)
     elif expecting == 'session_label':
-        await handle_session_label(event, user_id)
+        await handle_session_label(tenant, event, flow, text)
         
-async def handle_session_validation(event, user_id):
+async def handle_session_validation(tenant, event, flow, text):
     """Handle session string validation"""
-    session_string = event.text.strip()
+    session_string = text.strip()
     
     if not session_string:
         await event.respond("Please provide a valid session string.")
         return
     
-    # Save the status message for updating throughout the process
-    msg = await event.respond("🔍 Validating session string...")
-    active_processes[user_id]['status_msg'] = msg
+    # Reject anything that is not a session string before connecting; the
+    # flow keeps waiting for another try
+    try:
+        decoded = session_codec.decode(session_string)
+    except session_codec.MalformedSessionError as e:
+        reply_text, entities = templates.PASTED_SESSION_MALFORMED.render(reason=e)
+        await event.respond(
+            reply_text,
+            formatting_entities=entities,
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+        )
+        return
+    
+    # Save the status message for updating throughout the process; what the
+    # string says about itself is shown right away
+    reply_text, entities = templates.PASTED_SESSION_CHECKING.render(
+        layout=session_codec.LAYOUT_NAMES[decoded.layout],
+        dc_id=decoded.dc_id,
+        address=decoded.describe_address(),
+        key_id=f"{decoded.key_id:016x}"
+    )
+    msg = await event.respond(reply_text, formatting_entities=entities)
+    flow['status_msg'] = msg
+    
+    # Wait for a validation slot
+    try:
+        await validation_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(BUSY_TEXT, buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]])
+        clear_flow(tenant, flow)
+        return
     
+    client = None
     try:
-        # Create client with the session string
-        client = TelegramClient(StringSession(session_string), API_ID, API_HASH)
-        await client.connect()
+        # Create client with the session string, converted to Telethon's
+        # layout and pointed at its data center's own address
+        telethon_string = session_codec.to_telethon(decoded)
+        client = new_user_client(telethon_string)
+        wait = flood_ledger.check(flood_keys(client, account=True))
+        if wait:
+            await msg.edit(
+                flood_message(wait, "check the session"),
+                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+            )
+            return
+        await connect_client(client)
         
         # Check if the session is valid
-        if await client.is_user_authorized():
+        if await with_retries(client.is_user_authorized):
             # Get user info
-            me = await client.get_me()
+            me = await with_retries(client.get_me)
             user_name = f"{me.first_name} {me.last_name if me.last_name else ''}".strip()
             username_text = f"@{me.username}" if me.username else "No username"
             
+            if decoded.layout == 'telethon':
+                reply_text, entities = templates.PASTED_SESSION_VALID.render(
+                    user_name=user_name,
+                    username=username_text,
+                    user_id=me.id
+                )
+            else:
+                reply_text, entities = templates.PASTED_SESSION_VALID_CONVERTED.render(
+                    user_name=user_name,
+                    username=username_text,
+                    user_id=me.id,
+                    layout=session_codec.LAYOUT_NAMES[decoded.layout],
+                    session_string=telethon_string
+                )
             await msg.edit(
-                f"✅ *Session is valid!*\n\n"
-                f"*Account Information:*\n"
-                f"👤 User: {user_name}\n"
-                f"🔖 Username: {username_text}\n"
-                f"🆔 User ID: `{me.id}`\n\n"
-                f"This session is currently active and can be used.",
-                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-                parse_mode='Markdown'
+                reply_text,
+                formatting_entities=entities,
+                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
             )
         else:
+            reply_text, entities = templates.PASTED_SESSION_UNAUTHORIZED.render()
             await msg.edit(
-                "❌ *Session is not valid*\n\n"
-                "The session string you provided is not authorized.\n"
-                "This could happen if the session was revoked or expired.",
-                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-                parse_mode='Markdown'
+                reply_text,
+                formatting_entities=entities,
+                buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
             )
             
         # Clean up client
         await client.disconnect()
         
     except (AuthKeyUnregisteredError, UserDeactivatedError):
+        reply_text, entities = templates.PASTED_SESSION_REVOKED.render()
         await msg.edit(
-            "❌ *Session is invalid*\n\n"
-            "This session string has been revoked or the account has been deactivated.",
-            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-            parse_mode='Markdown'
+            reply_text,
+            formatting_entities=entities,
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+        )
+    
+    except FloodWaitError as e:
+        note_client_error(client, e, account=True)
+        await client.disconnect()
+        await msg.edit(
+            flood_message(e.seconds, "check the session"),
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
         )
         
     except Exception as e:
         logger.error(f"Error validating session: {e}")
+        note_client_error(client, e, account=True)
+        reply_text, entities = templates.PASTED_SESSION_ERROR.render(error=e)
         await msg.edit(
-            f"❌ *Error validating session*\n\n"
-            f"An error occurred: {str(e)}",
-            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-            parse_mode='Markdown'
+            reply_text,
+            formatting_entities=entities,
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
         )
+    
+    finally:
+        validation_admission.release()
+        # Clear user state
+        clear_flow(tenant, flow)
         
-    # Clear user state
-    if user_id in active_processes:
-        del active_processes[user_id]
-        
-async def handle_session_label(event, user_id):
+async def handle_session_label(tenant, event, flow, text):
     """Handle custom session labeling"""
-    label = event.text.strip()
+    user_id = flow['user_id']
+    await tenant.store.preload(user_id)
+    label = text.strip()
     
     if not label:
         await event.respond("Please provide a valid label for your session.")
         return
         
     # Get the session index
-    session_index = active_processes[user_id].get('session_index', 0)
+    session_index = flow.get('session_index', 0)
     
     # Update the label
-    if user_id in saved_sessions and session_index < len(saved_sessions[user_id]):
-        saved_sessions[user_id][session_index]['label'] = label
-        
+    if tenant.store.update_session(user_id, session_index, label=label):
+        text, entities = templates.SESSION_RENAMED.render(label=label)
         await event.respond(
-            f"✅ Session renamed to: *{label}*",
-            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-            parse_mode='Markdown'
+            text,
+            formatting_entities=entities,
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
         )
     else:
         await event.respond(
@@ -227,20 +919,24 @@ async def handle_session_label(event, user_id):
         )
         
     # Clear user state
-    if user_id in active_processes:
-        del active_processes[user_id]
+    clear_flow(tenant, flow)
 
-async def handle_phone(event, user_id):
+async def handle_phone(tenant, event, flow, text):
     """Handle phone number input"""
-    phone = event.text.strip()
-    
-    if not phone.startswith('+'):
-        await event.respond("Please provide a valid phone number starting with +")
+    # Reject impossible numbers locally, before any connection is made
+    valid, result = validate_phone_number(text.strip())
+    if not valid:
+        metrics.incr('phone_rejected_before_network')
+        await event.respond(
+            f"❌ {result}\n\n"
+            "Please send your phone number in international format, e.g. +12345678900"
+        )
         return
+    phone = result
     
     # Store phone number
-    active_processes[user_id]['phone'] = phone
-    active_processes[user_id]['expecting'] = 'code'
+    flow['phone'] = phone
+    flow['expecting'] = 'code'
     
     # Delete the phone number message for security
     try:
@@ -249,7 +945,7 @@ async def handle_phone(event, user_id):
         logger.warning(f"Could not delete phone message: {e}")
     
     # Get the existing status message or create a new one
-    msg = active_processes[user_id].get('status_msg')
+    msg = flow.get('status_msg')
     if msg:
         try:
             await msg.edit("📲 Requesting verification code... (Your phone number has been deleted from chat for security)")
@@ -260,33 +956,116 @@ async def handle_phone(event, user_id):
         msg = await event.respond("📲 Requesting verification code... (Your phone number has been deleted from chat for security)")
     
     # Update the status message reference
-    active_processes[user_id]['status_msg'] = msg
+    flow['status_msg'] = msg
+    
+    await request_code(tenant, flow)
+
+async def request_code(tenant, flow):
+    """Connect a new user client and have Telegram send the login code"""
+    msg = flow['status_msg']
+    phone = flow['phone']
+    flow['expecting'] = 'code'
+    
+    # A code request the ledger knows will be refused is postponed instead
+    client = new_user_client()
+    wait = flood_ledger.check(flood_keys(client, phone))
+    if wait:
+        await park_flow(tenant, flow, wait, request_code)
+        return
+    
+    # Wait for a login slot
+    try:
+        await login_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(BUSY_TEXT)
+        clear_flow(tenant, flow)
+        return
     
     try:
-        # Create new client
-        client = TelegramClient(StringSession(), API_ID, API_HASH)
-        await client.connect()
+        await connect_client(client)
         
         # Store client
-        active_processes[user_id]['client'] = client
+        flow['client'] = client
         
         # Request verification code
-        await client.send_code_request(phone)
+        sent_code = await with_retries(client.send_code_request, phone, retry_on=UNPROCESSED_ERRORS)
         
-        await msg.edit(
-            "✅ Verification code sent!\n\n"
-            "Please enter the verification code you received.\n"
-            "You can add spaces between digits if needed (e.g. `1 2 3 4 5`)",
-            parse_mode='Markdown'
-        )
+        # Keep the hash so a restored client can sign in without a new code
+        flow['phone_code_hash'] = sent_code.phone_code_hash
+        checkpoint_flow(tenant, flow)
+        
+        text, entities = templates.CODE_SENT.render()
+        await msg.edit(text, formatting_entities=entities)
+    except FloodWaitError as e:
+        note_client_error(client, e, phone)
+        await client.disconnect()
+        flow['client'] = None
+        await park_flow(tenant, flow, e.seconds, request_code)
     except Exception as e:
         logger.error(f"Error sending code request: {e}")
+        note_client_error(client, e, phone)
         await msg.edit(f"❌ Error requesting verification code: {str(e)}")
-        del active_processes[user_id]
+        clear_flow(tenant, flow)
+    finally:
+        login_admission.release()
+
+async def park_flow(tenant, flow, seconds, step):
+    """
+    Postpone a login step until a FloodWait penalty has expired.
+    
+    Args:
+        tenant: Bot the flow runs on
+        flow: The login flow
+        seconds: Length of the penalty
+        step: Coroutine function (tenant, flow) run when it has expired
+    """
+    msg = flow['status_msg']
+    if seconds > FLOOD_PARK_MAX:
+        await msg.edit(
+            f"⏳ Telegram is limiting login requests right now. "
+            f"Please try again in {describe_wait(seconds)}.",
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+        )
+        await discard_flow(tenant, flow)
+        return
+    
+    schedule_step(tenant, flow, seconds, step)
+    await msg.edit(
+        f"⏳ Telegram asked us to slow down. Login #{flow['id']} will continue "
+        f"automatically in {describe_wait(seconds)}; there is nothing you need to do."
+    )
 
-async def handle_code(event, user_id):
+def schedule_step(tenant, flow, seconds, step):
+    """
+    Park a flow and run a login step once a delay has passed.
+    
+    The parked flow is checkpointed with its stage and deadline, so
+    resume_flows() schedules the step again after a restart.
+    """
+    if flow['expecting'] != 'parked':
+        flow['parked_stage'] = flow['expecting']
+        flow['expecting'] = 'parked'
+    flow['resume_at'] = time.time() + seconds
+    flow['resume_step'] = step
+    checkpoint_flow(tenant, flow)
+    
+    async def resume():
+        await asyncio.sleep(seconds)
+        flow['expecting'] = flow.pop('parked_stage')
+        del flow['resume_at'], flow['resume_step']
+        await step(tenant, flow)
+    flow['retry_task'] = asyncio.create_task(resume())
+
+# Login steps a parked flow can continue with, by name, for resume_flows()
+PARKED_STEPS = {step.__name__: step for step in (request_code,)}
+
+def flood_message(seconds, action):
+    """Tell the user how long Telegram blocks an action"""
+    return f"⏳ Telegram is limiting requests right now. Please {action} again in {describe_wait(seconds)}."
+
+async def handle_code(tenant, event, flow, text):
     """Handle verification code input"""
-    code = event.text.strip()
+    code = text.strip()
     
     # Remove any non-digits
     clean_code = ''.join(c for c in code if c.isdigit())
@@ -295,12 +1074,12 @@ async def handle_code(event, user_id):
         await event.respond("Please provide a valid verification code containing digits.")
         return
     
-    phone = active_processes[user_id].get('phone')
-    client = active_processes[user_id].get('client')
+    phone = flow.get('phone')
+    client = flow.get('client')
     
     if not client:
         await event.respond("Session expired. Please start again with /start")
-        del active_processes[user_id]
+        clear_flow(tenant, flow)
         return
     
     # Delete the verification code message for security
@@ -310,7 +1089,7 @@ async def handle_code(event, user_id):
         logger.warning(f"Could not delete verification code message: {e}")
     
     # Get the existing status message or create a new one
-    msg = active_processes[user_id].get('status_msg')
+    msg = flow.get('status_msg')
     if msg:
         try:
             await msg.edit("🔄 Verifying code and generating session... (Your verification code has been deleted from chat for security)")
@@ -321,74 +1100,38 @@ async def handle_code(event, user_id):
         msg = await event.respond("🔄 Verifying code and generating session... (Your verification code has been deleted from chat for security)")
     
     # Update the status message reference
-    active_processes[user_id]['status_msg'] = msg
+    flow['status_msg'] = msg
+    
+    # The code stays valid while a penalty runs out, so the user can resend it
+    wait = flood_ledger.check(flood_keys(client, phone))
+    if wait:
+        await msg.edit(flood_message(wait, "send the code"))
+        return
+    
+    # Wait for a login slot; the flow stays at the code step if we are too busy
+    try:
+        await login_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(BUSY_TEXT + "\n\nYour code is still valid: send it again in a minute.")
+        return
     
     try:
         # Make sure client is connected
         if not client.is_connected():
-            await client.connect()
+            await connect_client(client)
         
         try:
             # Try to sign in with code
-            await client.sign_in(phone=phone, code=clean_code)
-            
-            # Success - get session string
-            me = await client.get_me()
-            session_string = client.session.save()
-            
-            # Format response
-            user_name = f"{me.first_name} {me.last_name if me.last_name else ''}".strip()
-            username_text = f"@{me.username}" if me.username else ""
-            current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Save the session
-            if user_id not in saved_sessions:
-                saved_sessions[user_id] = []
-                
-            session_info = {
-                'string': session_string,
-                'phone': phone,
-                'user_info': {
-                    'name': user_name,
-                    'username': me.username,
-                    'id': me.id
-                },
-                'created_at': current_time,
-                'device': f"Telethon {DEVICE_MODEL}",
-                'label': f"Session {len(saved_sessions[user_id]) + 1}"
-            }
-            
-            saved_sessions[user_id].append(session_info)
-            
-            # Generate options to save and manage the session
-            markup = [
-                [Button.inline('📋 Save with Custom Label', b'label_session')],
-                [Button.inline('🔙 Back to Main Menu', b'back_to_menu')],
-                [Button.inline('🔄 Generate Another Session', b'start_session')]
-            ]
-            
-            await msg.edit(
-                f"✅ Session generated successfully!\n\n"
-                f"📱 User: {user_name}\n"
-                f"{username_text}\n"
-                f"🆔 ID: {me.id}\n"
-                f"☎️ Phone: {phone}\n\n"
-                f"🔐 Session String:\n`{session_string}`\n\n"
-                f"⚠️ *IMPORTANT*: This session string gives full access to your account. "
-                f"Never share it with anyone!\n\n"
-                f"Your session was automatically saved. You can access it later from the main menu.",
-                buttons=markup,
-                parse_mode='Markdown'
+            await with_retries(
+                client.sign_in,
+                phone=phone,
+                code=clean_code,
+                phone_code_hash=flow.get('phone_code_hash'),
+                retry_on=UNPROCESSED_ERRORS
             )
             
-            # Set timer for auto-deletion if enabled
-            if user_id in auto_delete_settings and auto_delete_settings[user_id]:
-                # Schedule message deletion in 5 minutes
-                asyncio.create_task(auto_delete_message(msg, 300))
-            
-            # Clean up
-            await client.disconnect()
-            del active_processes[user_id]
+            # Success - save and show the new session
+            await finish_login(tenant, flow, client, msg, phone)
             
         except PhoneCodeInvalidError:
             await msg.edit(
@@ -396,7 +1139,7 @@ async def handle_code(event, user_id):
                 "Please try again with the correct code."
             )
             # Keep expecting code
-            active_processes[user_id]['expecting'] = 'code'
+            flow['expecting'] = 'code'
             
         except PhoneCodeExpiredError:
             await msg.edit(
@@ -405,7 +1148,7 @@ async def handle_code(event, user_id):
             )
             # Clean up
             await client.disconnect()
-            del active_processes[user_id]
+            clear_flow(tenant, flow)
             
         except SessionPasswordNeededError:
             await msg.edit(
@@ -413,19 +1156,26 @@ async def handle_code(event, user_id):
                 "Please enter your 2FA password:"
             )
             # Now expecting password
-            active_processes[user_id]['expecting'] = 'password'
+            flow['expecting'] = 'password'
+            checkpoint_flow(tenant, flow)
+        
+        except FloodWaitError as e:
+            note_client_error(client, e, phone)
+            await msg.edit(flood_message(e.seconds, "send the code"))
             
         except Exception as e:
             logger.error(f"Error signing in with code: {e}")
+            note_client_error(client, e, phone)
             await msg.edit(
                 f"❌ Error verifying code: {str(e)}\n\n"
                 f"Please try again or restart with /start"
             )
             # Keep expecting code in case they want to retry
-            active_processes[user_id]['expecting'] = 'code'
+            flow['expecting'] = 'code'
             
     except Exception as e:
         logger.error(f"Connection error in code handler: {e}")
+        note_client_error(client, e, phone)
         await msg.edit(
             f"❌ Connection error: {str(e)}\n\n"
             f"Please restart with /start"
@@ -433,22 +1183,24 @@ async def handle_code(event, user_id):
         # Clean up
         if client:
             await client.disconnect()
-        del active_processes[user_id]
+        clear_flow(tenant, flow)
+    finally:
+        login_admission.release()
 
-async def handle_password(event, user_id):
+async def handle_password(tenant, event, flow, text):
     """Handle 2FA password input"""
-    password = event.text.strip()
+    password = text.strip()
     
     if not password:
         await event.respond("Please provide your 2FA password.")
         return
     
-    client = active_processes[user_id].get('client')
-    phone = active_processes[user_id].get('phone')
+    client = flow.get('client')
+    phone = flow.get('phone')
     
     if not client:
         await event.respond("Session expired. Please start again with /start")
-        del active_processes[user_id]
+        clear_flow(tenant, flow)
         return
     
     # Delete the 2FA password message for security
@@ -458,7 +1210,7 @@ async def handle_password(event, user_id):
         logger.warning(f"Could not delete 2FA password message: {e}")
     
     # Get the existing status message or create a new one
-    msg = active_processes[user_id].get('status_msg')
+    msg = flow.get('status_msg')
     if msg:
         try:
             await msg.edit("🔐 Verifying 2FA password... (Your password has been deleted from chat for security)")
@@ -469,73 +1221,30 @@ async def handle_password(event, user_id):
         msg = await event.respond("🔐 Verifying 2FA password... (Your password has been deleted from chat for security)")
     
     # Update the status message reference
-    active_processes[user_id]['status_msg'] = msg
+    flow['status_msg'] = msg
+    
+    wait = flood_ledger.check(flood_keys(client, phone))
+    if wait:
+        await msg.edit(flood_message(wait, "send your 2FA password"))
+        return
+    
+    # Wait for a login slot; the flow stays at the password step if we are too busy
+    try:
+        await login_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(BUSY_TEXT + "\n\nPlease send your 2FA password again in a minute.")
+        return
     
     try:
         # Make sure client is connected
         if not client.is_connected():
-            await client.connect()
+            await connect_client(client)
         
         # Try to sign in with password
-        await client.sign_in(password=password)
-        
-        # Success - get session string
-        me = await client.get_me()
-        session_string = client.session.save()
-        
-        # Format response
-        user_name = f"{me.first_name} {me.last_name if me.last_name else ''}".strip()
-        username_text = f"@{me.username}" if me.username else ""
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Save the session
-        if user_id not in saved_sessions:
-            saved_sessions[user_id] = []
-            
-        session_info = {
-            'string': session_string,
-            'phone': phone,
-            'user_info': {
-                'name': user_name,
-                'username': me.username,
-                'id': me.id
-            },
-            'created_at': current_time,
-            'device': f"Telethon {DEVICE_MODEL}",
-            'label': f"Session {len(saved_sessions[user_id]) + 1} (2FA)"
-        }
-        
-        saved_sessions[user_id].append(session_info)
-        
-        # Generate options to save and manage the session
-        markup = [
-            [Button.inline('📋 Save with Custom Label', b'label_session')],
-            [Button.inline('🔙 Back to Main Menu', b'back_to_menu')],
-            [Button.inline('🔄 Generate Another Session', b'start_session')]
-        ]
+        await with_retries(client.sign_in, password=password, retry_on=UNPROCESSED_ERRORS)
         
-        await msg.edit(
-            f"✅ Session generated successfully!\n\n"
-            f"📱 User: {user_name}\n"
-            f"{username_text}\n"
-            f"🆔 ID: {me.id}\n"
-            f"☎️ Phone: {phone}\n\n"
-            f"🔐 Session String:\n`{session_string}`\n\n"
-            f"⚠️ *IMPORTANT*: This session string gives full access to your account. "
-            f"Never share it with anyone!\n\n"
-            f"Your session was automatically saved. You can access it later from the main menu.",
-            buttons=markup,
-            parse_mode='Markdown'
-        )
-        
-        # Set timer for auto-deletion if enabled
-        if user_id in auto_delete_settings and auto_delete_settings[user_id]:
-            # Schedule message deletion in 5 minutes
-            asyncio.create_task(auto_delete_message(msg, 300))
-        
-        # Clean up
-        await client.disconnect()
-        del active_processes[user_id]
+        # Success - save and show the new session
+        await finish_login(tenant, flow, client, msg, phone, label_suffix=' (2FA)')
         
     except PasswordHashInvalidError:
         await msg.edit(
@@ -543,16 +1252,98 @@ async def handle_password(event, user_id):
             "Please try again with the correct password."
         )
         # Keep expecting password
-        active_processes[user_id]['expecting'] = 'password'
+        flow['expecting'] = 'password'
+    
+    except FloodWaitError as e:
+        note_client_error(client, e, phone)
+        await msg.edit(flood_message(e.seconds, "send your 2FA password"))
         
     except Exception as e:
         logger.error(f"Error in password handler: {e}")
+        note_client_error(client, e, phone)
         await msg.edit(
             f"❌ Error with 2FA password: {str(e)}\n\n"
             f"Please try again or restart with /start"
         )
         # Keep expecting password in case they want to retry
-        active_processes[user_id]['expecting'] = 'password'
+        flow['expecting'] = 'password'
+    finally:
+        login_admission.release()
+
+async def finish_login(tenant, flow, client, msg, phone, label_suffix=''):
+    """
+    Save the session of a completed login and show it to the user.
+    
+    Args:
+        tenant: Bot the login ran on
+        flow: The login flow
+        client: The now authorized user client
+        msg: Status message to replace with the session details
+        phone: Phone number used to log in, or None to take it from the account
+        label_suffix: Appended to the default session label
+    """
+    user_id = flow['user_id']
+    await tenant.store.preload(user_id)
+    me = await client.get_me()
+    session_string = client.session.save()
+    if not phone:
+        phone = f"+{me.phone}" if me.phone else "Unknown"
+    
+    # Format response
+    user_name = f"{me.first_name} {me.last_name if me.last_name else ''}".strip()
+    username_text = f"@{me.username}" if me.username else ""
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    
+    # Save the session
+    session_info = {
+        'sealed': await vault.seal_string(tenant.name, user_id, session_string),
+        # The session stays bound to the app it was created with
+        'api_id': client.api_id,
+        'phone': phone,
+        'user_info': {
+            'name': user_name,
+            'username': me.username,
+            'id': me.id
+        },
+        'created_at': current_time,
+        'device': f"Telethon {DEVICE_MODEL}",
+        'label': f"Session {len(tenant.store.sessions(user_id)) + 1}{label_suffix}"
+    }
+    
+    session_index = tenant.store.add_session(user_id, session_info)
+    
+    # Generate options to save and manage the session; the label button
+    # names the session, as other logins may finish in the meantime
+    markup = [
+        [Button.inline('📋 Save with Custom Label', f"label_session_{session_index}".encode())],
+        [Button.inline('🔙 Back to Main Menu', b'back_to_menu')],
+        [Button.inline('🔄 Generate Another Session', b'start_session')]
+    ]
+    
+    text, entities = templates.SESSION_GENERATED.render(
+        user_name=user_name,
+        username=username_text,
+        user_id=me.id,
+        phone=phone,
+        session_string=session_string
+    )
+    await msg.edit(text, formatting_entities=entities, buttons=markup)
+    
+    # Set timer for auto-deletion if enabled
+    if tenant.store.get_setting(user_id, 'auto_delete', False):
+        # Schedule message deletion in 5 minutes
+        asyncio.create_task(auto_delete_message(msg, 300))
+    
+    # Time from choosing a login method to holding a session, per method
+    if 'started_at' in flow:
+        metrics.observe(
+            f"time_to_session_{flow.get('login_method', 'phone')}",
+            time.monotonic() - flow['started_at']
+        )
+    
+    # Clean up
+    await client.disconnect()
+    clear_flow(tenant, flow)
 
 # Auto-delete message helper function
 async def auto_delete_message(message, delay_seconds):
@@ -563,95 +1354,67 @@ async def auto_delete_message(message, delay_seconds):
     except Exception as e:
         logger.error(f"Failed to auto-delete message: {e}")
 
-@bot.on(events.CallbackQuery(data=b'back_to_menu'))
-async def back_to_menu(event):
+@on(events.CallbackQuery, data=b'back_to_menu')
+async def back_to_menu(tenant, event):
     """Handle back to menu button"""
     user_id = event.sender_id
     
-    # Clean up any active processes
-    if user_id in active_processes:
-        if 'client' in active_processes[user_id]:
-            try:
-                client = active_processes[user_id]['client']
-                if client:
-                    await client.disconnect()
-            except:
-                pass
-        del active_processes[user_id]
+    # Leave any pending prompt; logins in progress keep running
+    for flow in tenant.user_flows(user_id):
+        if flow['expecting'] not in LOGIN_STAGES:
+            await discard_flow(tenant, flow)
     
     # Show main menu
-    markup = [
-        [Button.inline('📱 Generate New Session', b'start_session')],
-        [Button.inline('🔍 Check Session Validity', b'check_session')],
-        [Button.inline('📋 View My Sessions', b'view_sessions')],
-        [Button.inline('🔒 Auto-Delete Messages', b'toggle_autodelete')],
-        [Button.inline('❓ Help', b'show_help')]
-    ]
-    
-    await event.edit(
-        "🔐 *Advanced Telethon Session Manager* 🔐\n\n"
-        "This bot helps you generate, validate, and manage multiple Telethon session strings with enhanced security features.\n\n"
-        "Select an option from the menu below:",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+    text, entities = templates.MAIN_MENU.render()
+    await event.edit(text, formatting_entities=entities, buttons=main_menu_markup())
 
-@bot.on(events.CallbackQuery(data=b'toggle_autodelete'))
-async def toggle_autodelete(event):
+@on(events.CallbackQuery, data=b'toggle_autodelete')
+async def toggle_autodelete(tenant, event):
     """Toggle auto-delete for security"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     
     # Toggle setting
-    auto_delete_settings[user_id] = not auto_delete_settings.get(user_id, False)
+    enabled = not tenant.store.get_setting(user_id, 'auto_delete', False)
+    tenant.store.set_setting(user_id, 'auto_delete', enabled)
     
-    status = "✅ Enabled" if auto_delete_settings[user_id] else "❌ Disabled"
+    status = "✅ Enabled" if enabled else "❌ Disabled"
     
     markup = [[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
     
-    await event.edit(
-        f"🔒 *Auto-Delete Security* 🔒\n\n"
-        f"Auto-deletion of messages containing sensitive data is now:\n"
-        f"*{status}*\n\n"
-        f"Security features:\n"
-        f"• Phone numbers are always deleted immediately after processing\n"
-        f"• Verification codes are always deleted after submission\n"
-        f"• 2FA passwords are always deleted for maximum security\n"
-        f"• Session strings will be automatically deleted after 5 minutes when this setting is enabled",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+    text, entities = templates.AUTO_DELETE_STATUS.render(status=status)
+    await event.edit(text, formatting_entities=entities, buttons=markup)
 
-@bot.on(events.CallbackQuery(data=b'view_sessions'))
-async def view_sessions(event):
+@on(events.CallbackQuery, data=b'view_sessions')
+async def view_sessions(tenant, event):
     """View saved sessions"""
     user_id = event.sender_id
+    # A user idle for a while is read from disk in a worker thread
+    await tenant.store.preload(user_id)
     
     # Check if user has saved sessions
-    if user_id not in saved_sessions or not saved_sessions[user_id]:
+    sessions = tenant.store.sessions(user_id)
+    if not sessions:
         markup = [[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
-        await event.edit(
-            "📋 *Your Saved Sessions* 📋\n\n"
-            "You don't have any saved sessions yet.\n\n"
-            "Generate a new session to get started.",
-            buttons=markup,
-            parse_mode='Markdown'
-        )
+        text, entities = templates.NO_SAVED_SESSIONS.render()
+        await event.edit(text, formatting_entities=entities, buttons=markup)
         return
     
     # List all sessions
-    session_list = []
+    session_list = [templates.SAVED_SESSIONS_HEADER.render()]
     markup = []
     
-    for i, session in enumerate(saved_sessions[user_id]):
+    for i, session in enumerate(sessions):
         label = session.get('label', f"Session {i+1}")
         created = session.get('created_at', 'Unknown date')
         phone = session.get('phone', 'Unknown')
         
-        session_list.append(
-            f"{i+1}. *{label}*\n"
-            f"   📱 Phone: `{phone}`\n"
-            f"   🕒 Created: {created}"
-        )
+        session_list.append(templates.SAVED_SESSION_ENTRY.render(
+            number=i+1,
+            label=label,
+            phone=phone,
+            created=created
+        ))
         
         # Add button for this session
         markup.append([Button.inline(f"🔍 Manage Session #{i+1}", f"manage_session_{i}".encode())])
@@ -659,55 +1422,58 @@ async def view_sessions(event):
     # Add back button
     markup.append([Button.inline('🔙 Back to Main Menu', b'back_to_menu')])
     
-    await event.edit(
-        "📋 *Your Saved Sessions* 📋\n\n" + 
-        "\n\n".join(session_list) + 
-        "\n\nClick on a session to manage it:",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+    session_list.append(templates.SAVED_SESSIONS_FOOTER.render())
+    text, entities = templates.join_rendered(session_list, separator="\n\n")
+    await event.edit(text, formatting_entities=entities, buttons=markup)
 
-@bot.on(events.CallbackQuery(data=b'label_session'))
-async def label_session_request(event):
-    """Request a label for the most recent session"""
+@on(events.CallbackQuery, pattern=r"label_session(_\d+)?$")
+async def label_session_request(tenant, event):
+    """Request a label for a newly generated session"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     
     # Check if user has sessions
-    if user_id not in saved_sessions or not saved_sessions[user_id]:
+    sessions = tenant.store.sessions(user_id)
+    if not sessions:
         await event.edit(
             "❌ No session found to label.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
         )
         return
     
-    # Set session index to the most recent one
-    session_index = len(saved_sessions[user_id]) - 1
-    
-    # Store the index and set state
-    active_processes[user_id] = {
-        'expecting': 'session_label',
-        'session_index': session_index
-    }
+    # The button names the session; older buttons mean the most recent one
+    suffix = event.data.decode()[len('label_session_'):]
+    session_index = int(suffix) if suffix else len(sessions) - 1
+    if session_index >= len(sessions):
+        await event.edit(
+            "❌ Session not found. It may have been deleted.",
+            buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
+        )
+        return
     
-    await event.edit(
-        "📝 *Custom Session Label* 📝\n\n"
-        "Please send a name for this session. This will help you identify it later.\n\n"
-        "Examples: 'Main Account', 'Business Account', 'Bot Development'",
-        buttons=[[Button.inline('🔙 Cancel', b'back_to_menu')]],
-        parse_mode='Markdown'
+    text, entities = templates.LABEL_PROMPT.render()
+    msg = await event.edit(
+        text,
+        formatting_entities=entities,
+        buttons=[[Button.inline('🔙 Cancel', b'back_to_menu')]]
     )
+    
+    # Store the index and set state
+    start_flow(tenant, user_id, 'session_label', session_index=session_index, status_msg=msg)
 
 # Pattern for session management buttons
-@bot.on(events.CallbackQuery(pattern=r"manage_session_(\d+)"))
-async def manage_session(event):
+@on(events.CallbackQuery, pattern=r"manage_session_(\d+)")
+async def manage_session(tenant, event):
     """Manage a specific session"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     
     # Extract session index from the button data
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
@@ -715,12 +1481,13 @@ async def manage_session(event):
         return
     
     # Get session info
-    session = saved_sessions[user_id][session_index]
+    session = sessions[session_index]
     label = session.get('label', f"Session {session_index+1}")
     created = session.get('created_at', 'Unknown date')
     phone = session.get('phone', 'Unknown')
     username = session.get('user_info', {}).get('username', 'Unknown')
     name = session.get('user_info', {}).get('name', 'Unknown')
+    health = describe_checks(CheckHistory.from_text(session.get('checks')))
     
     # Create buttons for session management
     markup = [
@@ -732,25 +1499,61 @@ async def manage_session(event):
         [Button.inline('🔙 Main Menu', b'back_to_menu')]
     ]
     
-    await event.edit(
-        f"🔐 *Session: {label}* 🔐\n\n"
-        f"📱 Phone: `{phone}`\n"
-        f"👤 User: {name}\n"
-        f"🔖 Username: {username}\n"
-        f"🕒 Created: {created}\n\n"
-        f"Select an action to perform with this session:",
-        buttons=markup,
-        parse_mode='Markdown'
+    text, entities = templates.SESSION_DETAILS.render(
+        label=label,
+        phone=phone,
+        name=name,
+        username=username,
+        created=created,
+        health=health
     )
+    await event.edit(text, formatting_entities=entities, buttons=markup)
 
-@bot.on(events.CallbackQuery(pattern=r"verify_session_(\d+)"))
-async def verify_session(event):
+async def saved_session_string(tenant, user_id, session_index, session):
+    """
+    Decrypt the string of a saved session.
+    
+    Sessions saved before the vault existed hold it in plain text; they are
+    sealed now.
+    
+    Returns:
+        The session string, or '' if it is missing or cannot be decrypted
+    """
+    if session.get('sealed'):
+        try:
+            return await vault.open_string(tenant.name, user_id, session['sealed'])
+        except (DecryptionError, ValueError) as e:
+            logger.error(f"Could not decrypt saved session of user {user_id}: {e}")
+            return ''
+    
+    session_string = session.get('string', '')
+    if session_string:
+        sealed = await vault.seal_string(tenant.name, user_id, session_string)
+        sealed_info = {name: value for name, value in session.items() if name != 'string'}
+        tenant.store.replace_session(user_id, session_index, dict(sealed_info, sealed=sealed))
+    return session_string
+
+def record_check(session, outcome, started):
+    """
+    Add a check to a saved session's history.
+    
+    Returns:
+        The updated history, encoded for the session store
+    """
+    history = CheckHistory.from_text(session.get('checks'))
+    history.record(outcome, time.perf_counter() - started)
+    return history.to_text()
+
+@on(events.CallbackQuery, pattern=r"verify_session_(\d+)")
+async def verify_session(tenant, event):
     """Verify if a saved session is still valid"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
@@ -758,8 +1561,8 @@ async def verify_session(event):
         return
     
     # Get session info
-    session = saved_sessions[user_id][session_index]
-    session_string = session.get('string', '')
+    session = sessions[session_index]
+    session_string = await saved_session_string(tenant, user_id, session_index, session)
     label = session.get('label', f"Session {session_index+1}")
     
     if not session_string:
@@ -770,87 +1573,126 @@ async def verify_session(event):
         return
     
     # Show validation message
-    msg = await event.edit(
-        f"🔄 Verifying session *{label}*...",
-        parse_mode='Markdown'
-    )
+    text, entities = templates.VERIFYING_SESSION.render(label=label)
+    msg = await event.edit(text, formatting_entities=entities)
     
+    # Wait for a validation slot
+    try:
+        await validation_admission.acquire(queue_position_notifier(msg))
+    except QueueFullError:
+        await msg.edit(
+            BUSY_TEXT,
+            buttons=[[Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())]]
+        )
+        return
+    
+    client = None
+    started = time.perf_counter()
     try:
         # Create client and check validity
-        client = TelegramClient(StringSession(session_string), API_ID, API_HASH)
-        await client.connect()
+        client = new_user_client(session_string, session.get('api_id'))
+        wait = flood_ledger.check(flood_keys(client, account=True))
+        if wait:
+            await msg.edit(
+                flood_message(wait, "verify the session"),
+                buttons=[[Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())]]
+            )
+            return
+        await connect_client(client)
         
-        if await client.is_user_authorized():
+        if await with_retries(client.is_user_authorized):
             # Get updated user info
-            me = await client.get_me()
+            me = await with_retries(client.get_me)
             user_name = f"{me.first_name} {me.last_name if me.last_name else ''}".strip()
             username_text = f"@{me.username}" if me.username else "No username"
             
             # Update session info with latest data
-            saved_sessions[user_id][session_index]['user_info'] = {
-                'name': user_name,
-                'username': me.username,
-                'id': me.id
-            }
+            tenant.store.update_session(
+                user_id, session_index,
+                user_info={
+                    'name': user_name,
+                    'username': me.username,
+                    'id': me.id
+                },
+                checks=record_check(session, VALID, started)
+            )
             
+            text, entities = templates.SAVED_SESSION_VALID.render(
+                label=label,
+                user_name=user_name,
+                username=username_text
+            )
             await msg.edit(
-                f"✅ *Session is valid!*\n\n"
-                f"*{label}* is active and can be used.\n\n"
-                f"👤 User: {user_name}\n"
-                f"🔖 Username: {username_text}",
+                text,
+                formatting_entities=entities,
                 buttons=[
                     [Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())],
                     [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-                ],
-                parse_mode='Markdown'
+                ]
             )
         else:
+            tenant.store.update_session(
+                user_id, session_index, checks=record_check(session, UNAUTHORIZED, started)
+            )
+            text, entities = templates.SAVED_SESSION_UNAUTHORIZED.render(label=label)
             await msg.edit(
-                f"❌ *Session is not valid*\n\n"
-                f"*{label}* is no longer authorized.\n"
-                f"This could happen if the session was revoked or expired.",
+                text,
+                formatting_entities=entities,
                 buttons=[
                     [Button.inline('❌ Delete Session', f"delete_session_{session_index}".encode())],
                     [Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())],
                     [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-                ],
-                parse_mode='Markdown'
+                ]
             )
         
         # Clean up
         await client.disconnect()
         
     except (AuthKeyUnregisteredError, UserDeactivatedError):
+        tenant.store.update_session(user_id, session_index, checks=record_check(session, REVOKED, started))
+        text, entities = templates.SAVED_SESSION_REVOKED.render(label=label)
         await msg.edit(
-            f"❌ *Session is invalid*\n\n"
-            f"*{label}* has been revoked or the account has been deactivated.",
+            text,
+            formatting_entities=entities,
             buttons=[
                 [Button.inline('❌ Delete Session', f"delete_session_{session_index}".encode())],
                 [Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())],
                 [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-            ],
-            parse_mode='Markdown'
+            ]
+        )
+    except FloodWaitError as e:
+        note_client_error(client, e, account=True)
+        await client.disconnect()
+        await msg.edit(
+            flood_message(e.seconds, "verify the session"),
+            buttons=[[Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())]]
         )
     except Exception as e:
         logger.error(f"Error verifying session: {e}")
+        note_client_error(client, e, account=True)
+        tenant.store.update_session(user_id, session_index, checks=record_check(session, ERROR, started))
+        text, entities = templates.SAVED_SESSION_ERROR.render(error=e)
         await msg.edit(
-            f"❌ *Error verifying session*\n\n"
-            f"An error occurred: {str(e)}",
+            text,
+            formatting_entities=entities,
             buttons=[
                 [Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())],
                 [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-            ],
-            parse_mode='Markdown'
+            ]
         )
+    finally:
+        validation_admission.release()
 
-@bot.on(events.CallbackQuery(pattern=r"show_session_(\d+)"))
-async def show_session(event):
+@on(events.CallbackQuery, pattern=r"show_session_(\d+)")
+async def show_session(tenant, event):
     """Show the session string for a saved session"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
@@ -858,8 +1700,8 @@ async def show_session(event):
         return
     
     # Get session info
-    session = saved_sessions[user_id][session_index]
-    session_string = session.get('string', '')
+    session = sessions[session_index]
+    session_string = await saved_session_string(tenant, user_id, session_index, session)
     label = session.get('label', f"Session {session_index+1}")
     
     if not session_string:
@@ -869,31 +1711,31 @@ async def show_session(event):
         )
         return
     
+    text, entities = templates.SHOW_SESSION_STRING.render(label=label, session_string=session_string)
     msg = await event.edit(
-        f"🔐 *Session String for: {label}*\n\n"
-        f"`{session_string}`\n\n"
-        f"⚠️ *IMPORTANT*: This session string gives full access to your account. "
-        f"Never share it with anyone!",
+        text,
+        formatting_entities=entities,
         buttons=[
             [Button.inline('🔙 Back to Session', f"manage_session_{session_index}".encode())],
             [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-        ],
-        parse_mode='Markdown'
+        ]
     )
     
     # Auto-delete for security if enabled
-    if user_id in auto_delete_settings and auto_delete_settings[user_id]:
+    if tenant.store.get_setting(user_id, 'auto_delete', False):
         # Schedule message deletion in 5 minutes
         asyncio.create_task(auto_delete_message(msg, 300))
 
-@bot.on(events.CallbackQuery(pattern=r"edit_label_(\d+)"))
-async def edit_label_request(event):
+@on(events.CallbackQuery, pattern=r"edit_label_(\d+)")
+async def edit_label_request(tenant, event):
     """Request a new label for a session"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
@@ -901,31 +1743,29 @@ async def edit_label_request(event):
         return
     
     # Get current label
-    session = saved_sessions[user_id][session_index]
+    session = sessions[session_index]
     label = session.get('label', f"Session {session_index+1}")
     
-    # Set state to expect new label
-    active_processes[user_id] = {
-        'expecting': 'session_label',
-        'session_index': session_index
-    }
-    
-    await event.edit(
-        f"✏️ *Edit Session Label* ✏️\n\n"
-        f"Current label: *{label}*\n\n"
-        f"Please send a new name for this session:",
-        buttons=[[Button.inline('🔙 Cancel', f"manage_session_{session_index}".encode())]],
-        parse_mode='Markdown'
+    text, entities = templates.EDIT_LABEL_PROMPT.render(label=label)
+    msg = await event.edit(
+        text,
+        formatting_entities=entities,
+        buttons=[[Button.inline('🔙 Cancel', f"manage_session_{session_index}".encode())]]
     )
+    
+    # Set state to expect new label
+    start_flow(tenant, user_id, 'session_label', session_index=session_index, status_msg=msg)
 
-@bot.on(events.CallbackQuery(pattern=r"delete_session_(\d+)"))
-async def delete_session_confirm(event):
+@on(events.CallbackQuery, pattern=r"delete_session_(\d+)")
+async def delete_session_confirm(tenant, event):
     """Confirm deletion of a session"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
@@ -933,156 +1773,310 @@ async def delete_session_confirm(event):
         return
     
     # Get label
-    session = saved_sessions[user_id][session_index]
+    session = sessions[session_index]
     label = session.get('label', f"Session {session_index+1}")
     
     # Show confirmation
+    text, entities = templates.DELETE_CONFIRM.render(label=label)
     await event.edit(
-        f"⚠️ *Delete Session* ⚠️\n\n"
-        f"Are you sure you want to delete *{label}*?\n\n"
-        f"This action cannot be undone.",
+        text,
+        formatting_entities=entities,
         buttons=[
             [Button.inline('✅ Yes, Delete Session', f"confirm_delete_{session_index}".encode())],
             [Button.inline('❌ No, Keep Session', f"manage_session_{session_index}".encode())]
-        ],
-        parse_mode='Markdown'
+        ]
     )
 
-@bot.on(events.CallbackQuery(pattern=r"confirm_delete_(\d+)"))
-async def delete_session_confirmed(event):
+@on(events.CallbackQuery, pattern=r"confirm_delete_(\d+)")
+async def delete_session_confirmed(tenant, event):
     """Delete session after confirmation"""
     user_id = event.sender_id
+    await tenant.store.preload(user_id)
     session_index = int(event.data.decode().split('_')[-1])
     
     # Validate session index
-    if user_id not in saved_sessions or session_index >= len(saved_sessions[user_id]):
+    sessions = tenant.store.sessions(user_id)
+    if session_index >= len(sessions):
         await event.edit(
             "❌ Session not found. It may have been deleted.",
             buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
         )
         return
     
-    # Get label before deletion
-    label = saved_sessions[user_id][session_index].get('label', f"Session {session_index+1}")
-    
     # Delete session
-    del saved_sessions[user_id][session_index]
-    
-    # Clean up if no sessions left
-    if not saved_sessions[user_id]:
-        del saved_sessions[user_id]
+    session = tenant.store.delete_session(user_id, session_index)
+    label = session.get('label', f"Session {session_index+1}")
     
+    text, entities = templates.SESSION_DELETED.render(label=label)
     await event.edit(
-        f"✅ *Session Deleted*\n\n"
-        f"*{label}* has been deleted successfully.",
+        text,
+        formatting_entities=entities,
         buttons=[
             [Button.inline('🔙 Back to Sessions', b'view_sessions')],
             [Button.inline('🔙 Back to Main Menu', b'back_to_menu')]
-        ],
-        parse_mode='Markdown'
+        ]
     )
 
-@bot.on(events.CallbackQuery(data=b'check_session'))
-async def check_session_request(event):
+@on(events.CallbackQuery, data=b'check_session')
+async def check_session_request(tenant, event):
     """Request a session string to check its validity"""
     user_id = event.sender_id
     
     # Edit the button message to ask for the session string and save it
+    text, entities = templates.CHECK_SESSION_PROMPT.render()
     msg = await event.edit(
-        "🔍 *Check Session Validity* 🔍\n\n"
-        "Please send the session string you want to check.\n\n"
-        "This will verify if the session is still valid and show information about it.",
-        buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]],
-        parse_mode='Markdown'
+        text,
+        formatting_entities=entities,
+        buttons=[[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
     )
     
     # Set state to expect session string and save the status message
-    active_processes[user_id] = {
-        'expecting': 'session_string_to_check',
-        'status_msg': msg  # Save the message to edit it later
-    }
+    start_flow(tenant, user_id, 'session_string_to_check', status_msg=msg)
 
-@bot.on(events.CallbackQuery(data=b'show_help'))
-async def show_help(event):
+@on(events.CallbackQuery, data=b'show_help')
+async def show_help(tenant, event):
     """Show help information"""
     markup = [[Button.inline('🔙 Back to Main Menu', b'back_to_menu')]]
     
-    await event.edit(
-        "❓ *Advanced Telethon Session Manager Help* ❓\n\n"
-        "This bot helps you generate, validate, and manage Telethon session strings with an intuitive button-based interface.\n\n"
-        "*Key Features:*\n"
-        "• Button-based interface (no command memorization needed)\n"
-        "• Generate multiple session strings for various accounts\n"
-        "• Custom labeling for easy session identification\n"
-        "• Session validation with detailed account information\n"
-        "• Enhanced security with automatic data protection\n"
-        "• Manage multiple sessions in one place\n\n"
-        "*Enhanced Security Features:*\n"
-        "• Phone numbers are automatically deleted from chat history\n"
-        "• Verification codes are immediately removed after submission\n"
-        "• 2FA passwords are deleted for maximum security\n"
-        "• Session strings can be auto-deleted after viewing (configurable)\n"
-        "• All security features designed to protect your account\n\n"
-        "*Security Recommendations:*\n"
-        "• Keep auto-deletion enabled for session strings\n"
-        "• Always validate sessions before using them\n"
-        "• Never share session strings with unauthorized parties\n"
-        "• Use descriptive labels to identify sessions\n"
-        "• Store session strings in a secure location\n\n"
-        "*Usage Tips:*\n"
-        "• Use the main menu to access all features\n"
-        "• Follow the on-screen prompts for each action\n"
-        "• Provide verification codes with or without spaces\n\n"
-        "*Need more help?*\n"
-        "If you have questions or need assistance, please contact the bot administrator.",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+    text, entities = templates.HELP.render()
+    await event.edit(text, formatting_entities=entities, buttons=markup)
 
-@bot.on(events.NewMessage(pattern='/cancel'))
-async def cancel_command(event):
-    """Cancel the ongoing process"""
+@on(events.NewMessage, pattern='/cancel')
+async def cancel_command(tenant, event):
+    """Cancel the user's flows, or one of them"""
     user_id = event.sender_id
+    flows = tenant.user_flows(user_id)
+    
+    # "/cancel 2", or /cancel sent as a reply to a flow's message, only
+    # cancels that flow; otherwise all of the user's flows are cancelled
+    args = event.text.split()
+    if len(args) > 1 and args[1].lstrip('#').isdigit():
+        flow_id = int(args[1].lstrip('#'))
+        flows = [flow for flow in flows if flow['id'] == flow_id]
+    elif event.reply_to_msg_id:
+        replied = [
+            flow for flow in flows
+            if flow.get('status_msg') and flow['status_msg'].id == event.reply_to_msg_id
+        ]
+        flows = replied or flows
     
-    if user_id in active_processes:
-        # Clean up client if exists
-        if 'client' in active_processes[user_id]:
-            client = active_processes[user_id]['client']
-            if client:
-                try:
-                    await client.disconnect()
-                except:
-                    pass
-        # Remove user data
-        del active_processes[user_id]
-    
-    # Create main menu with buttons
-    markup = [
-        [Button.inline('📱 Generate New Session', b'start_session')],
-        [Button.inline('🔍 Check Session Validity', b'check_session')],
-        [Button.inline('📋 View My Sessions', b'view_sessions')],
-        [Button.inline('🔒 Auto-Delete Messages', b'toggle_autodelete')],
-        [Button.inline('❓ Help', b'show_help')]
-    ]
+    for flow in flows:
+        await discard_flow(tenant, flow)
     
-    await event.respond(
-        "❌ Process cancelled.\n\n"
-        "What would you like to do next? Choose an option from the menu below:",
-        buttons=markup,
-        parse_mode='Markdown'
-    )
+    markup = main_menu_markup()
+    
+    text, entities = templates.PROCESS_CANCELLED.render()
+    await event.respond(text, formatting_entities=entities, buttons=markup)
+
+@on(events.NewMessage, pattern=r'/profile(\s|$)')
+async def profile_command(tenant, event):
+    """Admin command: profile the running bot, e.g. /profile 60"""
+    if event.sender_id not in ADMIN_USER_IDS:
+        return
+    
+    args = event.text.split()
+    try:
+        seconds = int(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await event.respond("Usage: /profile [seconds]")
+        return
+    
+    logger.info(f"Admin {event.sender_id} started a {seconds}s profile capture")
+    msg = await event.respond(f"⏱ Profiling all bots for {seconds} seconds...")
+    try:
+        path = await capture_profile(seconds)
+    except RuntimeError as e:
+        await msg.edit(f"❌ {e}")
+        return
+    await msg.edit(f"✅ Profile written to {path}")
+
+@on(events.NewMessage, pattern=r'/reshard(\s|$)')
+async def reshard_command(tenant, event):
+    """Admin command: change the number of session store shards, e.g. /reshard 8"""
+    if event.sender_id not in ADMIN_USER_IDS:
+        return
+    
+    args = event.text.split()
+    try:
+        count = int(args[1])
+    except (IndexError, ValueError):
+        await event.respond(f"Usage: /reshard <shards> (now {session_store.shard_count})")
+        return
+    
+    logger.info(f"Admin {event.sender_id} started resharding the session store into {count} shards")
+    msg = await event.respond(f"⏳ Moving saved sessions from {session_store.shard_count} to {count} shards...")
+    started = time.monotonic()
+    try:
+        moved = await asyncio.to_thread(session_store.reshard, count)
+    except (ValueError, RuntimeError) as e:
+        await msg.edit(f"❌ {e}")
+        return
+    await msg.edit(f"✅ {moved} users moved into {count} shards in {time.monotonic() - started:.1f}s")
+
+@on(events.NewMessage, pattern=r'/storage(\s|$)')
+async def storage_command(tenant, event):
+    """Admin command: count the users and saved sessions of every bot"""
+    if event.sender_id not in ADMIN_USER_IDS:
+        return
+    
+    msg = await event.respond(f"⏳ Scanning {session_store.shard_count} shards...")
+    # tenant -> [users, sessions]
+    counts = {}
+    scan = session_store.scan()
+    done = False
+    while not done:
+        # The scan reads from disk, so it runs in a thread a step at a time
+        step = await asyncio.to_thread(list, itertools.islice(scan, STORAGE_SCAN_STEP))
+        done = len(step) < STORAGE_SCAN_STEP
+        for name, user_id, record in step:
+            tenant_counts = counts.setdefault(name, [0, 0])
+            tenant_counts[0] += 1
+            tenant_counts[1] += len(record['sessions'])
+        lines = [f"{'✅' if done else '⏳'} Session store, {session_store.shard_count} shards:"]
+        lines += [f"{name}: {users} users, {sessions} sessions" for name, (users, sessions) in sorted(counts.items())]
+        await msg.edit("\n".join(lines))
+
+async def store_maintenance():
+    """Periodically evict idle users from memory and report cache stats"""
+    while True:
+        await asyncio.sleep(STORE_MAINTENANCE_INTERVAL)
+        session_store.evict_idle()
+        vault.expire()
+        stats = session_store.stats()
+        logger.info(
+            f"Session cache: {stats['resident_users']} users, "
+            f"{stats['resident_bytes']}/{stats['budget_bytes']} bytes, "
+            f"hit rate {stats['hit_rate']:.1%}, {stats['evictions']} evictions, "
+            f"{sum(stats['queued_writes'])} writes queued on {stats['shards']} shards"
+        )
+
+async def report_ready(tenants, started):
+    """Record the time from startup until every bot has caught up on missed updates"""
+    if CATCH_UP:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(tenant.backlog.drained.wait() for tenant in tenants)),
+                CATCH_UP_READY_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Catch-up on missed updates not finished after {CATCH_UP_READY_TIMEOUT}s")
+    elapsed = time.monotonic() - started
+    metrics.observe('time_to_ready', elapsed)
+    for tenant in tenants:
+        stats = tenant.backlog.stats()
+        logger.info(
+            f"Bot {tenant.name} caught up on {stats['missed']} missed updates: "
+            f"{stats['handled']} handled, {stats['dropped']} dropped, {stats['notices']} users told to restart"
+        )
+    logger.info(f"Ready {elapsed:.1f}s after startup")
+
+async def start_tenants(tenants, started):
+    """
+    Log every hosted bot in and restore interrupted flows.
+    
+    Args:
+        tenants: Bots to start
+        started: Monotonic time the process started, for time-to-ready
+    """
+    for tenant in tenants:
+        await tenant.bot.start(bot_token=tenant.token)
+        me = await tenant.bot.get_me()
+        logger.info(f"Bot {tenant.name} started as @{me.username}")
+    
+    proxy_pool.start()
+    transport_selector.start()
+    
+    # Pick up login flows interrupted by the last restart
+    await resume_flows(tenants)
+    
+    watchdog.start(func for func, _, _ in HANDLERS)
+    
+    asyncio.create_task(store_maintenance())
+    asyncio.create_task(metrics.export_metrics())
+    asyncio.create_task(publish_snapshots(tenants))
+    asyncio.create_task(report_ready(tenants, started))
+
+def create_tenants(configs):
+    """Create a tenant with its own bot client for every configured token"""
+    tenants = []
+    for config in configs:
+        bot = TelegramClient(
+            session_name_for(config['name']), api_pool.default.api_id, api_pool.default.api_hash,
+            catch_up=CATCH_UP
+        )
+        # Formatted messages carry precompiled entities (message_templates.py);
+        # everything else is sent as plain text without Markdown parsing
+        bot.parse_mode = None
+        tenant = Tenant(
+            config['name'],
+            config['token'],
+            bot,
+            session_store,
+            max_active_flows=config['max_active_flows'],
+            max_flows_per_user=config['max_flows_per_user']
+        )
+        if CATCH_UP:
+            tenant.backlog.attach(bot)
+        register_handlers(tenant)
+        tenants.append(tenant)
+    return tenants
 
 def main():
-    """Start the bot"""
+    """Start all configured bots on one event loop"""
+    started = time.monotonic()
+    
+    try:
+        configs = load_tenant_config()
+    except (OSError, ValueError) as e:
+        logger.error(f"Invalid bot configuration: {e}")
+        print(f"Error: Invalid bot configuration: {e}")
+        sys.exit(1)
+    
+    if not configs:
+        logger.error("No bot token configured")
+        print("Error: No Telegram bot token found! Please set the TELEGRAM_BOT_TOKEN environment variable.")
+        print("To host several bots, set TELEGRAM_BOT_TOKENS (name=token,...) or BOTS_CONFIG instead.")
+        print("You can get a token from @BotFather on Telegram.")
+        sys.exit(1)
+    
     print("Starting Advanced Telethon Session Manager...")
     
-    bot.start(bot_token=BOT_TOKEN)
-    print("Advanced Telethon Session Manager started successfully!")
+    # Pick the AES-IGE backend before any client connects. The key-exchange
+    # workers, forked at import, keep Telethon's own (they only decrypt one
+    # small answer per login)
+    try:
+        aes_backend.select()
+    except ValueError as e:
+        logger.error(f"Invalid AES backend: {e}")
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    if AUTH_OFFLOAD_ENABLED:
+        logger.info(f"Auth-key generation offloaded to {AUTH_KEY_WORKERS} worker processes")
+    
+    tenants = create_tenants(configs)
+    metrics.set_gauge('session_cache', session_store.stats)
+    metrics.set_gauge('login_admission', login_admission.stats)
+    metrics.set_gauge('validation_admission', validation_admission.stats)
+    metrics.set_gauge('event_loop', watchdog.stats)
+    metrics.set_gauge('api_credentials', api_pool.stats)
+    metrics.set_gauge('proxies', proxy_pool.stats)
+    metrics.set_gauge('flood_ledger', flood_ledger.stats)
+    metrics.set_gauge('transports', transport_selector.stats)
+    metrics.set_gauge('aes_backend', aes_backend.stats)
+    metrics.set_gauge('session_vault', vault.stats)
+    metrics.set_gauge('inbound_limiter', lambda: {tenant.name: tenant.limiter.stats() for tenant in tenants})
+    metrics.set_gauge('catch_up', lambda: {tenant.name: tenant.backlog.stats() for tenant in tenants})
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(start_tenants(tenants, started))
+    print(f"Advanced Telethon Session Manager started successfully with {len(tenants)} bot(s)!")
     print("Enhanced security features enabled.")
     print("Press Ctrl+C to stop.")
     
-    # Run the bot until disconnected
-    bot.run_until_disconnected()
+    # Run until every bot has disconnected
+    loop.run_until_complete(asyncio.gather(
+        *(tenant.bot.run_until_disconnected() for tenant in tenants)
+    ))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,146 @@
+"""
+Multi-tenant hosting: several bot tokens served from one process.
+
+Each tenant owns its bot client, its in-flight flows and its rate limits.
+Everything else (Telethon itself, the event loop, session storage and
+checkpoints) is shared, so every additional bot costs little memory.
+"""
+import os
+import re
+import json
+import logging
+from inbound_limiter import InboundLimiter
+from update_backlog import Backlog
+
+logger = logging.getLogger(__name__)
+
+# Tenant names end up in file names, so keep them simple
+TENANT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+# Name used for the single bot configured through TELEGRAM_BOT_TOKEN
+DEFAULT_TENANT = 'default'
+
+# Default per-tenant cap on concurrent login flows
+DEFAULT_MAX_ACTIVE_FLOWS = int(os.environ.get("MAX_ACTIVE_FLOWS", 100))
+
+# Default cap on concurrent login flows of a single user
+DEFAULT_MAX_FLOWS_PER_USER = int(os.environ.get("MAX_FLOWS_PER_USER", 3))
+
+
+class Tenant:
+    """A hosted bot together with its isolated state"""
+
+    def __init__(self, name, token, bot, store, max_active_flows=DEFAULT_MAX_ACTIVE_FLOWS,
+                 max_flows_per_user=DEFAULT_MAX_FLOWS_PER_USER):
+        self.name = name
+        self.token = token
+        self.bot = bot
+        # View of the shared session store restricted to this tenant
+        self.store = store.for_tenant(name)
+        # In-flight flows of this tenant's users: user id -> flow id -> flow
+        self.flows = {}
+        # Last flow id given to each user; ids are never reused, so a stale
+        # button or "#id" of a finished flow cannot reach a newer one
+        self._last_flow_id = {}
+        self.max_active_flows = max_active_flows
+        self.max_flows_per_user = max_flows_per_user
+        # Per-user rate limit on incoming updates
+        self.limiter = InboundLimiter()
+        # Updates missed while the bot was down, see update_backlog.py
+        self.backlog = Backlog()
+
+    def user_flows(self, user_id):
+        """Get a user's flows, oldest first"""
+        return sorted(self.flows.get(user_id, {}).values(), key=lambda flow: flow['id'])
+
+    def all_flows(self):
+        """Iterate over the flows of all users"""
+        for flows in list(self.flows.values()):
+            yield from list(flows.values())
+
+    def get_flow(self, user_id, flow_id):
+        """Get one of a user's flows, or None"""
+        return self.flows.get(user_id, {}).get(flow_id)
+
+    def add_flow(self, flow):
+        """Store a flow under its 'user_id' and 'id'"""
+        user_id, flow_id = flow['user_id'], flow['id']
+        self.flows.setdefault(user_id, {})[flow_id] = flow
+        self._last_flow_id[user_id] = max(self._last_flow_id.get(user_id, 0), flow_id)
+
+    def remove_flow(self, flow):
+        """Forget a flow; does nothing if it is already gone"""
+        flows = self.flows.get(flow['user_id'])
+        if flows is not None:
+            flows.pop(flow['id'], None)
+            if not flows:
+                del self.flows[flow['user_id']]
+
+    def count_flows(self):
+        """Number of flows of all users"""
+        return sum(len(flows) for flows in self.flows.values())
+
+    def next_flow_id(self, user_id):
+        """Get a new flow id for a user; ids are small numbers users can type"""
+        return self._last_flow_id.get(user_id, 0) + 1
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+
+def session_name_for(name):
+    """
+    Get the bot session file name for a tenant.
+
+    The default tenant keeps the original 'simple_bot' session so existing
+    deployments retain their update state.
+    """
+    return 'simple_bot' if name == DEFAULT_TENANT else f'simple_bot_{name}'
+
+
+def load_tenant_config():
+    """
+    Load the list of bots to host.
+
+    Sources, in order of precedence:
+    - BOTS_CONFIG: path to a JSON list of
+      {"name", "token", "max_active_flows", "max_flows_per_user"}
+    - TELEGRAM_BOT_TOKENS: comma-separated "name=token" pairs
+    - TELEGRAM_BOT_TOKEN: a single bot named 'default'
+
+    Returns:
+        List of tenant config dictionaries (empty if nothing is configured)
+
+    Raises:
+        ValueError: If the configuration is malformed
+    """
+    config_path = os.environ.get("BOTS_CONFIG")
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            configs = json.load(f)
+    elif os.environ.get("TELEGRAM_BOT_TOKENS"):
+        configs = []
+        for pair in os.environ["TELEGRAM_BOT_TOKENS"].split(','):
+            name, sep, token = pair.strip().partition('=')
+            if not sep:
+                raise ValueError(f"Expected name=token in TELEGRAM_BOT_TOKENS, got {name!r}")
+            configs.append({'name': name, 'token': token})
+    elif os.environ.get("TELEGRAM_BOT_TOKEN"):
+        configs = [{'name': DEFAULT_TENANT, 'token': os.environ["TELEGRAM_BOT_TOKEN"]}]
+    else:
+        configs = []
+
+    seen = set()
+    for config in configs:
+        name = config.get('name')
+        if not name or not TENANT_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid bot name {name!r}: use letters, digits, '_' or '-'")
+        if name in seen:
+            raise ValueError(f"Duplicate bot name {name!r}")
+        if not config.get('token'):
+            raise ValueError(f"No token configured for bot {name!r}")
+        seen.add(name)
+        config.setdefault('max_active_flows', DEFAULT_MAX_ACTIVE_FLOWS)
+        config.setdefault('max_flows_per_user', DEFAULT_MAX_FLOWS_PER_USER)
+
+    return configs
@@ -0,0 +1,53 @@
+"""
+Redaction of log messages, including the summaries of rate-limited ones.
+
+Run with: python -m pytest tests
+"""
+import os
+import sys
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_pipeline import redact, RateLimiter, RedactingFormatter
+
+# Telethon layout: version byte, then URL-safe base64 (not all hex digits)
+SESSION_STRING = "1" + "BQxZ9_vtRHR-FSkW" * 20
+
+# (message, secret that must not survive redaction)
+REDACTION_SAMPLES = [
+    ("Sending code to +44 7700 900123", "7700 900123"),
+    ("Sending code to 447700900123", "447700900123"),
+    ("Login for phone 555-123-4567 started", "555-123-4567"),
+    ("User sent code: 12345", "12345"),
+    ("password: hunter2 rejected", "hunter2"),
+    ("2fa=s3cret! accepted", "s3cret!"),
+    ('Password = "correct horse" set', "correct horse"),
+    ("phone_code_hash 0123456789abcdef0123", "0123456789abcdef0123"),
+    (f"Session {SESSION_STRING} saved", SESSION_STRING[1:]),
+]
+
+
+@pytest.mark.parametrize("text, secret", REDACTION_SAMPLES)
+def test_redact_removes_secret(text, secret):
+    assert secret not in redact(text)
+
+
+@pytest.mark.parametrize("text", ["User 123456789 pressed a button", "Took 0.25s", "Chat -1001234567890"])
+def test_redact_keeps_ids_and_numbers(text):
+    assert redact(text) == text
+
+
+def test_suppressed_summary_is_redacted():
+    limiter = RateLimiter(window=60, burst=1)
+    record = logging.LogRecord('bot', logging.INFO, __file__, 0, "Saved %s", (SESSION_STRING,), None)
+    for _ in range(8):
+        limiter.allow(record)
+
+    summaries = limiter._flush_window()
+    assert len(summaries) == 1
+    text = RedactingFormatter("%(message)s").format(summaries[0])
+    assert "Suppressed 7 similar messages" in text
+    assert "_vtRHR-FSkW" not in text
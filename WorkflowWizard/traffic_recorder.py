@@ -0,0 +1,275 @@
+"""
+Opt-in recorder of the bot's traffic for later replay.
+
+When TRAFFIC_RECORDING names a file, every incoming message and button press
+of every hosted bot is appended to it as a JSON line, together with the
+timing and outcome of each RPC made by user clients (connect, send code,
+sign in, ...). benchmarks/replay_traffic.py feeds such a recording back
+through the handlers against a fake client.
+
+Nothing sensitive is written: phone numbers, codes and passwords are masked
+in a way that keeps their shape (so replayed input takes the same branches),
+pasted session strings keep their layout but get a dummy auth key, and
+account names are reduced to placeholders of the same length.
+"""
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from telethon import events
+import session_codec
+from log_pipeline import redact
+from utils import lookup_country_code
+
+logger = logging.getLogger(__name__)
+
+# Path of the recording; recording is disabled when empty
+TRAFFIC_RECORDING = os.environ.get("TRAFFIC_RECORDING", "")
+
+# Format of the recording, bumped on incompatible changes
+RECORDING_VERSION = 1
+
+# (tenant name, user id) of the update being handled in the current task.
+# User clients created while handling an update are attributed to its user.
+current_update = contextvars.ContextVar('current_update', default=None)
+
+# A lone command such as /start or /cancel, kept verbatim in every stage
+_COMMAND = re.compile(r'^/\w+$')
+
+# A leading flow selector such as "#2 ", kept so replies reach the same flow
+_FLOW_SELECTOR = re.compile(r'^\s*#\d+\s+')
+_NON_DIGITS = re.compile(r'\D')
+
+
+def _mask_phone(text):
+    """Zero the subscriber digits of a phone number, keeping its country code"""
+    digits = _NON_DIGITS.sub('', text)
+    keep = 0
+    if not text.strip().startswith('+') and digits.startswith('00'):
+        # Typed with the 00 international prefix
+        digits = digits[2:]
+        keep = 2
+    plan = lookup_country_code(digits)
+    if plan is not None:
+        keep += len(plan[0])
+
+    masked = []
+    seen = 0
+    for char in text:
+        if char.isdigit():
+            masked.append(char if seen < keep else '0')
+            seen += 1
+        else:
+            masked.append(char)
+    return ''.join(masked)
+
+
+def redact_input(text, stage):
+    """
+    Mask a user's message according to what the bot was waiting for.
+
+    Args:
+        text: The message text
+        stage: The flow stage ('expecting' value) when it arrived, or None
+
+    Returns:
+        Text of the same shape with sensitive values masked
+    """
+    if _COMMAND.match(text.strip()):
+        return text
+    selector = _FLOW_SELECTOR.match(text)
+    if selector:
+        return selector.group(0) + redact_input(text[selector.end():], stage)
+    if stage == 'phone':
+        return _mask_phone(text)
+    if stage == 'code':
+        return re.sub(r'\d', '0', text)
+    if stage == 'password':
+        return '*' * len(text)
+    if stage == 'session_string_to_check':
+        # Keep the layout, so replays take the same path through the decoder
+        return session_codec.mask(text)
+    return redact(text)
+
+
+def _placeholder(value):
+    """Replace personal text by a placeholder of the same length"""
+    return 'x' * len(value) if value else value
+
+
+def summarize_result(method, result):
+    """
+    Reduce an RPC result to what the handlers use, without personal data.
+
+    Returns:
+        A JSON-serializable summary, or None if handlers ignore the result
+    """
+    if method == 'is_user_authorized':
+        return bool(result)
+    if method == 'get_me' and result is not None:
+        return {
+            'id': result.id,
+            'first_name': _placeholder(result.first_name),
+            'last_name': _placeholder(result.last_name),
+            'username': _placeholder(result.username)
+        }
+    return None
+
+
+class RecordingClient:
+    """Wrapper around a user client that records its RPCs"""
+
+    # Awaitable client methods used by the handlers
+    RECORDED_METHODS = ('connect', 'disconnect', 'is_user_authorized', 'send_code_request', 'sign_in', 'get_me')
+
+    def __init__(self, client, recorder, context):
+        self._client = client
+        self._recorder = recorder
+        self._context = context
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self.RECORDED_METHODS:
+            return attribute
+
+        async def recorded(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await attribute(*args, **kwargs)
+            except Exception as e:
+                self._recorder.record_rpc(self._context, name, time.perf_counter() - start, error=e)
+                raise
+            self._recorder.record_rpc(
+                self._context, name, time.perf_counter() - start,
+                result=summarize_result(name, result)
+            )
+            return result
+        return recorded
+
+
+class TrafficRecorder:
+    """Appends updates and user-client RPCs to a JSON lines file"""
+
+    def __init__(self, path, describe=None):
+        """
+        Args:
+            path: File the recording is appended to
+            describe: Function (tenant, event) -> (flow id, stage) telling
+                which flow a message goes to and what it is treated as
+        """
+        self.path = path
+        self.describe = describe
+        self.started = time.monotonic()
+        # One worker keeps the records in order and file I/O off the event loop
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recorder')
+        self._file = None
+        self._write({
+            'type': 'start',
+            'version': RECORDING_VERSION,
+            'started_at': time.time()
+        })
+
+    def _write(self, record):
+        self._writer.submit(self._append, record)
+
+    def _append(self, record):
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.error(f"Could not write traffic recording: {e}")
+
+    def _offset(self):
+        return round(time.monotonic() - self.started, 6)
+
+    async def record_update(self, tenant, event):
+        """Event handler that records an update before the other handlers run"""
+        user_id = event.sender_id
+        current_update.set((tenant.name, user_id))
+
+        record = {
+            'type': 'update',
+            't': self._offset(),
+            'tenant': tenant.name,
+            'user_id': user_id,
+            'chat_id': event.chat_id
+        }
+        if isinstance(event, events.CallbackQuery.Event):
+            record['event'] = 'callback'
+            record['msg_id'] = event.message_id
+            # Callback data is arbitrary bytes; latin-1 maps them 1:1 to text
+            record['data'] = event.data.decode('latin-1')
+        else:
+            flow_id, stage = self.describe(tenant, event) if self.describe else (None, None)
+            record['event'] = 'message'
+            record['msg_id'] = event.id
+            record['stage'] = stage
+            record['flow'] = flow_id
+            # Message ids differ on replay, so a reply is replayed as a reply
+            # to the current message of the same flow
+            record['reply'] = bool(event.reply_to_msg_id)
+            record['text'] = redact_input(event.raw_text, stage)
+        self._write(record)
+
+    def wrap_client(self, client):
+        """Record the RPCs of a user client created for the current update"""
+        return RecordingClient(client, self, current_update.get())
+
+    def record_rpc(self, context, method, duration, result=None, error=None):
+        """
+        Record one user-client RPC.
+
+        Args:
+            context: (tenant name, user id) the client belongs to, or None
+            method: Client method name
+            duration: Seconds the call took
+            result: Summary of the result (see summarize_result)
+            error: The exception raised, if any
+        """
+        tenant, user_id = context or (None, None)
+        record = {
+            'type': 'rpc',
+            't': self._offset(),
+            'tenant': tenant,
+            'user_id': user_id,
+            'method': method,
+            'duration': round(duration, 6)
+        }
+        if error is not None:
+            record['error'] = type(error).__name__
+            # Errors such as FloodWaitError carry a number (e.g. seconds)
+            if isinstance(getattr(error, 'seconds', None), int):
+                record['capture'] = error.seconds
+        else:
+            record['result'] = result
+        self._write(record)
+
+    def close(self):
+        """Write out pending records and close the file"""
+        self._writer.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def recorder_from_env(describe=None):
+    """
+    Create the recorder if TRAFFIC_RECORDING is set.
+
+    Args:
+        describe: See TrafficRecorder
+
+    Returns:
+        A TrafficRecorder, or None when recording is disabled
+    """
+    if not TRAFFIC_RECORDING:
+        return None
+    recorder = TrafficRecorder(TRAFFIC_RECORDING, describe)
+    atexit.register(recorder.close)
+    logger.warning(f"Recording traffic to {TRAFFIC_RECORDING}")
+    return recorder
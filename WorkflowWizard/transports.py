@@ -0,0 +1,199 @@
+"""
+MTProto transport selection and per-DC round-trip probing for user clients.
+
+Telethon defaults to TcpFull, which adds 12 bytes and a CRC32 to every
+packet. Intermediate adds 4 bytes, Abridged 1 (4 for large packets), and the
+obfuscated variants wrap them in AES-CTR after a 64-byte header so the
+traffic is harder to recognize and block.
+
+USER_TRANSPORT fixes the transport, or with 'auto' a background prober
+measures each (data center, transport) pair from this host: it connects,
+sends an unencrypted req_pq_multi and times the answer. New clients then
+use the transport with the lowest smoothed RTT for the DC their session
+lives on. The DC itself is set by the account (Telegram migrates a login to
+the phone number's home DC), so only the transport is chosen.
+
+Telethon encrypts obfuscated traffic with pure-Python AES-CTR, which costs
+milliseconds of event loop time per packet (benchmarks/bench_transports.py),
+so 'auto' only chooses among the plain transports. The obfuscated ones are
+for networks that block MTProto and must be set explicitly.
+
+The prober measures direct connections; clients that go through an MTProxy
+use the proxy's own transport.
+"""
+import os
+import time
+import asyncio
+import logging
+from telethon import connection
+from telethon.network import MTProtoPlainSender
+from telethon.network.connection.connection import ObfuscatedConnection
+from telethon.network.connection.tcpobfuscated import ObfuscatedIO
+from telethon.network.connection.tcpintermediate import IntermediatePacketCodec
+from telethon.tl.functions import ReqPqMultiRequest
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Transport of user clients: one of TRANSPORTS, or 'auto' to use the fastest
+USER_TRANSPORT = os.environ.get("USER_TRANSPORT", "auto")
+
+# Seconds between probe rounds, and the timeout of one probe
+TRANSPORT_PROBE_INTERVAL = int(os.environ.get("TRANSPORT_PROBE_INTERVAL", 600))
+TRANSPORT_PROBE_TIMEOUT = float(os.environ.get("TRANSPORT_PROBE_TIMEOUT", 5))
+
+# Used until probes have finished, and when every probe of a DC failed
+FALLBACK_TRANSPORT = 'full'
+
+# Production data centers (https://core.telegram.org/api/datacenter)
+DC_ADDRESSES = {
+    1: ('149.154.175.53', 443),
+    2: ('149.154.167.51', 443),
+    3: ('149.154.175.100', 443),
+    4: ('149.154.167.91', 443),
+    5: ('91.108.56.130', 443),
+}
+
+# DC a new session starts on (Telethon's default)
+DEFAULT_DC = 2
+
+# Weight of the newest sample in the smoothed RTT
+_SMOOTHING = 0.3
+
+
+class ConnectionTcpObfuscatedIntermediate(ObfuscatedConnection):
+    """
+    Intermediate framing inside obfuscated2 encryption. Telethon only ships
+    the Abridged variant (ConnectionTcpObfuscated).
+    """
+    packet_codec = IntermediatePacketCodec
+    obfuscated_io = ObfuscatedIO
+
+
+TRANSPORTS = {
+    'full': connection.ConnectionTcpFull,
+    'intermediate': connection.ConnectionTcpIntermediate,
+    'abridged': connection.ConnectionTcpAbridged,
+    'obfuscated': connection.ConnectionTcpObfuscated,
+    'obfuscated_intermediate': ConnectionTcpObfuscatedIntermediate,
+}
+
+# Transports 'auto' probes and chooses from
+AUTO_TRANSPORTS = ('full', 'intermediate', 'abridged')
+
+
+class _Loggers(dict):
+    """Logger lookup Telethon's connection classes expect"""
+
+    def __missing__(self, key):
+        return logging.getLogger(key)
+
+
+async def measure_rtt(dc_id, transport, timeout=TRANSPORT_PROBE_TIMEOUT):
+    """
+    Time one handshake with a data center over a transport.
+
+    Covers the TCP connect and one unencrypted req_pq_multi round trip, the
+    first exchange of every new authorization.
+
+    Returns:
+        Seconds taken
+
+    Raises:
+        ConnectionError, OSError or asyncio.TimeoutError: If it failed
+    """
+    ip, port = DC_ADDRESSES[dc_id]
+    conn = TRANSPORTS[transport](ip, port, dc_id, loggers=_Loggers())
+    start = time.perf_counter()
+    await conn.connect(timeout=timeout)
+    try:
+        sender = MTProtoPlainSender(conn, loggers=_Loggers())
+        nonce = int.from_bytes(os.urandom(16), 'big', signed=True)
+        await asyncio.wait_for(sender.send(ReqPqMultiRequest(nonce)), timeout)
+        return time.perf_counter() - start
+    finally:
+        await conn.disconnect()
+
+
+class TransportSelector:
+    """Keeps RTTs per (DC, transport) fresh and picks the fastest transport"""
+
+    def __init__(self, mode=USER_TRANSPORT):
+        if mode != 'auto' and mode not in TRANSPORTS:
+            raise ValueError(f"Unknown transport {mode!r}; use 'auto' or one of {', '.join(TRANSPORTS)}")
+        self.mode = mode
+        # (dc_id, transport) -> smoothed RTT in seconds
+        self.rtt = {}
+        # (dc_id, transport) -> consecutive failed probes
+        self.failures = {}
+        self._prober = None
+
+    def choose(self, dc_id=None):
+        """
+        Get the connection class for a client of a DC.
+
+        Args:
+            dc_id: DC of the client's session, or None/0 for a new session
+
+        Returns:
+            A Telethon connection class
+        """
+        if self.mode != 'auto':
+            return TRANSPORTS[self.mode]
+        dc_id = dc_id or DEFAULT_DC
+        measured = [
+            (rtt, transport) for (dc, transport), rtt in self.rtt.items()
+            if dc == dc_id and not self.failures.get((dc, transport))
+        ]
+        if not measured:
+            return TRANSPORTS[FALLBACK_TRANSPORT]
+        return TRANSPORTS[min(measured)[1]]
+
+    async def probe(self, dc_id, transport):
+        """Measure one pair and fold the result into its smoothed RTT"""
+        key = (dc_id, transport)
+        try:
+            rtt = await measure_rtt(dc_id, transport)
+        except Exception as e:
+            self.failures[key] = self.failures.get(key, 0) + 1
+            metrics.incr('transport_probe_failures')
+            logger.debug(f"Probe of DC {dc_id} over {transport} failed: {e!r}")
+            return
+        self.failures[key] = 0
+        previous = self.rtt.get(key)
+        self.rtt[key] = rtt if previous is None else previous + _SMOOTHING * (rtt - previous)
+
+    async def probe_all(self):
+        """Probe every DC over every candidate transport, one DC at a time"""
+        for dc_id in DC_ADDRESSES:
+            await asyncio.gather(*(self.probe(dc_id, transport) for transport in AUTO_TRANSPORTS))
+
+    async def _probe_forever(self):
+        while True:
+            await self.probe_all()
+            best = {dc_id: self.choose(dc_id).__name__ for dc_id in DC_ADDRESSES}
+            logger.info(f"Fastest transports per DC: {best}")
+            await asyncio.sleep(TRANSPORT_PROBE_INTERVAL)
+
+    def start(self):
+        """Start probing in the background (only in 'auto' mode)"""
+        if self.mode == 'auto' and self._prober is None:
+            self._prober = asyncio.create_task(self._probe_forever())
+
+    def stats(self):
+        """
+        Smoothed RTTs and the chosen transport per DC.
+
+        Returns:
+            Dictionary keyed by DC id
+        """
+        result = {}
+        for dc_id in DC_ADDRESSES:
+            result[str(dc_id)] = {
+                'chosen': next(name for name, cls in TRANSPORTS.items() if cls is self.choose(dc_id)),
+                'rtt_ms': {
+                    transport: round(self.rtt[(dc_id, transport)] * 1000, 1)
+                    for transport in AUTO_TRANSPORTS if (dc_id, transport) in self.rtt
+                }
+            }
+        return result
@@ -0,0 +1,249 @@
+"""
+Catch-up policy for updates a bot missed while it was down.
+
+With BOT_CATCH_UP on (the default), each bot loads its saved update state
+when it connects and Telethon fetches what it missed with getDifference.
+Those updates are tagged as backlog as the difference is applied, and a
+guard registered ahead of every handler sorts them before they are routed:
+
+- An update older than CATCH_UP_MAX_AGE is stale: the flow it answered or
+  the menu it pressed belonged to the process that died. It is dropped and
+  its sender is told once to start again, however many stale updates they
+  sent.
+- A recent update is handled normally, but the backlog is let through in
+  batches of CATCH_UP_BATCH every CATCH_UP_BATCH_INTERVAL seconds, so a long
+  backlog does not start hundreds of handlers at once next to live traffic.
+
+Button presses carry no date. One in the backlog was made after the saved
+update state was written, so it counts as recent only while that state is
+younger than CATCH_UP_MAX_AGE.
+
+With BOT_CATCH_UP=0 bots do not load their update state, and Telethon skips
+whatever they missed.
+
+Tagging relies on Telethon internals (the client's MessageBox and its
+apply_difference), checked to match in the Telethon versions pinned in
+pyproject.toml. If they are missing, attach() logs a warning and the bot
+catches up on every missed update, without the policy.
+"""
+import os
+import time
+import asyncio
+import inspect
+import logging
+from telethon import types, utils
+import metrics
+
+try:
+    from telethon._updates import MessageBox
+except ImportError:  # Moved or removed in another Telethon version
+    MessageBox = None
+
+logger = logging.getLogger(__name__)
+
+# Fetch updates missed while the bot was down
+CATCH_UP = os.environ.get("BOT_CATCH_UP", "1") != "0"
+
+# Seconds after which a missed update is dropped rather than handled
+CATCH_UP_MAX_AGE = float(os.environ.get("CATCH_UP_MAX_AGE", 120))
+
+# Recent missed updates handled per batch, and seconds between batches
+CATCH_UP_BATCH = int(os.environ.get("CATCH_UP_BATCH", 20))
+CATCH_UP_BATCH_INTERVAL = float(os.environ.get("CATCH_UP_BATCH_INTERVAL", 0.5))
+
+# Seconds to wait for the first catch-up before reporting the bot ready anyway
+CATCH_UP_READY_TIMEOUT = 60
+
+# Verdicts of Backlog.sort()
+LIVE = 0
+RECENT = 1
+STALE = 2
+
+
+def update_key(update):
+    """
+    Key of a raw update as the guard sees its event, or None for updates the
+    bot has no handlers for.
+    """
+    if isinstance(update, types.UpdateNewMessage) and not update.message.out:
+        return ('message', utils.get_peer_id(update.message.peer_id), update.message.id)
+    if isinstance(update, types.UpdateBotCallbackQuery):
+        return ('callback', update.query_id)
+    return None
+
+
+def can_tag(bot):
+    """Whether a bot's Telethon has the internals Backlog.attach() replaces"""
+    if MessageBox is None or not isinstance(getattr(bot, '_message_box', None), MessageBox):
+        return False
+    if not isinstance(getattr(bot, '_log', None), dict):
+        return False
+    apply_difference = getattr(MessageBox, 'apply_difference', None)
+    if apply_difference is None:
+        return False
+    return list(inspect.signature(apply_difference).parameters) == ['self', 'diff', 'chat_hashes']
+
+
+if MessageBox is not None:
+    class _TaggingMessageBox(MessageBox):
+        """Telethon's update state machine, passing each difference to a Backlog"""
+
+        def __init__(self, log, backlog):
+            super().__init__(log)
+            self.backlog = backlog
+
+        def apply_difference(self, diff, chat_hashes):
+            result = super().apply_difference(diff, chat_hashes)
+            self.backlog.add(result[0], final=not isinstance(diff, types.updates.DifferenceSlice))
+            return result
+
+
+class Backlog:
+    """Missed updates of one bot that its handlers have not seen yet"""
+
+    def __init__(self, max_age=CATCH_UP_MAX_AGE, batch_size=CATCH_UP_BATCH,
+                 batch_interval=CATCH_UP_BATCH_INTERVAL):
+        self.max_age = max_age
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+        # Keys of tagged updates the guard has not seen yet
+        self.waiting = set()
+        # Set once the first catch-up is complete and every update of it
+        # went past the guard
+        self.drained = asyncio.Event()
+        # Whether the last difference applied was the final one
+        self._difference_done = False
+        # Unix time of the update state saved before the restart
+        self._state_date = None
+        # Users told to start again during this catch-up
+        self._notified = set()
+        # Recent updates admitted during this catch-up, and when the first was
+        self._admitted = 0
+        self._batch_start = None
+        self.missed = 0
+        self.handled = 0
+        self.dropped = 0
+        self.notices = 0
+
+    def attach(self, bot):
+        """
+        Tag the missed updates a bot fetches from now on.
+
+        Telethon has no hook for this, so the bot's update state machine is
+        replaced, before it connects, by one that reports each difference it
+        applies.
+
+        Returns:
+            False if this Telethon lacks the internals replaced; the bot then
+            catches up on everything it missed, without the policy
+        """
+        if not can_tag(bot):
+            logger.warning(
+                "Catch-up policy unavailable with this Telethon version; "
+                "missed updates will all be handled"
+            )
+            # Nothing will be tagged, so there is nothing to wait for
+            self._difference_done = True
+            self._check_drained()
+            return False
+        for entity_id, state in bot.session.get_update_states():
+            if entity_id == 0:
+                self._state_date = state.date.timestamp()
+        if self._state_date is None:
+            # No saved update state (first run, or a lost session): Telethon
+            # starts from the current state and fetches no difference
+            self._difference_done = True
+            self._check_drained()
+        bot._message_box = _TaggingMessageBox(bot._log['messagebox'], self)
+        return True
+
+    def add(self, updates, final=True):
+        """
+        Tag updates from a difference.
+
+        Args:
+            updates: Raw updates of the difference
+            final: Whether this is the last slice of the difference
+        """
+        if self._difference_done:
+            # A new gap after the last catch-up: start a new one
+            self._notified.clear()
+            self._admitted = 0
+            self._batch_start = None
+        for update in updates:
+            key = update_key(update)
+            if key is not None:
+                self.waiting.add(key)
+                self.missed += 1
+        self._difference_done = final
+        self._check_drained()
+
+    def sort(self, key, sent_at=None, now=None):
+        """
+        Tell a missed update from a live one, and a stale one from a recent one.
+
+        Args:
+            key: ('message', chat id, message id) or ('callback', query id)
+            sent_at: Unix time the update was sent, if it carries one
+            now: Unix time, now by default
+
+        Returns:
+            LIVE, RECENT or STALE
+        """
+        if key not in self.waiting:
+            return LIVE
+        self.waiting.discard(key)
+        if now is None:
+            now = time.time()
+        # Button presses carry no date, but were made after the saved state
+        if sent_at is None:
+            sent_at = self._state_date if self._state_date is not None else 0.0
+        if now - sent_at > self.max_age:
+            verdict = STALE
+            self.dropped += 1
+            metrics.incr('catch_up_dropped')
+        else:
+            verdict = RECENT
+            self.handled += 1
+            metrics.incr('catch_up_handled')
+        self._check_drained()
+        return verdict
+
+    async def admit(self):
+        """Wait for the batch a recent missed update falls in"""
+        now = time.monotonic()
+        if self._batch_start is None:
+            self._batch_start = now
+        batch = self._admitted // self.batch_size
+        self._admitted += 1
+        delay = self._batch_start + batch * self.batch_interval - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def first_notice(self, user_id):
+        """Whether a user with stale updates has not been told yet"""
+        if user_id in self._notified:
+            return False
+        self._notified.add(user_id)
+        self.notices += 1
+        return True
+
+    def _check_drained(self):
+        if self._difference_done and not self.waiting:
+            self.drained.set()
+
+    def stats(self):
+        """
+        Get catch-up statistics.
+
+        Returns:
+            Dictionary with missed updates, those handled and dropped, the
+            notices sent and the updates still waiting
+        """
+        return {
+            'missed': self.missed,
+            'handled': self.handled,
+            'dropped': self.dropped,
+            'notices': self.notices,
+            'waiting': len(self.waiting)
+        }
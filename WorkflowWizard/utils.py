@@ -1,9 +1,109 @@
+import io
 import re
-from typing import Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import qrcode
+except ImportError:  # Optional: without it, QR logins show the link only
+    qrcode = None
+
+# Numbering plan: country calling code -> (min, max) length of the national
+# significant number, following the ITU E.164 assignments
+NUMBERING_PLAN = {
+    '1': (10, 10), '7': (10, 10),
+    '20': (8, 10), '27': (9, 9), '30': (10, 10), '31': (9, 10), '32': (8, 9),
+    '33': (9, 9), '34': (9, 9), '36': (8, 9), '39': (6, 11), '40': (9, 9),
+    '41': (9, 9), '43': (4, 13), '44': (9, 10), '45': (8, 8), '46': (7, 10),
+    '47': (5, 8), '48': (9, 9), '49': (6, 13), '51': (8, 9), '52': (10, 10),
+    '53': (6, 8), '54': (10, 11), '55': (10, 11), '56': (9, 9), '57': (8, 10),
+    '58': (10, 10), '60': (8, 10), '61': (9, 9), '62': (7, 12), '63': (8, 10),
+    '64': (8, 10), '65': (8, 8), '66': (8, 9), '81': (9, 10), '82': (7, 10),
+    '84': (9, 10), '86': (7, 12), '90': (10, 10), '91': (10, 10), '92': (8, 11),
+    '93': (9, 9), '94': (9, 9), '95': (7, 10), '98': (10, 10),
+    '211': (9, 9), '212': (9, 9), '213': (8, 9), '216': (8, 8), '218': (9, 9),
+    '220': (7, 7), '221': (9, 9), '222': (8, 8), '223': (8, 8), '224': (8, 9),
+    '225': (8, 10), '226': (8, 8), '227': (8, 8), '228': (8, 8), '229': (8, 10),
+    '230': (7, 8), '231': (7, 9), '232': (8, 8), '233': (9, 9), '234': (7, 10),
+    '235': (8, 8), '236': (8, 8), '237': (8, 9), '238': (7, 7), '239': (7, 7),
+    '240': (9, 9), '241': (7, 8), '242': (9, 9), '243': (7, 9), '244': (9, 9),
+    '245': (7, 9), '246': (7, 7), '247': (5, 5), '248': (7, 7), '249': (9, 9),
+    '250': (9, 9), '251': (9, 9), '252': (7, 9), '253': (8, 8), '254': (9, 10),
+    '255': (9, 9), '256': (9, 9), '257': (8, 8), '258': (8, 9), '260': (9, 9),
+    '261': (9, 9), '262': (9, 9), '263': (5, 10), '264': (8, 9), '265': (7, 9),
+    '266': (8, 8), '267': (7, 8), '268': (8, 8), '269': (7, 7), '290': (4, 5),
+    '291': (7, 7), '297': (7, 7), '298': (6, 6), '299': (6, 6),
+    '350': (8, 8), '351': (9, 9), '352': (4, 11), '353': (7, 9), '354': (7, 9),
+    '355': (8, 9), '356': (8, 8), '357': (8, 8), '358': (5, 12), '359': (7, 9),
+    '370': (8, 8), '371': (8, 8), '372': (7, 8), '373': (8, 8), '374': (8, 8),
+    '375': (9, 10), '376': (6, 9), '377': (8, 9), '378': (6, 10), '379': (10, 10),
+    '380': (9, 9), '381': (7, 12), '382': (8, 8), '383': (8, 9), '385': (8, 9),
+    '386': (8, 8), '387': (8, 9), '389': (8, 8), '420': (9, 9), '421': (9, 9),
+    '423': (7, 9),
+    '500': (5, 5), '501': (7, 7), '502': (8, 8), '503': (7, 8), '504': (8, 8),
+    '505': (8, 8), '506': (8, 8), '507': (7, 8), '508': (6, 6), '509': (8, 8),
+    '590': (9, 9), '591': (8, 8), '592': (7, 7), '593': (8, 9), '594': (9, 9),
+    '595': (9, 9), '596': (9, 9), '597': (6, 7), '598': (8, 8), '599': (7, 8),
+    '670': (7, 8), '672': (6, 6), '673': (7, 7), '674': (7, 7), '675': (7, 8),
+    '676': (5, 7), '677': (5, 7), '678': (5, 7), '679': (7, 7), '680': (7, 7),
+    '681': (6, 6), '682': (5, 5), '683': (4, 7), '685': (5, 7), '686': (5, 8),
+    '687': (6, 6), '688': (5, 7), '689': (8, 8), '690': (4, 7), '691': (7, 7),
+    '692': (7, 7),
+    '850': (8, 10), '852': (8, 8), '853': (8, 8), '855': (8, 9), '856': (8, 10),
+    '880': (8, 10), '886': (8, 9),
+    # Anonymous Telegram numbers sold on Fragment
+    '888': (8, 8),
+    '960': (7, 7), '961': (7, 8), '962': (8, 9), '963': (8, 9), '964': (8, 10),
+    '965': (7, 8), '966': (9, 9), '967': (7, 9), '968': (8, 8), '970': (8, 9),
+    '971': (8, 9), '972': (8, 9), '973': (8, 8), '974': (7, 8), '975': (7, 8),
+    '976': (8, 8), '977': (8, 10), '992': (9, 9), '993': (8, 8), '994': (9, 9),
+    '995': (9, 9), '996': (9, 9), '998': (9, 9),
+}
+
+def _compile_numbering_plan(plan: Dict[str, Tuple[int, int]]) -> dict:
+    """
+    Compile the numbering plan into a digit trie.
+    
+    Each node maps a digit to its child node. A node that terminates a
+    country calling code stores (code, min_length, max_length) under None.
+    Country codes are prefix-free, so a lookup never has to backtrack.
+    """
+    root = {}
+    for code, (min_length, max_length) in plan.items():
+        node = root
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node[None] = (code, min_length, max_length)
+    return root
+
+PHONE_TRIE = _compile_numbering_plan(NUMBERING_PLAN)
+
+# Everything that is not a digit or '+' is formatting
+_PHONE_FORMATTING = re.compile(r'[^\d+]')
+
+def lookup_country_code(digits: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Find the country calling code a number starts with.
+    
+    Args:
+        digits: The number's digits, without '+'
+        
+    Returns:
+        Tuple of (country code, min national length, max national length),
+        or None if no country code matches
+    """
+    node = PHONE_TRIE
+    for digit in digits[:3]:
+        node = node.get(digit)
+        if node is None:
+            return None
+        plan = node.get(None)
+        if plan is not None:
+            return plan
+    return None
 
 def validate_phone_number(phone_number: str) -> Tuple[bool, str]:
     """
-    Validate and format a phone number.
+    Validate and format a phone number against the numbering plan.
     
     Args:
         phone_number: The phone number to validate
@@ -11,12 +111,15 @@ def validate_phone_number(phone_number: str) -> Tuple[bool, str]:
     Returns:
         Tuple containing:
         - Boolean indicating if the number is valid
-        - The formatted number or error message
+        - The formatted number (+ and digits only) or error message
     """
     # Remove any non-digit characters except the + at the beginning
-    cleaned_number = re.sub(r'[^\d+]', '', phone_number)
+    cleaned_number = _PHONE_FORMATTING.sub('', phone_number)
+    
+    # Accept the 00 international prefix as an alternative to +
+    if cleaned_number.startswith('00'):
+        cleaned_number = '+' + cleaned_number[2:]
     
-    # Check if the number starts with + and has at least 7 digits after
     if not cleaned_number.startswith('+'):
         return False, "Phone number must start with a '+' sign"
         
@@ -24,13 +127,40 @@ def validate_phone_number(phone_number: str) -> Tuple[bool, str]:
     number_without_plus = cleaned_number[1:]
     if not number_without_plus.isdigit():
         return False, "Phone number must contain only digits after the '+' sign"
-        
-    # Check if it has a reasonable length (at least 7 digits, not more than 15)
-    if len(number_without_plus) < 7 or len(number_without_plus) > 15:
-        return False, "Phone number must be between 7 and 15 digits long"
+    
+    plan = lookup_country_code(number_without_plus)
+    if plan is None:
+        return False, "Phone number does not start with a valid country code"
+    
+    # Check the national number length allowed for that country
+    code, min_length, max_length = plan
+    national_length = len(number_without_plus) - len(code)
+    if national_length < min_length or national_length > max_length:
+        if min_length == max_length:
+            return False, f"Numbers with country code +{code} must have {min_length} digits after it"
+        return False, f"Numbers with country code +{code} must have {min_length} to {max_length} digits after it"
         
     return True, cleaned_number
 
+def normalize_phone_numbers(phone_numbers: Iterable[str]) -> List[Tuple[bool, str]]:
+    """
+    Validate and format many phone numbers at once.
+    
+    Args:
+        phone_numbers: The phone numbers to validate
+        
+    Returns:
+        List of (valid, formatted number or error message) tuples in input order
+    """
+    # Bulk inputs tend to repeat numbers, so each distinct one is checked once
+    results = {}
+    validate = validate_phone_number
+    phone_numbers = list(phone_numbers)
+    for phone_number in phone_numbers:
+        if phone_number not in results:
+            results[phone_number] = validate(phone_number)
+    return [results[phone_number] for phone_number in phone_numbers]
+
 def format_verification_code(code: str) -> Tuple[bool, str]:
     """
     Format verification code by removing spaces and non-digits.
@@ -63,3 +193,23 @@ def safe_str(value) -> str:
         String representation or 'Not set' if None
     """
     return str(value) if value is not None else 'Not set'
+
+def make_qr_png(data: str) -> Optional[io.BytesIO]:
+    """
+    Render data as a QR code image.
+    
+    Args:
+        data: Text to encode, e.g. a tg://login URL
+        
+    Returns:
+        A PNG file object ready to be sent as a photo, or None if the
+        optional qrcode package (with Pillow) is not installed
+    """
+    if qrcode is None:
+        return None
+    image = qrcode.make(data, box_size=8, border=2)
+    buffer = io.BytesIO()
+    image.save(buffer)
+    buffer.name = 'qr_login.png'
+    buffer.seek(0)
+    return buffer
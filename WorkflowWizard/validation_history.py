@@ -0,0 +1,155 @@
+"""
+Compact history of a saved session's validation checks.
+
+Each saved session keeps a ring buffer of its last CHECK_HISTORY_SIZE checks
+(time, outcome, latency) in one bytearray: an 8-byte header followed by
+7-byte records. The header carries running counts of valid and failed checks
+in the buffer and the time of the last failure, so uptime and last failure
+are read in O(1) and updated in O(1) when a check overwrites the oldest one.
+
+The buffer travels with the session in the session store as base64 text
+(under 'checks'), so it is persisted and deleted together with the session.
+"""
+import os
+import time
+import base64
+import struct
+
+# Checks remembered per session (at most 255)
+CHECK_HISTORY_SIZE = min(255, int(os.environ.get("CHECK_HISTORY_SIZE", 32)))
+
+# Check outcomes
+VALID = 1
+UNAUTHORIZED = 2
+REVOKED = 3
+# The check itself failed (network, server); not a verdict on the session
+ERROR = 4
+
+FAILURES = (UNAUTHORIZED, REVOKED)
+
+# head (next slot), count, valid checks, failed checks, last failure (unix time)
+_HEADER = struct.Struct('<BBBBI')
+# unix time, outcome, latency in milliseconds
+_RECORD = struct.Struct('<IBH')
+
+_MAX_LATENCY_MS = 0xFFFF
+
+
+class CheckHistory:
+    """Ring buffer of a session's recent checks"""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, size=CHECK_HISTORY_SIZE, data=None):
+        """
+        Args:
+            size: Capacity of a new, empty history
+            data: Existing buffer to wrap instead (see to_text/from_text)
+        """
+        if data is None:
+            data = bytearray(_HEADER.size + size * _RECORD.size)
+        self._data = data
+
+    @classmethod
+    def from_text(cls, text, size=CHECK_HISTORY_SIZE):
+        """
+        Load a history saved with to_text().
+
+        Returns:
+            The history, or an empty one if text is empty or unreadable
+        """
+        if text:
+            try:
+                data = bytearray(base64.b64decode(text))
+            except ValueError:
+                data = None
+            if data and (len(data) - _HEADER.size) % _RECORD.size == 0 and len(data) > _HEADER.size:
+                return cls(data=data)
+        return cls(size)
+
+    def to_text(self):
+        """Encode the history for the session store"""
+        return base64.b64encode(self._data).decode('ascii')
+
+    @property
+    def capacity(self):
+        return (len(self._data) - _HEADER.size) // _RECORD.size
+
+    def record(self, outcome, latency, when=None):
+        """
+        Add a check, overwriting the oldest one when the buffer is full.
+
+        Args:
+            outcome: VALID, UNAUTHORIZED, REVOKED or ERROR
+            latency: Seconds the check took
+            when: Unix time of the check, now by default
+        """
+        when = int(when if when is not None else time.time())
+        head, count, valid, failed, last_failure = _HEADER.unpack_from(self._data)
+        offset = _HEADER.size + head * _RECORD.size
+        if count == self.capacity:
+            # Take the overwritten check out of the running counts
+            _, old, _ = _RECORD.unpack_from(self._data, offset)
+            valid -= old == VALID
+            failed -= old in FAILURES
+        else:
+            count += 1
+        valid += outcome == VALID
+        if outcome in FAILURES:
+            failed += 1
+            last_failure = when
+        latency_ms = min(_MAX_LATENCY_MS, max(0, round(latency * 1000)))
+        _RECORD.pack_into(self._data, offset, when, outcome, latency_ms)
+        _HEADER.pack_into(self._data, 0, (head + 1) % self.capacity, count, valid, failed, last_failure)
+
+    def __len__(self):
+        return self._data[1]
+
+    def uptime(self):
+        """
+        Share of checks with a verdict that found the session valid.
+
+        Returns:
+            A fraction between 0 and 1, or None if no check reached a verdict
+        """
+        _, _, valid, failed, _ = _HEADER.unpack_from(self._data)
+        return valid / (valid + failed) if valid + failed else None
+
+    def last_failure(self):
+        """Unix time of the last check that found the session invalid, or None"""
+        last_failure = _HEADER.unpack_from(self._data)[4]
+        return last_failure or None
+
+    def checks(self):
+        """
+        All remembered checks, oldest first.
+
+        Returns:
+            List of (unix time, outcome, latency in seconds)
+        """
+        head, count = self._data[0], self._data[1]
+        start = (head - count) % self.capacity
+        result = []
+        for i in range(count):
+            offset = _HEADER.size + (start + i) % self.capacity * _RECORD.size
+            when, outcome, latency_ms = _RECORD.unpack_from(self._data, offset)
+            result.append((when, outcome, latency_ms / 1000))
+        return result
+
+
+def describe(history):
+    """
+    One-line summary for the session details screen.
+
+    Returns:
+        Text such as "92% valid over 12 checks, last failure 2024-05-01 10:00"
+    """
+    if not len(history):
+        return "not checked yet"
+    uptime = history.uptime()
+    uptime_text = f"{uptime:.0%}" if uptime is not None else "n/a"
+    last_failure = history.last_failure()
+    if last_failure is None:
+        return f"{uptime_text} valid over {len(history)} checks, no failures"
+    failed_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_failure))
+    return f"{uptime_text} valid over {len(history)} checks, last failure {failed_at}"